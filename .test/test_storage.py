@@ -0,0 +1,322 @@
+"""
+Storage contract: the same Storage calls are made against Database (SQLite)
+and PostgresDatabase, each scenario checks what any backend must do and
+returns a trace of the results, and the traces of the two backends have to be
+equal.
+
+PostgreSQL cases need TEST_POSTGRES_URL pointing to a throwaway database,
+everything in it is dropped before every case. Without it they are skipped.
+Run from the repository root: python -m pytest .test
+"""
+
+from datetime import date, datetime, timedelta
+from modules.libraries.dbms import Database
+from modules.libraries.models import Row
+from modules.libraries.postgres import PostgresDatabase
+from modules.libraries.storage import current_actor
+import asyncio, os, pytest, time
+
+POSTGRES_URL = os.getenv("TEST_POSTGRES_URL")
+needs_postgres = pytest.mark.skipif(
+    not POSTGRES_URL, reason="set TEST_POSTGRES_URL to a throwaway PostgreSQL database"
+)
+BACKENDS = ["sqlite", pytest.param("postgres", marks=needs_postgres)]
+# Set by the backend, only whether they are set is compared
+VOLATILE = {"created_at", "completed_at", "calendar_token", "updated_at"}
+
+OWNER, MEMBER, STRANGER = 101, 202, 303
+TODAY = date.today()
+
+
+def day(offset: int) -> str:
+    return (TODAY + timedelta(days=offset)).strftime("%Y-%m-%d")
+
+
+def plain(value, name: str = ""):
+    # Models and containers as comparable plain values
+    if name in VOLATILE or isinstance(value, datetime):
+        return value is not None
+    if isinstance(value, Row):
+        return {slot: plain(getattr(value, slot), slot) for slot in value.__slots__}
+    if isinstance(value, dict):
+        return {key: plain(item, key) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [plain(item) for item in value]
+    return value
+
+
+async def reset_postgres(dsn: str) -> None:
+    import asyncpg
+
+    connection = await asyncpg.connect(dsn)
+    try:
+        await connection.execute(
+            "DROP SCHEMA IF EXISTS archive CASCADE; "
+            "DROP SCHEMA IF EXISTS public CASCADE; CREATE SCHEMA public"
+        )
+    finally:
+        await connection.close()
+
+
+def run(backend: str, tmp_path, scenario):
+    async def main():
+        if backend == "postgres":
+            await reset_postgres(POSTGRES_URL)
+            db = PostgresDatabase(POSTGRES_URL)
+        else:
+            db = Database(str(tmp_path / "storage.db"))
+        await db.connect()
+        await db.create_tables()
+        try:
+            return plain(await scenario(db))
+        finally:
+            await db.close()
+
+    return asyncio.run(main())
+
+
+async def add_users(db) -> None:
+    for user_id in (OWNER, MEMBER, STRANGER):
+        assert await db.add_user(user_id, f"user{user_id}")
+
+
+async def add_project(db, user_id: int, name: str) -> int:
+    assert await db.new_project(user_id, name, f"{name} description")
+    return next(p.id for p in await db.fetch_projects(user_id) if p.name == name)
+
+
+async def add_task(db, project_id: int, name: str, deadline: str, priority=3) -> int:
+    assert await db.new_task(
+        OWNER, project_id, name, f"{name} description", deadline, priority
+    )
+    return next(t.id for t in await db.fetch_tasks(project_id) if t.name == name)
+
+
+async def users(db) -> list:
+    await add_users(db)
+    assert await db.update_user_names([(OWNER, "renamed")])
+    assert (await db.fetch_user_by_name("renamed")).user_id == OWNER
+    assert await db.fetch_user_by_name("nobody") is None
+    assert await db.fetch_user(404) is None
+    before = await db.fetch_notification_settings(MEMBER)
+    assert await db.set_notification_settings(MEMBER, notifications=False)
+    assert await db.set_notification_settings(MEMBER, digest=False)
+    return [
+        await db.fetch_user(OWNER),
+        sorted(await db.fetch_user_ids()),
+        before,
+        await db.fetch_notification_settings(MEMBER),
+    ]
+
+
+async def projects_and_tasks(db) -> list:
+    await add_users(db)
+    project_id = await add_project(db, OWNER, "home")
+    assert await db.edit_project(OWNER, "home", "house", "new description")
+    first = await add_task(db, project_id, "paint", day(3), priority=1)
+    second = await add_task(db, project_id, "clean", day(5))
+    third = await add_task(db, project_id, "fix", day(7))
+    assert await db.user_has_tasks(OWNER)
+    assert not await db.user_has_tasks(MEMBER)
+    assert await db.add_subtask(first, "buy paint")
+    assert await db.add_subtasks(second, ["kitchen", "bath"])
+    assert await db.user_has_subtasks(OWNER)
+    subtasks = await db.fetch_subtasks(project_id)
+    assert await db.edit_subtask(subtasks[0].id)
+    assert await db.edit_task(first, 1)
+    edited = await db.edit_tasks(OWNER, 1, task_ids=[second, third])
+    # Tasks of somebody else's project are skipped
+    assert await db.edit_tasks(STRANGER, 0, task_ids=[second]) == []
+    reopened = await db.edit_tasks(OWNER, 0, project_id=project_id)
+    completed = await db.edit_subtasks(
+        OWNER, project_id=project_id, complete_tasks=True
+    )
+    assert await db.delete_subtask(subtasks[-1].id)
+    assert await db.remove_task(third)
+    assert await db.fetch_task(third) is None
+    return [
+        await db.fetch_projects(OWNER),
+        await db.fetch_project(project_id),
+        sorted(edited),
+        sorted(reopened),
+        completed,
+        await db.fetch_tasks(project_id),
+        await db.fetch_task(first),
+        await db.fetch_subtasks(project_id),
+        await db.fetch_subtask(subtasks[0].id),
+    ]
+
+
+async def sharing_and_calendar(db) -> list:
+    await add_users(db)
+    project_id = await add_project(db, OWNER, "shared")
+    await add_task(db, project_id, "meet", day(2))
+    versions = [await db.fetch_calendar_version(MEMBER)]
+    assert await db.add_shared_project(project_id, MEMBER)
+    versions.append(await db.fetch_calendar_version(MEMBER))
+    assert await db.check_project_member(project_id, MEMBER)
+    assert not await db.check_project_member(project_id, STRANGER)
+    token = await db.fetch_calendar_token(MEMBER)
+    assert token and token == await db.fetch_calendar_token(MEMBER)
+    assert await db.fetch_user_by_calendar_token(token) == MEMBER
+    assert await db.fetch_user_by_calendar_token("unknown") is None
+    tasks = [task async for task in db.iter_calendar_tasks(MEMBER)]
+    other = await add_project(db, OWNER, "other")
+    owner_version = await db.fetch_calendar_version(OWNER)
+    assert await db.delete_project(other)
+    versions.append(await db.fetch_calendar_version(OWNER))
+    # The version only ever grows, the validator must not repeat
+    assert int(versions[-1][0]) > int(owner_version[0])
+    assert int(versions[1][0]) > int(versions[0][0])
+    return [
+        await db.fetch_shared_projects(MEMBER),
+        await db.fetch_shared_projects(STRANGER),
+        tasks,
+        [version for version, _ in versions],
+    ]
+
+
+async def schedule(db) -> list:
+    await add_users(db)
+    project_id = await add_project(db, OWNER, "routine")
+    daily = await add_task(db, project_id, "walk", day(1), priority=2)
+    await add_task(db, project_id, "report", day(1), priority=1)
+    await add_task(db, project_id, "later", day(20), priority=5)
+    assert await db.set_notification_settings(OWNER, digest=True)
+    assert await db.set_task_recurrence(daily, "daily")
+    assert await db.edit_task(daily, 1)
+    advanced = await db.fetch_task(daily)
+    assert advanced.status == "in progress" and advanced.deadline == day(2)
+    # A weekly task missed a month ago moves past today, not one week on
+    missed = await add_task(db, project_id, "water", day(-28))
+    assert await db.set_task_recurrence(missed, "weekly")
+    assert await db.edit_tasks(OWNER, 1, task_ids=[missed]) == [missed]
+    assert (await db.fetch_task(missed)).deadline == day(7)
+    return [
+        advanced,
+        await db.fetch_tasks_by_day(OWNER, TODAY + timedelta(days=1)),
+        await db.fetch_tasks_by_day(OWNER, TODAY + timedelta(days=4)),
+        await db.fetch_next_tasks(OWNER, 2),
+        await db.fetch_deadline_counts(OWNER, TODAY, TODAY + timedelta(days=3)),
+        await db.fetch_digest_tasks(TODAY + timedelta(days=1)),
+    ]
+
+
+async def overdue(db) -> list:
+    await add_users(db)
+    project_id = await add_project(db, OWNER, "late")
+    await add_task(db, project_id, "old", day(-10))
+    await add_task(db, project_id, "yesterday", day(-1))
+    await add_task(db, project_id, "today", day(0))
+    done = await add_task(db, project_id, "done", day(-2))
+    assert await db.edit_task(done, 1)
+    # Nobody is notified about the quiet project, its tasks are only flagged
+    assert await db.set_notification_settings(STRANGER, notifications=False)
+    quiet_id = await add_project(db, STRANGER, "quiet")
+    assert await db.new_task(STRANGER, quiet_id, "quiet", "quiet", day(-3), 3)
+    found = await db.fetch_new_overdue_tasks(day(0))
+    assert list(found) == [OWNER]
+    # Overdue after the fetch: not flagged before it has been notified about
+    late = await add_task(db, project_id, "late", day(-4))
+    task_ids = [task.id for task in found[OWNER]]
+    assert await db.mark_overdue(day(0), task_ids, 1) == 3
+    assert [task.id for task in (await db.fetch_new_overdue_tasks(day(0)))[OWNER]] == [
+        late
+    ]
+    assert await db.mark_overdue(day(0), task_ids, 1) == 0
+    assert await db.mark_overdue(day(0), [late], 1) == 1
+    assert await db.fetch_new_overdue_tasks(day(0)) == {}
+    return [
+        found,
+        await db.fetch_tasks(project_id),
+        await db.fetch_tasks(quiet_id),
+    ]
+
+
+async def outbox_and_watermarks(db) -> list:
+    now = time.time()
+    assert await db.fetch_watermark("digest") is None
+    assert await db.set_watermark("digest", day(0))
+    assert await db.set_watermark("digest", day(1))
+    assert await db.enqueue_notifications(
+        [
+            ("a", OWNER, "first", now - 2),
+            ("b", MEMBER, "second", now - 1),
+            ("c", OWNER, "later", now + 3600),
+        ]
+    )
+    # The key makes enqueueing idempotent
+    assert await db.enqueue_notifications([("a", OWNER, "first again", now - 2)])
+    batch = await db.fetch_outbox_batch(10)
+    assert [entry["idempotency_key"] for entry in batch] == ["a", "b"]
+    assert await db.mark_outbox_sent(batch[0]["id"])
+    assert await db.mark_outbox_retry(batch[1]["id"], now + 60, "429")
+    assert await db.fetch_outbox_batch(10) == []
+    return [
+        await db.fetch_watermark("digest"),
+        batch,
+        await db.prune_outbox(now + 1),
+    ]
+
+
+async def change_log(db) -> list:
+    await add_users(db)
+    project_id = await add_project(db, OWNER, "team")
+    assert await db.add_shared_project(project_id, MEMBER)
+    start = await db.fetch_last_change_seq()
+    token = current_actor.set(OWNER)
+    try:
+        task_id = await add_task(db, project_id, "plan", day(4))
+        assert await db.add_subtask(task_id, "draft")
+        assert await db.edit_task(task_id, 1)
+    finally:
+        current_actor.reset(token)
+    last = await db.fetch_last_change_seq()
+    changes = await db.fetch_changes(start, 100)
+    assert [change.seq for change in changes] == sorted(c.seq for c in changes)
+    return [
+        [{**plain(change), "seq": None} for change in changes],
+        len(await db.fetch_changes(start, 1)),
+        await db.fetch_change_fanout(start, last),
+        await db.prune_changes(time.time() + 60, 100) >= 0,
+    ]
+
+
+async def archive(db) -> list:
+    await add_users(db)
+    project_id = await add_project(db, OWNER, "finished")
+    kept = await add_task(db, project_id, "open", day(1))
+    for name in ("one", "two", "three"):
+        assert await db.edit_task(await add_task(db, project_id, name, day(-1)), 1)
+    # completed_at has a one second resolution
+    await asyncio.sleep(1.1)
+    assert await db.archive_tasks(0, 2) == 3
+    assert [task.id for task in await db.fetch_tasks(project_id)] == [kept]
+    archived = await db.fetch_archived_tasks(OWNER, 2)
+    rest = await db.fetch_archived_tasks(OWNER, 2, offset=2)
+    assert len(archived) == 2 and len(rest) == 1
+    return [archived, rest, await db.fetch_archived_tasks(MEMBER, 10)]
+
+
+SCENARIOS = [
+    users,
+    projects_and_tasks,
+    sharing_and_calendar,
+    schedule,
+    overdue,
+    outbox_and_watermarks,
+    change_log,
+    archive,
+]
+
+
+@pytest.mark.parametrize("scenario", SCENARIOS, ids=lambda s: s.__name__)
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_contract(backend, scenario, tmp_path):
+    run(backend, tmp_path, scenario)
+
+
+@needs_postgres
+@pytest.mark.parametrize("scenario", SCENARIOS, ids=lambda s: s.__name__)
+def test_backends_agree(scenario, tmp_path):
+    assert run("postgres", tmp_path, scenario) == run("sqlite", tmp_path, scenario)
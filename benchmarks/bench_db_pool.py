@@ -0,0 +1,96 @@
+"""
+Mixed read/write throughput of Database as the reader pool grows.
+
+Run from the repository root: python -m benchmarks.bench_db_pool
+"""
+
+from modules.libraries.dbms import Database
+import argparse, asyncio, os, random, statistics, tempfile, time
+
+
+async def seed(db: Database, projects: int, tasks: int) -> list:
+    await db.create_tables()
+    await db.add_user(1, "bench")
+    for index in range(projects):
+        await db.new_project(1, f"project {index}", "bench")
+    project_ids = [project.id for project in await db.fetch_projects(1)]
+    for project_id in project_ids:
+        for index in range(tasks):
+            await db.new_task(
+                1, project_id, f"task {index}", "bench", "2030-01-01", index % 5 + 1
+            )
+    return project_ids
+
+
+async def run(path: str, readers: int, duration: float, clients: int, writers: int):
+    db = Database(path, readers=readers)
+    project_ids = [project.id for project in await db.fetch_projects(1)]
+    task_ids = [task.id for task in await db.fetch_tasks(project_ids[0])]
+    latencies = []
+    counts = {"read": 0, "write": 0}
+    # Reads each client got done: an unfair pool lets a few clients starve
+    # the others, whose waits barely show in the percentiles
+    client_reads = [0] * clients
+    deadline = time.perf_counter() + duration
+
+    async def reader(client: int):
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            await db.fetch_tasks(random.choice(project_ids))
+            latencies.append(time.perf_counter() - started)
+            counts["read"] += 1
+            client_reads[client] += 1
+
+    async def writer():
+        while time.perf_counter() < deadline:
+            await db.edit_task(random.choice(task_ids), random.randint(0, 1))
+            counts["write"] += 1
+
+    await asyncio.gather(
+        *(reader(client) for client in range(clients)),
+        *(writer() for _ in range(writers)),
+    )
+    await db.close()
+
+    latencies.sort()
+    return (
+        counts["read"] / duration,
+        counts["write"] / duration,
+        statistics.median(latencies) * 1000,
+        latencies[int(len(latencies) * 0.99)] * 1000,
+        latencies[-1] * 1000,
+        min(client_reads),
+    )
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--writers", type=int, default=2)
+    parser.add_argument("--projects", type=int, default=50)
+    parser.add_argument("--tasks", type=int, default=40)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "bench.db")
+        db = Database(path)
+        await seed(db, args.projects, args.tasks)
+        await db.close()
+
+        print(
+            f"{'readers':>8} {'reads/s':>10} {'writes/s':>10} {'p50 ms':>8} {'p99 ms':>8} "
+            f"{'max ms':>8} {'min reads':>10}"
+        )
+        for readers in (1, 2, 4, 8):
+            reads, writes, p50, p99, worst, fewest = await run(
+                path, readers, args.duration, args.clients, args.writers
+            )
+            print(
+                f"{readers:>8} {reads:>10.0f} {writes:>10.0f} {p50:>8.2f} {p99:>8.2f} "
+                f"{worst:>8.2f} {fewest:>10}"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,112 @@
+"""
+Event-loop time spent logging per update: the synchronous FileHandler main.py
+used to attach versus the queued pipeline of modules.libraries.logs, with and
+without per-module levels and sampling.
+
+Updates arrive with a short idle gap, the time a bot spends waiting on the
+network, in which the queue's writer thread gets to run.
+
+Run from the repository root: python -m benchmarks.bench_logging
+"""
+
+from modules.libraries.logs import LOG_DATE_FORMAT, LOG_FORMAT, setup_logging
+import argparse, glob, logging, os, statistics, tempfile, time
+
+
+def update(index: int) -> None:
+    # The lines a /projects update logs: aiogram's, the handler's and the
+    # database layer's. They are logged from this file, so sampling
+    # "benchmarks" stands in for sampling the database modules.
+    logging.getLogger("aiogram.event").info(
+        f"Update id={index} is handled. Duration 3 ms by bot id=1"
+    )
+    logging.info(f"Fetched projects for user with id {index}")
+    logging.info(f"Fetched shared projects for user with id {index}")
+    for project_id in range(3):
+        logging.info(f"Fetched all tasks for project with id {project_id}")
+    logging.info(f"User {index} opened the projects list")
+
+
+def reset() -> None:
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+    logging.getLogger("aiogram.event").setLevel(logging.NOTSET)
+
+
+def measure(updates: int, gap: float) -> list:
+    samples = []
+    for index in range(updates):
+        started = time.perf_counter()
+        update(index)
+        samples.append(time.perf_counter() - started)
+        time.sleep(gap)
+    return samples
+
+
+def written(directory: str, name: str) -> str:
+    # Rotated files included
+    size = sum(
+        os.path.getsize(path)
+        for path in glob.glob(os.path.join(directory, f"{name}.log*"))
+    )
+    return f"{size / 1024:.0f} KiB written"
+
+
+def report(name: str, samples: list, drain: float, extra: str = "") -> None:
+    samples.sort()
+    print(
+        f"{name:>16} {statistics.mean(samples) * 1e6:>10.1f} "
+        f"{samples[int(len(samples) * 0.99)] * 1e6:>10.1f} {drain * 1000:>9.1f} {extra}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--gap", type=float, default=0.0005)
+    args = parser.parse_args()
+
+    print(f"{'setup':>16} {'mean us':>10} {'p99 us':>10} {'drain ms':>9}")
+    with tempfile.TemporaryDirectory() as directory, open(os.devnull, "w") as null:
+        # What setup_logging in main.py used to attach
+        reset()
+        handlers = [
+            logging.FileHandler(os.path.join(directory, "file.log")),
+            logging.StreamHandler(null),
+        ]
+        logging.basicConfig(
+            level=logging.INFO,
+            format=LOG_FORMAT,
+            datefmt=LOG_DATE_FORMAT,
+            handlers=handlers,
+            force=True,
+        )
+        report("file", measure(args.updates, args.gap), 0.0, written(directory, "file"))
+
+        for name, levels, sampling in (
+            ("queued", None, None),
+            ("queued+levels", {"aiogram.event": "WARNING"}, None),
+            ("queued+sampled", {"aiogram.event": "WARNING"}, {"benchmarks": 10}),
+        ):
+            reset()
+            listener = setup_logging(
+                directory,
+                filename=f"{name}.log",
+                levels=levels,
+                sampling=sampling,
+                queue_size=args.updates * 8,
+                stream=null,
+            )
+            samples = measure(args.updates, args.gap)
+            # The writer thread catches up after the updates, off the loop
+            started = time.perf_counter()
+            listener.stop()
+            drain = time.perf_counter() - started
+            report(name, samples, drain, written(directory, name))
+        reset()
+
+
+if __name__ == "__main__":
+    main()
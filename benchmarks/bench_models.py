@@ -0,0 +1,105 @@
+"""
+Memory and load time of 100k tasks as hand-built dicts versus slotted Task rows.
+
+Run from the repository root: python -m benchmarks.bench_models
+"""
+
+from modules.libraries.dbms import Database, _SQL
+import argparse, asyncio, gc, os, statistics, tempfile, time, tracemalloc
+
+
+async def seed(db: Database, tasks: int) -> int:
+    await db.create_tables()
+    await db.add_user(1, "bench")
+    await db.new_project(1, "bench", "bench")
+    project_id = (await db.fetch_projects(1))[0].id
+    async with db._write() as conn:
+        await conn.executemany(
+            _SQL.INSERT_TASK,
+            (
+                (project_id, f"task {index}", "bench", "2030-01-01", index % 5 + 1)
+                for index in range(tasks)
+            ),
+        )
+        await conn.commit()
+    return project_id
+
+
+async def load_dicts(db: Database, project_id: int) -> list:
+    # What fetch_tasks used to do
+    async with db._read() as conn:
+        async with conn.cursor() as cursor:
+            await cursor.execute(_SQL.SELECT_TASKS, (project_id,))
+            return [
+                {
+                    "id": row[0],
+                    "name": row[1],
+                    "description": row[2],
+                    "deadline": row[3],
+                    "priority": row[4],
+                    "status": row[5],
+                    "recurrence": row[6],
+                    "overdue": row[7],
+                }
+                for row in await cursor.fetchall()
+            ]
+
+
+async def load_models(db: Database, project_id: int) -> list:
+    return await db.fetch_tasks(project_id)
+
+
+async def timings(loaders: dict, db: Database, project_id: int, rounds: int) -> dict:
+    # Rounds alternate between the loaders, first one then the other going
+    # first, so a slow stretch of the machine or a warm cache falls on both
+    timings = {name: [] for name in loaders}
+    for index in range(rounds):
+        order = list(loaders.items())
+        for name, loader in order if index % 2 == 0 else reversed(order):
+            started = time.perf_counter()
+            await loader(db, project_id)
+            timings[name].append(time.perf_counter() - started)
+    return timings
+
+
+async def retained(loader, db: Database, project_id: int) -> tuple:
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    rows = await loader(db, project_id)
+    size = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return len(rows), size
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--tasks", type=int, default=100_000)
+    parser.add_argument("--rounds", type=int, default=11)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        db = Database(os.path.join(directory, "bench.db"), readers=1)
+        project_id = await seed(db, args.tasks)
+
+        loaders = {"dict": load_dicts, "slots": load_models}
+        measured = await timings(loaders, db, project_id, args.rounds)
+        print(
+            f"{'format':>8} {'rows/s':>10} {'ms':>8} {'vs dict':>8} {'MiB':>8} {'B/row':>7}"
+        )
+        for name, loader in loaders.items():
+            count, memory = await retained(loader, db, project_id)
+            elapsed = statistics.median(measured[name])
+            # Median of the per-round ratios, robust to drift between rounds
+            ratio = statistics.median(
+                ours / theirs for ours, theirs in zip(measured[name], measured["dict"])
+            )
+            print(
+                f"{name:>8} {count / elapsed:>10.0f} {elapsed * 1000:>8.1f} "
+                f"{ratio:>8.2f} {memory / 2**20:>8.1f} {memory / count:>7.0f}"
+            )
+        await db.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
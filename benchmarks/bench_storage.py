@@ -0,0 +1,124 @@
+"""
+Throughput and latency of the SQLite and PostgreSQL storage backends under the
+same concurrent mix of reads and writes.
+
+Run from the repository root: python -m benchmarks.bench_storage
+PostgreSQL is measured when a DSN is given (needs asyncpg), e.g.
+python -m benchmarks.bench_storage --postgres postgresql://localhost/prodigy_bench
+The PostgreSQL database should be empty, the benchmark creates its tables there.
+"""
+
+from datetime import date
+from modules.libraries.dbms import Database
+from modules.libraries.postgres import PostgresDatabase
+from modules.libraries.storage import Storage
+import argparse, asyncio, logging, os, random, statistics, tempfile, time
+
+
+async def seed(db: Storage, users: int, tasks: int) -> dict:
+    # user_id -> (project_id, task ids)
+    await db.create_tables()
+    seeded = {}
+    for user_id in range(1, users + 1):
+        await db.add_user(user_id, f"bench{user_id}")
+        await db.new_project(user_id, "bench", "bench")
+        project_id = (await db.fetch_projects(user_id))[0].id
+        for index in range(tasks):
+            await db.new_task(
+                user_id,
+                project_id,
+                f"task {index}",
+                "bench",
+                f"2030-01-{index % 28 + 1:02d}",
+                index % 5 + 1,
+            )
+        seeded[user_id] = (
+            project_id,
+            [task.id for task in await db.fetch_tasks(project_id)],
+        )
+    return seeded
+
+
+async def run(db: Storage, seeded: dict, duration: float, clients: int) -> dict:
+    latencies = {"read": [], "write": []}
+    deadline = time.perf_counter() + duration
+
+    async def client():
+        while time.perf_counter() < deadline:
+            user_id = random.choice(list(seeded))
+            project_id, task_ids = seeded[user_id]
+            # Roughly what the bot sees: mostly lists and calendars, some edits
+            operation = random.random()
+            started = time.perf_counter()
+            if operation < 0.5:
+                await db.fetch_tasks(project_id)
+                kind = "read"
+            elif operation < 0.7:
+                await db.fetch_tasks_by_day(
+                    user_id, date(2030, 1, random.randint(1, 28))
+                )
+                kind = "read"
+            elif operation < 0.8:
+                await db.fetch_shared_projects(user_id)
+                kind = "read"
+            elif operation < 0.95:
+                await db.edit_tasks(
+                    user_id, random.randint(0, 1), task_ids=random.sample(task_ids, 5)
+                )
+                kind = "write"
+            else:
+                await db.add_subtasks(random.choice(task_ids), ["a", "b", "c"])
+                kind = "write"
+            latencies[kind].append(time.perf_counter() - started)
+
+    await asyncio.gather(*(client() for _ in range(clients)))
+
+    results = {}
+    for kind, samples in latencies.items():
+        samples.sort()
+        results[kind] = (
+            len(samples) / duration,
+            statistics.median(samples) * 1000,
+            samples[int(len(samples) * 0.99)] * 1000,
+        )
+    return results
+
+
+async def bench(name: str, db: Storage, args) -> None:
+    seeded = await seed(db, args.users, args.tasks)
+    for clients in (1, 8, 32, 128):
+        results = await run(db, seeded, args.duration, clients)
+        for kind, (rate, p50, p99) in results.items():
+            print(
+                f"{name:>10} {clients:>8} {kind:>6} {rate:>10.0f} {p50:>8.2f} {p99:>8.2f}"
+            )
+    await db.close()
+
+
+async def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--duration", type=float, default=5)
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--tasks", type=int, default=40)
+    parser.add_argument("--postgres", default=os.getenv("BENCH_POSTGRES_DSN"))
+    parser.add_argument("--pool-size", type=int, default=10)
+    args = parser.parse_args()
+    logging.disable(logging.INFO)
+
+    print(
+        f"{'backend':>10} {'clients':>8} {'kind':>6} {'ops/s':>10} {'p50 ms':>8} {'p99 ms':>8}"
+    )
+    with tempfile.TemporaryDirectory() as directory:
+        await bench("sqlite", Database(os.path.join(directory, "bench.db")), args)
+    if args.postgres:
+        await bench(
+            "postgres",
+            PostgresDatabase(args.postgres, max_size=args.pool_size),
+            args,
+        )
+    else:
+        print("PostgreSQL skipped, pass --postgres or set BENCH_POSTGRES_DSN")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,218 @@
+"""
+A local stand-in for the Telegram Bot API, for load tests without network
+access. It serves getMe, getUpdates, sendMessage, editMessageText and
+answerCallbackQuery, can answer a share of calls with 429 Too Many Requests
+and delays every call by a configurable latency.
+
+Tests push user messages and button presses with push_message and
+push_callback and read what the bot sent with next_reply. main.py talks to
+it when TELEGRAM_API_URL points at the server, see benchmarks/load_bot.py.
+"""
+
+from aiohttp import web
+from collections import Counter
+import asyncio, random, time
+
+BOT_ID = 100000
+BOT_USERNAME = "prodigy_load_bot"
+
+
+class FakeTelegram:
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        rate_limit: float = 0.0,
+        retry_after: int = 1,
+    ):
+        self._host = host
+        self._port = port
+        # Seconds added to every call but getUpdates, plus up to jitter more
+        self._latency = latency
+        self._jitter = jitter
+        # Share of sendMessage and editMessageText calls answered with 429
+        self._rate_limit = rate_limit
+        self._retry_after = retry_after
+        self._runner = None
+        self._updates = []
+        self._update_id = 0
+        self._message_id = 0
+        self._new_updates = asyncio.Event()
+        self._replies = {}
+        self.calls = Counter()
+        self.rate_limited = 0
+
+    @property
+    def url(self) -> str:
+        return f"http://{self._host}:{self._port}"
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_route("*", "/bot{token}/{method}", self._handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self._host, self._port)
+        await site.start()
+        # Port 0 picks a free port
+        self._port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self) -> None:
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
+
+    # What users do
+
+    def push_message(self, user_id: int, text: str) -> None:
+        message = self._message(user_id, text, sender=self._user(user_id))
+        if text.startswith("/"):
+            command = text.split()[0]
+            message["entities"] = [
+                {"type": "bot_command", "offset": 0, "length": len(command)}
+            ]
+        self._push({"message": message})
+
+    def push_callback(self, user_id: int, data: str) -> None:
+        self._push(
+            {
+                "callback_query": {
+                    "id": str(self._next_update_id()),
+                    "from": self._user(user_id),
+                    "chat_instance": str(user_id),
+                    "data": data,
+                    "message": self._message(user_id, "menu", sender=self._bot()),
+                }
+            }
+        )
+
+    async def next_reply(self, chat_id: int, timeout: float) -> dict:
+        # The next message the bot sent or edited in the chat
+        return await asyncio.wait_for(self._inbox(chat_id).get(), timeout)
+
+    def forget(self, chat_id: int) -> None:
+        # Drops the chat's replies once its user is gone
+        self._replies.pop(chat_id, None)
+
+    def clear_replies(self, chat_id: int) -> None:
+        inbox = self._inbox(chat_id)
+        while not inbox.empty():
+            inbox.get_nowait()
+
+    # The Bot API
+
+    async def _handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"].lower()
+        params = await self._params(request)
+        self.calls[method] += 1
+
+        if method == "getupdates":
+            return self._ok(await self._get_updates(params))
+
+        delay = self._latency + random.random() * self._jitter
+        if delay:
+            await asyncio.sleep(delay)
+
+        if method in ("sendmessage", "editmessagetext"):
+            if random.random() < self._rate_limit:
+                self.rate_limited += 1
+                return self._error(
+                    429,
+                    f"Too Many Requests: retry after {self._retry_after}",
+                    {"retry_after": self._retry_after},
+                )
+            chat_id = int(params["chat_id"])
+            message = self._message(chat_id, params.get("text", ""), sender=self._bot())
+            if method == "editmessagetext":
+                message["message_id"] = int(params.get("message_id") or 0)
+                message["edit_date"] = message["date"]
+            self._inbox(chat_id).put_nowait(message)
+            return self._ok(message)
+
+        if method == "getme":
+            return self._ok(self._bot())
+        if method in ("answercallbackquery", "deletewebhook", "setmycommands"):
+            return self._ok(True)
+        return self._error(404, "Not Found: method not found")
+
+    async def _get_updates(self, params: dict) -> list:
+        offset = int(params.get("offset") or 0)
+        # Confirmed updates are gone for good, as on the real server
+        self._updates = [
+            update for update in self._updates if update["update_id"] >= offset
+        ]
+        if not self._updates:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(
+                    self._new_updates.wait(), float(params.get("timeout") or 0)
+                )
+            except asyncio.TimeoutError:
+                pass
+        limit = int(params.get("limit") or 100)
+        return self._updates[:limit]
+
+    @staticmethod
+    async def _params(request: web.Request) -> dict:
+        # aiogram posts form fields, nested objects arrive JSON-encoded
+        if request.content_type == "application/json":
+            return await request.json()
+        return dict(await request.post())
+
+    # Helpers
+
+    def _push(self, update: dict) -> None:
+        update["update_id"] = self._next_update_id()
+        self._updates.append(update)
+        self._new_updates.set()
+
+    def _next_update_id(self) -> int:
+        self._update_id += 1
+        return self._update_id
+
+    def _message(self, chat_id: int, text: str, sender: dict) -> dict:
+        self._message_id += 1
+        return {
+            "message_id": self._message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": sender,
+            "text": text,
+        }
+
+    def _inbox(self, chat_id: int) -> asyncio.Queue:
+        inbox = self._replies.get(chat_id)
+        if inbox is None:
+            inbox = self._replies[chat_id] = asyncio.Queue()
+        return inbox
+
+    @staticmethod
+    def _user(user_id: int) -> dict:
+        return {
+            "id": user_id,
+            "is_bot": False,
+            "first_name": f"user{user_id}",
+            "username": f"user{user_id}",
+        }
+
+    @staticmethod
+    def _bot() -> dict:
+        return {
+            "id": BOT_ID,
+            "is_bot": True,
+            "first_name": "Prodigy",
+            "username": BOT_USERNAME,
+        }
+
+    @staticmethod
+    def _ok(result) -> web.Response:
+        return web.json_response({"ok": True, "result": result})
+
+    @staticmethod
+    def _error(code: int, description: str, parameters: dict = None) -> web.Response:
+        body = {"ok": False, "error_code": code, "description": description}
+        if parameters:
+            body["parameters"] = parameters
+        # The Bot API puts the error in the body, aiogram reads it from there
+        return web.json_response(body, status=code)
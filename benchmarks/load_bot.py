@@ -0,0 +1,273 @@
+"""
+Full-stack load test: thousands of simulated users talk to the real bot,
+router, middlewares and database through the local Bot API stand-in of
+benchmarks/fake_telegram.py, with no network access.
+
+Every user runs /start, creates a project and a task through the dialogs,
+then keeps mixing listings with new tasks until the run ends. The report has
+throughput, latency percentiles from sending an update to receiving the
+bot's reply, and the share of steps that timed out, failed, were throttled
+or shed.
+
+Run from the repository root: python -m benchmarks.load_bot
+Add --rate-limit 0.01 to have 1% of the bot's messages answered with 429.
+"""
+
+from benchmarks.fake_telegram import FakeTelegram
+from collections import Counter, defaultdict
+import argparse, asyncio, logging, os, random, re, signal, tempfile, time
+
+# Replies that mean the step failed, matched by prefix
+ERROR_REPLIES = ("Ошибка", "Что-то пошло не так", "Неверный", "Проект с таким ID")
+THROTTLED_REPLY = "Слишком много запросов"
+SHED_REPLY = "Бот сейчас перегружен"
+PROJECT_ID = re.compile(r"Project ID: (\d+)")
+# Listings a user checks between writes, with their weights
+READS = (
+    ("/projects", 4),
+    ("/next", 3),
+    ("/calendar", 2),
+    ("/archive", 1),
+    ("/help", 1),
+)
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.outcomes = defaultdict(Counter)
+
+    def record(self, step: str, outcome: str, latency: float = None) -> None:
+        self.outcomes[step][outcome] += 1
+        if latency is not None:
+            self.latencies[step].append(latency)
+
+
+class User:
+    def __init__(self, fake: FakeTelegram, stats: Stats, user_id: int, timeout: float):
+        self._fake = fake
+        self._stats = stats
+        self._timeout = timeout
+        self.user_id = user_id
+        self.project_id = None
+
+    async def send(self, step: str, text: str, expect: str = None):
+        # The bot's reply to text, or None when the step didn't go through
+        self._fake.clear_replies(self.user_id)
+        started = time.perf_counter()
+        self._fake.push_message(self.user_id, text)
+        try:
+            reply = await self._fake.next_reply(self.user_id, self._timeout)
+        except asyncio.TimeoutError:
+            self._stats.record(step, "timeout")
+            return None
+        latency = time.perf_counter() - started
+        reply = reply.get("text", "")
+        if reply.startswith(THROTTLED_REPLY):
+            outcome = "throttled"
+        elif reply.startswith(SHED_REPLY):
+            outcome = "shed"
+        elif reply.startswith(ERROR_REPLIES) or (expect and expect not in reply):
+            outcome = "error"
+        else:
+            outcome = "ok"
+        self._stats.record(step, outcome, latency)
+        return reply if outcome == "ok" else None
+
+    def leave(self) -> None:
+        self._fake.forget(self.user_id)
+
+    async def dialog(self, step: str, inputs: list) -> bool:
+        # (text, expected part of the reply) pairs, stops at the first failure
+        for text, expect in inputs:
+            if await self.send(step, text, expect) is None:
+                return False
+        return True
+
+    async def new_project(self) -> bool:
+        name = f"load {self.user_id}"
+        return await self.dialog(
+            "/new_project",
+            [
+                ("/new_project", "Введите имя проекта"),
+                (name, "Введите описание проекта"),
+                ("load test project", "Проект успешно создан"),
+            ],
+        )
+
+    async def projects(self) -> None:
+        reply = await self.send("/projects", "/projects")
+        ids = PROJECT_ID.findall(reply or "")
+        if ids:
+            self.project_id = ids[-1]
+
+    async def new_task(self) -> bool:
+        deadline = f"{random.randint(1, 28):02d}.{random.randint(1, 12):02d}.2030"
+        return await self.dialog(
+            "/new_task",
+            [
+                ("/new_task", "Введите ID проекта"),
+                (self.project_id, "Введите название таска"),
+                (f"task {random.randrange(1000)}", "Введите описание таска"),
+                ("load test task", "Введите срок выполнения"),
+                (deadline, "Выберите приоритет"),
+                (str(random.randint(1, 5)), "Таск успешно создан"),
+            ],
+        )
+
+
+async def think(mean: float, ends_at: float) -> bool:
+    # Waits like a user reading the reply, False once the run is over
+    pause = random.expovariate(1 / mean) if mean else 0
+    await asyncio.sleep(max(min(pause, ends_at - time.monotonic()), 0))
+    return time.monotonic() < ends_at
+
+
+async def session(user: User, args, ends_at: float) -> None:
+    try:
+        await user.send("/start", "/start", "Hello")
+        if not await think(args.think, ends_at):
+            return
+        if await user.new_project():
+            if not await think(args.think, ends_at):
+                return
+            await user.projects()
+        commands = [command for command, _ in READS]
+        weights = [weight for _, weight in READS]
+        while await think(args.think, ends_at):
+            if user.project_id and random.random() < args.writes:
+                await user.new_task()
+            else:
+                command = random.choices(commands, weights)[0]
+                if command == "/projects":
+                    await user.projects()
+                else:
+                    await user.send(command, command)
+    finally:
+        user.leave()
+
+
+def percentile(samples: list, share: float) -> float:
+    return samples[min(int(len(samples) * share), len(samples) - 1)] * 1000
+
+
+def report(stats: Stats, fake: FakeTelegram, elapsed: float) -> None:
+    print(
+        f"{'step':>12} {'sent':>7} {'ok %':>6} {'timeout':>7} {'error':>6} "
+        f"{'thrott':>6} {'shed':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+    )
+    total = Counter()
+    for step in sorted(stats.outcomes):
+        outcomes = stats.outcomes[step]
+        total.update(outcomes)
+        sent = sum(outcomes.values())
+        samples = sorted(stats.latencies[step]) or [0.0]
+        print(
+            f"{step:>12} {sent:>7} {outcomes['ok'] / sent * 100:>6.1f} "
+            f"{outcomes['timeout']:>7} {outcomes['error']:>6} "
+            f"{outcomes['throttled']:>6} {outcomes['shed']:>6} "
+            f"{percentile(samples, 0.5):>8.1f} {percentile(samples, 0.95):>8.1f} "
+            f"{percentile(samples, 0.99):>8.1f}"
+        )
+    sent = sum(total.values())
+    samples = sorted(sample for step in stats.latencies.values() for sample in step)
+    print(
+        f"\n{sent} updates in {elapsed:.1f}s: {sent / elapsed:.1f} updates/s, "
+        f"{total['ok'] / elapsed:.1f} ok/s"
+    )
+    if samples:
+        print(
+            f"latency p50 {percentile(samples, 0.5):.1f} ms, "
+            f"p95 {percentile(samples, 0.95):.1f} ms, "
+            f"p99 {percentile(samples, 0.99):.1f} ms, "
+            f"max {samples[-1] * 1000:.1f} ms"
+        )
+    for outcome in ("timeout", "error", "throttled", "shed"):
+        print(f"{outcome:>9}: {total[outcome] / max(sent, 1) * 100:.2f}%")
+    calls = ", ".join(f"{method} {count}" for method, count in fake.calls.most_common())
+    print(f"Bot API calls: {calls}; answered with 429: {fake.rate_limited}")
+
+
+def start_bot(
+    fake: FakeTelegram, directory: str, database: str = None, configure=None
+) -> asyncio.Task:
+    # Runs main.main() against the fake server. The bot reads its settings at
+    # import time, configure(const) runs before the middlewares are built.
+    os.environ["DATABASE_URL"] = database or os.path.join(directory, "load.db")
+    os.environ["TELEGRAM_API_URL"] = fake.url
+    os.environ["BOT_TOKEN"] = "123456:FAKE-TOKEN"
+    from modules.libraries.utils import const
+
+    const.CALENDAR_FEED_PORT = 0
+    const.BACKUP_DIRECTORY = os.path.join(directory, "backups")
+    if configure is not None:
+        configure(const)
+    import main
+
+    return asyncio.create_task(main.main())
+
+
+async def stop_bot(bot_task: asyncio.Task, sig: int = signal.SIGINT) -> None:
+    # Stops polling the way Ctrl+C or a service manager does, cancelling
+    # main() would leave aiogram's polling task running. A bot that already
+    # failed has no handler left and the signal would kill this process.
+    if not bot_task.done():
+        os.kill(os.getpid(), sig)
+    await bot_task
+
+
+async def run(args) -> None:
+    fake = FakeTelegram(
+        latency=args.latency,
+        jitter=args.jitter,
+        rate_limit=args.rate_limit,
+        retry_after=args.retry_after,
+    )
+    await fake.start()
+
+    with tempfile.TemporaryDirectory() as directory:
+
+        def configure(const) -> None:
+            const.DATABASE_SHARDS = args.shards
+
+        bot_task = start_bot(fake, directory, args.postgres, configure)
+        # Users arrive over the ramp instead of in one burst
+        started = time.monotonic()
+        ends_at = started + args.ramp + args.duration
+        stats = Stats()
+        sessions = []
+        for index in range(args.users):
+            user = User(fake, stats, 1_000_000 + index, args.timeout)
+            sessions.append(asyncio.create_task(session(user, args, ends_at)))
+            await asyncio.sleep(args.ramp / args.users)
+        await asyncio.gather(*sessions)
+        elapsed = time.monotonic() - started
+
+        await stop_bot(bot_task)
+        await fake.stop()
+    report(stats, fake, elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--duration", type=float, default=60.0)
+    parser.add_argument("--ramp", type=float, default=10.0)
+    parser.add_argument("--think", type=float, default=5.0, help="mean seconds")
+    parser.add_argument("--writes", type=float, default=0.2, help="share of steps")
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--latency", type=float, default=0.02)
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--rate-limit", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--postgres", help="a DSN instead of a temporary SQLite file")
+    parser.add_argument("--shards", type=int, default=1, help="SQLite files")
+    args = parser.parse_args()
+
+    # Warnings too: a dialog cut short by throttling logs one per step
+    logging.disable(logging.WARNING)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""
+Outbox relay recovery check: notifications are queued in the outbox and the
+relay delivers them to the fake Bot API while it is repeatedly stopped in the
+middle of a batch and started again, as a crash or a restart would do:
+
+- every outbox row reaches its chat exactly once,
+- no row is left pending.
+
+Stops alternate between cancelling the relay's task and OutboxRelay.stop().
+A share of sends is answered with 429, so retries are part of the run.
+Reports the delivery throughput of an uninterrupted relay and of the one
+that keeps being stopped.
+
+Exits with status 1 if a message was lost or delivered twice.
+Run from the repository root: python -m benchmarks.outbox_relay
+"""
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from benchmarks.fake_telegram import FakeTelegram
+from collections import Counter
+from modules.libraries.dbms import Database
+from modules.libraries.outbox import OutboxRelay
+import argparse, asyncio, logging, os, random, sqlite3, sys, tempfile, time
+
+FIRST_CHAT_ID = 1_000_000
+
+
+def notifications(run: str, count: int, chats: int) -> list:
+    now = time.time()
+    return [
+        (f"{run}:{index}", FIRST_CHAT_ID + index % chats, f"{run} #{index}", now)
+        for index in range(count)
+    ]
+
+
+async def received(fake: FakeTelegram, chats: int) -> Counter:
+    # Texts the fake server got, drained from every chat
+    texts = Counter()
+    for chat_id in range(FIRST_CHAT_ID, FIRST_CHAT_ID + chats):
+        while True:
+            try:
+                message = await fake.next_reply(chat_id, 0.01)
+            except asyncio.TimeoutError:
+                break
+            texts[message["text"]] += 1
+    return texts
+
+
+def outbox_statuses(path: str) -> Counter:
+    with sqlite3.connect(path) as db:
+        return Counter(
+            dict(db.execute("SELECT status, COUNT(*) FROM outbox GROUP BY status"))
+        )
+
+
+async def wait_for(relays: list, done: int, timeout: float) -> bool:
+    ends_at = time.monotonic() + timeout
+    while sum(relay.sent + relay.failed for relay in relays) < done:
+        if time.monotonic() > ends_at:
+            return False
+        await asyncio.sleep(0.005)
+    return True
+
+
+async def stop(relay: OutboxRelay, task: asyncio.Task, cancel: bool) -> None:
+    if cancel:
+        task.cancel()
+    else:
+        relay.stop()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+
+async def deliver(db: Database, bot: Bot, args, run: str, kills: int) -> tuple:
+    # Returns the seconds it took and the relays that took part
+    await db.enqueue_notifications(notifications(run, args.messages, args.chats))
+    started = time.monotonic()
+    relays = []
+    for index in range(kills + 1):
+        relay = OutboxRelay(db, bot, batch_size=args.batch_size, interval=0.1)
+        relays.append(relay)
+        task = asyncio.create_task(relay.run())
+        if index == kills:
+            finished = await wait_for(relays, args.messages, args.timeout)
+        else:
+            # Somewhere inside the first two batches, never at their edge
+            target = random.randrange(1, args.batch_size) + args.batch_size * (
+                index % 2
+            )
+            before = sum(relay.sent + relay.failed for relay in relays[:-1])
+            finished = await wait_for(
+                relays, min(before + target, args.messages), args.timeout
+            )
+        await stop(relay, task, cancel=index % 2 == 0)
+        if not finished:
+            break
+    return time.monotonic() - started, relays
+
+
+def report(name: str, elapsed: float, relays: list) -> None:
+    sent = sum(relay.sent for relay in relays)
+    retried = sum(relay.retried for relay in relays)
+    print(
+        f"{name}: {sent} messages in {elapsed:.2f}s, {sent / elapsed:.1f} messages/s, "
+        f"{retried} retries, {len(relays) - 1} stops"
+    )
+
+
+async def run(args) -> bool:
+    fake = FakeTelegram(
+        latency=args.latency,
+        jitter=args.latency,
+        rate_limit=args.rate_limit,
+        retry_after=1,
+    )
+    await fake.start()
+    bot = Bot(
+        token="123456:FAKE-TOKEN",
+        session=AiohttpSession(api=TelegramAPIServer.from_base(fake.url)),
+    )
+
+    lost = {}
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "outbox.db")
+        db = Database(path)
+        await db.create_tables()
+        for run, kills in (("uninterrupted", 0), ("stopped", args.stops)):
+            elapsed, relays = await deliver(db, bot, args, run, kills)
+            report(run, elapsed, relays)
+            texts = await received(fake, args.chats)
+            expected = {f"{run} #{index}" for index in range(args.messages)}
+            lost[f"{run}: missing"] = len(expected - set(texts))
+            lost[f"{run}: delivered twice or more"] = sum(
+                1 for count in texts.values() if count > 1
+            )
+        await db.close()
+        statuses = outbox_statuses(path)
+
+    await bot.session.close()
+    await fake.stop()
+
+    print(f"outbox: {dict(statuses)}")
+    lost["pending rows"] = statuses["pending"]
+    lost["failed rows"] = statuses["failed"]
+    lost = {name: count for name, count in lost.items() if count}
+    print(f"lost: {lost}" if lost else "every message delivered exactly once")
+    return not lost
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--messages", type=int, default=1000)
+    parser.add_argument("--chats", type=int, default=100)
+    parser.add_argument("--stops", type=int, default=10)
+    parser.add_argument("--batch-size", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.005)
+    parser.add_argument("--rate-limit", type=float, default=0.02)
+    parser.add_argument("--timeout", type=float, default=120.0)
+    args = parser.parse_args()
+
+    # The retries log a warning each
+    logging.disable(logging.WARNING)
+    sys.exit(0 if asyncio.run(run(args)) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+"""
+Rolling restart check: simulated users keep creating projects and tasks while
+the bot gets SIGTERM and is started again, as a service manager would do it.
+No work may be lost on the way:
+
+- every message gets its reply, before the restart or after it,
+- every project and task the bot confirmed is in the database,
+- dialogs cut by a restart continue where they were after it.
+
+The bot is restarted inside this process, so module-level state such as the
+middlewares' survives; the dispatcher, its FSM storage and the database
+connections are created anew, as after a real restart. Throttling is lifted
+so that every message is expected to be answered.
+
+Exits with status 1 if anything was lost.
+Run from the repository root: python -m benchmarks.restart_bot
+"""
+
+from benchmarks.fake_telegram import FakeTelegram
+from benchmarks.load_bot import Stats, User, report, start_bot, stop_bot, think
+from collections import Counter
+import argparse, asyncio, logging, os, random, signal, sqlite3, sys, tempfile, time
+
+
+class Restarts:
+    def __init__(self):
+        self.count = 0
+        self.downtime = []
+
+
+def detach_router() -> None:
+    # The router is created at import and stays attached to the dispatcher of
+    # the previous start; a new process would import it afresh
+    from modules.routers.routers import router
+
+    router._parent_router = None
+
+
+def unthrottled(const) -> None:
+    const.THROTTLE_RATES = {klass: (1e9, 1e9) for klass in const.THROTTLE_RATES}
+
+
+async def dialog(done: Counter, restarts: Restarts, name: str, run) -> bool:
+    # Counts confirmed dialogs, and separately those a restart fell into
+    before = restarts.count
+    finished = await run()
+    spanned = restarts.count != before
+    if finished:
+        done[name] += 1
+    if spanned:
+        done[f"{name} across a restart" if finished else f"{name} cut"] += 1
+    return finished
+
+
+async def session(
+    user: User, args, ends_at: float, done: Counter, restarts: Restarts
+) -> None:
+    try:
+        if await user.send("/start", "/start", "Hello") is None:
+            return
+        if not await dialog(done, restarts, "projects", user.new_project):
+            return
+        while user.project_id is None and time.monotonic() < ends_at:
+            await user.projects()
+        while await think(args.think, ends_at):
+            if random.random() < args.writes:
+                await dialog(done, restarts, "tasks", user.new_task)
+            else:
+                await user.projects()
+    finally:
+        user.leave()
+
+
+def count_rows(path: str, table: str) -> int:
+    with sqlite3.connect(path) as db:
+        return db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+
+
+async def run(args) -> bool:
+    fake = FakeTelegram(latency=args.latency, jitter=args.latency)
+    await fake.start()
+
+    with tempfile.TemporaryDirectory() as directory:
+        database = os.path.join(directory, "load.db")
+
+        def configure(const) -> None:
+            unthrottled(const)
+            const.FSM_STATE_PATH = os.path.join(directory, "fsm_state.pickle")
+
+        bot_task = start_bot(fake, directory, database, configure)
+        stats = Stats()
+        done = Counter()
+        restarts = Restarts()
+        started = time.monotonic()
+        ends_at = started + args.duration
+        sessions = [
+            asyncio.create_task(
+                session(
+                    User(fake, stats, 1_000_000 + index, args.timeout),
+                    args,
+                    ends_at,
+                    done,
+                    restarts,
+                )
+            )
+            for index in range(args.users)
+        ]
+
+        for index in range(args.restarts):
+            # Restarts spread evenly over the run
+            restart_at = started + args.duration * (index + 1) / (args.restarts + 1)
+            await asyncio.sleep(max(restart_at - time.monotonic(), 0))
+            stopping = time.monotonic()
+            await stop_bot(bot_task, signal.SIGTERM)
+            restarts.count += 1
+            detach_router()
+            bot_task = start_bot(fake, directory, database, configure)
+            restarts.downtime.append(time.monotonic() - stopping)
+
+        await asyncio.gather(*sessions)
+        elapsed = time.monotonic() - started
+        await stop_bot(bot_task, signal.SIGTERM)
+        await fake.stop()
+
+        users = count_rows(database, "users")
+        projects = count_rows(database, "projects")
+        tasks = count_rows(database, "tasks")
+
+    report(stats, fake, elapsed)
+    print(
+        f"\n{restarts.count} restarts, stopping took "
+        + ", ".join(f"{downtime:.2f}s" for downtime in restarts.downtime)
+    )
+    for name in ("projects", "tasks"):
+        print(
+            f"{name}: {done[name]} confirmed, "
+            f"{done[f'{name} across a restart']} of them across a restart, "
+            f"{done[f'{name} cut']} cut by one"
+        )
+
+    total = Counter()
+    for outcomes in stats.outcomes.values():
+        total.update(outcomes)
+    lost = {
+        "unanswered messages": total["timeout"],
+        "failed steps": total["error"],
+        "dialogs cut by a restart": done["projects cut"] + done["tasks cut"],
+        "users missing": args.users - users,
+        "projects missing": done["projects"] - projects,
+        "tasks missing": done["tasks"] - tasks,
+    }
+    lost = {name: count for name, count in lost.items() if count}
+    print(f"lost: {lost}" if lost else "nothing lost")
+    return not lost
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--duration", type=float, default=30.0)
+    parser.add_argument("--restarts", type=int, default=2)
+    parser.add_argument("--think", type=float, default=1.0, help="mean seconds")
+    parser.add_argument("--writes", type=float, default=0.5, help="share of steps")
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--latency", type=float, default=0.01)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    sys.exit(0 if asyncio.run(run(args)) else 1)
+
+
+if __name__ == "__main__":
+    main()
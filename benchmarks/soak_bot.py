@@ -0,0 +1,187 @@
+"""
+Memory soak test: hours of simulated traffic against the full bot, through
+the fake Bot API of benchmarks/fake_telegram.py, with tracemalloc snapshots
+along the way.
+
+Time is virtual: think times, session lengths, throttling refill and the
+intervals of the background jobs are all divided by --speedup, so two hours
+of traffic at --speedup 20 take six minutes. Users keep arriving and leaving,
+which is what makes per-user state pile up.
+
+Every --sample-every virtual minutes the process RSS, the sizes of the
+caches, FSM storage and queues (what /debug_memory shows) and a tracemalloc
+snapshot are taken. The report lists them over time and the allocation sites
+that grew the most since the first sample, with the number of intervals in
+which each of them grew: a site that grows in every interval is a leak
+candidate, one that grows early and then stays flat is a warming cache.
+
+Run from the repository root: python -m benchmarks.soak_bot
+"""
+
+from benchmarks.fake_telegram import FakeTelegram
+from benchmarks.load_bot import Stats, User, report, session, start_bot, stop_bot
+from modules.libraries import memory
+import argparse, asyncio, gc, logging, random, tempfile, time, tracemalloc
+
+# The consts that are time intervals, divided by the speedup
+INTERVALS = (
+    "THROTTLE_IDLE_TTL",
+    "USERNAME_FLUSH_INTERVAL",
+    "ARCHIVE_INTERVAL",
+    "OVERDUE_SWEEP_INTERVAL",
+    "BACKUP_INTERVAL",
+    "CHANGES_PRUNE_INTERVAL",
+    "CHANGE_NOTIFY_WINDOW",
+)
+# Allocations of the simulated users and the fake server aren't the bot's
+HARNESS = ("*/benchmarks/*",)
+# Columns of the timeline: (title, stats section, key)
+COLUMNS = (
+    ("rss", "process", "rss"),
+    ("traced", "tracemalloc", "current"),
+    ("tasks", "process", "tasks"),
+    ("fsm keys", "fsm", "keys"),
+    ("fsm size", "fsm", "bytes"),
+    ("buckets", "throttling", "buckets"),
+    ("names", "usernames", "known"),
+    ("users", "registration", "known"),
+    ("calendar", "storage", "calendar_cache"),
+    ("log queue", "log_queue", "queued"),
+)
+
+
+def speed_up(speedup: float):
+    def configure(const) -> None:
+        const.THROTTLE_RATES = {
+            klass: (capacity, refill * speedup)
+            for klass, (capacity, refill) in const.THROTTLE_RATES.items()
+        }
+        for name in INTERVALS:
+            setattr(const, name, getattr(const, name) / speedup)
+
+    return configure
+
+
+class Sampler:
+    def __init__(self, frames: int):
+        self._key_type = "traceback" if frames > 1 else "lineno"
+        self.rows = []
+        # memory.allocation_sites() at every sample
+        self.sites = []
+
+    async def sample(self, virtual: float, active: int) -> None:
+        # Garbage that is merely waiting for the collector isn't growth
+        gc.collect()
+        self.rows.append((virtual, active, memory.collect()))
+        # Grouping the traces is slow, the simulated users go on meanwhile
+        self.sites.append(
+            await asyncio.to_thread(memory.allocation_sites, self._key_type)
+        )
+
+    def growth(self, top: int) -> list:
+        # (traceback, size diff, count diff, intervals in which the site grew)
+        growth = []
+        for traceback, size, count in memory.top_growth(
+            self.sites[0], self.sites[-1], top, ignore=HARNESS
+        ):
+            sizes = [sites.get(traceback, (0, 0))[0] for sites in self.sites]
+            grew = sum(1 for old, new in zip(sizes, sizes[1:]) if new > old)
+            growth.append((traceback, size, count, grew))
+        return growth
+
+
+def print_timeline(rows: list) -> None:
+    print(f"{'virtual':>8} {'active':>7} " + " ".join(f"{c[0]:>10}" for c in COLUMNS))
+    for virtual, active, stats in rows:
+        cells = []
+        for _, section, key in COLUMNS:
+            value = stats.get(section, {}).get(key)
+            if section == "tracemalloc" or key in ("rss", "bytes"):
+                value = memory.format_bytes(value)
+            cells.append(f"{'-' if value is None else value:>10}")
+        hours, minutes = divmod(int(virtual // 60), 60)
+        print(f"{hours:>5}:{minutes:02d} {active:>7} " + " ".join(cells))
+
+
+def print_growth(growth: list, intervals: int) -> None:
+    print("\nTop growing allocation sites since the first sample:")
+    print(f"{'size':>10} {'blocks':>8} {'grew in':>9}  site")
+    for traceback, size, count, grew in growth:
+        print(
+            f"{memory.format_bytes(size):>10} {count:>+8} "
+            f"{grew:>4}/{intervals:<4}  {memory.format_site(traceback)}"
+        )
+        for frame in traceback[1:]:
+            print(f"{'':>35}{frame.filename}:{frame.lineno}")
+
+
+async def run(args) -> None:
+    tracemalloc.start(args.frames)
+    fake = FakeTelegram(latency=args.latency, jitter=args.latency)
+    await fake.start()
+
+    with tempfile.TemporaryDirectory() as directory:
+        bot_task = start_bot(fake, directory, args.postgres, speed_up(args.speedup))
+        # What a session of a user does, in real seconds
+        user_args = argparse.Namespace(
+            think=args.think / args.speedup, writes=args.writes
+        )
+        stats = Stats()
+        sampler = Sampler(args.frames)
+        sessions = set()
+        started = time.monotonic()
+        ends_at = started + args.hours * 3600 / args.speedup
+        next_sample = started + args.sample_every * 60 / args.speedup
+        arrival_gap = 3600 / args.arrivals / args.speedup
+        next_arrival = started
+        user_id = 1_000_000
+
+        while time.monotonic() < ends_at:
+            now = time.monotonic()
+            if now >= next_sample:
+                await sampler.sample((now - started) * args.speedup, len(sessions))
+                next_sample += args.sample_every * 60 / args.speedup
+            while next_arrival <= now:
+                user_id += 1
+                user = User(fake, stats, user_id, args.timeout)
+                leaves_at = min(now + args.session / args.speedup, ends_at)
+                task = asyncio.create_task(session(user, user_args, leaves_at))
+                sessions.add(task)
+                task.add_done_callback(sessions.discard)
+                next_arrival += random.expovariate(1 / arrival_gap)
+            await asyncio.sleep(min(next_arrival, next_sample, ends_at) - now)
+
+        await asyncio.gather(*sessions)
+        await sampler.sample((time.monotonic() - started) * args.speedup, 0)
+        elapsed = time.monotonic() - started
+        await stop_bot(bot_task)
+        await fake.stop()
+
+    print_timeline(sampler.rows)
+    print_growth(sampler.growth(args.top), len(sampler.rows) - 1)
+    print(f"\n{user_id - 1_000_000} users over {args.hours:g} virtual hours\n")
+    report(stats, fake, elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--hours", type=float, default=2.0, help="virtual hours")
+    parser.add_argument("--speedup", type=float, default=20.0)
+    parser.add_argument("--arrivals", type=float, default=600, help="users per hour")
+    parser.add_argument("--session", type=float, default=600, help="seconds per user")
+    parser.add_argument("--think", type=float, default=30.0, help="mean seconds")
+    parser.add_argument("--writes", type=float, default=0.2, help="share of steps")
+    parser.add_argument("--sample-every", type=float, default=15, help="minutes")
+    parser.add_argument("--top", type=int, default=15)
+    parser.add_argument("--frames", type=int, default=1, help="traceback depth")
+    parser.add_argument("--timeout", type=float, default=10.0)
+    parser.add_argument("--latency", type=float, default=0.005)
+    parser.add_argument("--postgres", help="a DSN instead of a temporary SQLite file")
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -4,11 +4,29 @@ AUTHOR: github.com/atheop1337 😘
 
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
 from aiogram.enums import ParseMode
+from modules.libraries.archive import ArchiveJob
+from modules.libraries.backup import BackupJob
+from modules.libraries.calendar_feed import CalendarFeed
+from modules.libraries.changes import ChangeLogPruner, ChangeNotifier
 from modules.libraries.dbms import Database
-from modules.routers.routers import router as handlers_router
+from modules.libraries.digest import DigestScheduler
+from modules.libraries.fsm_state import load_fsm_state, save_fsm_state
+from modules.libraries.logs import queue_stats, setup_logging
+from modules.libraries.memory import fsm_stats, watch
+from modules.libraries.outbox import OutboxRelay
+from modules.libraries.overdue import OverdueSweeper
+from modules.libraries.shards import ShardedDatabase
+from modules.routers.routers import (
+    router as handlers_router,
+    concurrency_middleware,
+    registration_middleware,
+    username_middleware,
+)
+from modules.handlers import handlers
 from modules.libraries.utils import const
-from datetime import datetime
 import asyncio, logging, os
 
 TOKEN_FILE_PATH = r"C:\Everything\tokens\prodigy\TOKEN"
@@ -23,45 +41,151 @@ def read_token_from_file(file_path) -> str:
         raise ValueError(f"Error reading token from file: {e}")
 
 
-def setup_logging():
-    log_dir = ".logs"
-    os.makedirs(log_dir, exist_ok=True)
-
-    log_filename = os.path.join(
-        log_dir, datetime.now().strftime("%Y-%m-%d_%H-%M-%S.log")
-    )
-
-    logging.basicConfig(
-        level=logging.INFO,
-        format="[%(asctime)s]:%(levelname)s:%(funcName)s:%(message)s",
-        datefmt="%Y-%m-%d|%H:%M:%S",
-        handlers=[logging.FileHandler(log_filename), logging.StreamHandler()],
-    )
-
-
-TOKEN = read_token_from_file(TOKEN_FILE_PATH)
-if not TOKEN:
-    raise ValueError("No BOT_TOKEN found in the token file. Please check your token.")
+def load_token() -> str:
+    # BOT_TOKEN wins over the token file, load tests run with a fake token
+    token = os.getenv("BOT_TOKEN") or read_token_from_file(TOKEN_FILE_PATH)
+    if not token:
+        raise ValueError(
+            "No BOT_TOKEN found in the token file. Please check your token."
+        )
+    return token
 
 
 async def main() -> None:
-    db = Database(const.DATABASE_NAME)
+    db = handlers._db
     await db.create_tables()
+    await registration_middleware.load()
     dp = Dispatcher()
     dp.include_routers(handlers_router)
-    bot = Bot(token=TOKEN, default=DefaultBotProperties(parse_mode=ParseMode.HTML))
+    load_fsm_state(dp.storage, const.FSM_STATE_PATH)
+    # Sizes shown by /debug_memory, the middlewares register in routers.py
+    watch("storage", db.stats)
+    watch("fsm", lambda: fsm_stats(dp.storage))
+    watch("log_queue", queue_stats)
+    # TELEGRAM_API_URL points the bot at another Bot API server, like the
+    # local one of benchmarks/fake_telegram.py
+    session = None
+    if const.TELEGRAM_API_URL:
+        session = AiohttpSession(
+            api=TelegramAPIServer.from_base(const.TELEGRAM_API_URL)
+        )
+    bot = Bot(
+        token=load_token(),
+        session=session,
+        default=DefaultBotProperties(parse_mode=ParseMode.HTML),
+    )
+    calendar_feed = CalendarFeed(db, const.CALENDAR_FEED_HOST, const.CALENDAR_FEED_PORT)
+    await calendar_feed.start()
+    digest = DigestScheduler(db, const.DIGEST_SEND_AT, const.DIGEST_WINDOW)
+    digest_task = asyncio.create_task(digest.run())
+    outbox_relay = OutboxRelay(db, bot, batch_size=const.OUTBOX_BATCH_SIZE)
+    outbox_task = asyncio.create_task(outbox_relay.run())
+    archive = ArchiveJob(
+        db, const.ARCHIVE_AFTER_DAYS, const.ARCHIVE_BATCH_SIZE, const.ARCHIVE_INTERVAL
+    )
+    archive_task = asyncio.create_task(archive.run())
+    overdue = OverdueSweeper(
+        db,
+        const.OVERDUE_SWEEP_INTERVAL,
+        const.OVERDUE_BATCH_SIZE,
+        const.OVERDUE_NOTIFY_LIMIT,
+    )
+    overdue_task = asyncio.create_task(overdue.run())
+    changes = ChangeLogPruner(
+        db,
+        const.CHANGES_RETENTION,
+        const.CHANGES_PRUNE_BATCH_SIZE,
+        const.CHANGES_PRUNE_INTERVAL,
+    )
+    changes_task = asyncio.create_task(changes.run())
+    # A sharded database has a change log per shard
+    change_logs = db.change_logs()
+    notifier_tasks = [
+        asyncio.create_task(
+            ChangeNotifier(
+                db,
+                const.CHANGE_NOTIFY_WINDOW,
+                const.CHANGE_NOTIFY_BATCH_SIZE,
+                const.CHANGE_NOTIFY_RATE,
+                const.CHANGE_NOTIFY_LIMIT,
+                log=log,
+                name=f":{index}" if len(change_logs) > 1 else "",
+            ).run()
+        )
+        for index, log in enumerate(change_logs)
+    ]
+    # Online backups use SQLite's backup API, PostgreSQL has its own tooling.
+    # Shard files are backed up one by one, not as one snapshot.
+    files = []
+    if isinstance(db, ShardedDatabase):
+        files = db.databases
+    elif isinstance(db, Database):
+        files = [db]
+    backup_tasks = []
+    for index, file in enumerate(files):
+        backup = BackupJob(
+            file,
+            const.BACKUP_DIRECTORY,
+            const.BACKUP_INTERVAL,
+            keep=const.BACKUP_KEEP,
+            compress=const.BACKUP_COMPRESS,
+            pages=const.BACKUP_PAGES,
+            sleep=const.BACKUP_SLEEP,
+        )
+        backup_tasks.append(asyncio.create_task(backup.run()))
+        watch("backup" if index == 0 else f"backup:{index}", backup.stats)
 
     try:
-        await dp.start_polling(bot)
+        # aiogram stops polling on SIGTERM and SIGINT. The session stays open
+        # for the handlers that are still running.
+        await dp.start_polling(bot, close_bot_session=False)
     finally:
+        # The updates being handled were already confirmed to Telegram, it
+        # won't send them again, so they get a chance to finish
+        if not await concurrency_middleware.drain(const.SHUTDOWN_TIMEOUT):
+            logging.warning(
+                f"Shutting down with updates still running: {concurrency_middleware.stats()}"
+            )
+        await username_middleware.flush()
+        # The relay finishes the message it is sending, the rest stays queued
+        outbox_relay.stop()
+        await asyncio.wait([outbox_task], timeout=const.SHUTDOWN_TIMEOUT)
+        jobs = [
+            outbox_task,
+            digest_task,
+            archive_task,
+            overdue_task,
+            changes_task,
+            *notifier_tasks,
+            *backup_tasks,
+        ]
+        # The jobs write in transactions and keep their progress in the
+        # database, a cancelled run is redone by the next start
+        for job in jobs:
+            job.cancel()
+        await asyncio.gather(*jobs, return_exceptions=True)
+        save_fsm_state(dp.storage, const.FSM_STATE_PATH)
+        await calendar_feed.stop()
         await bot.session.close()
         await db.close()
 
 
 if __name__ == "__main__":
+    log_listener = setup_logging(
+        const.LOG_DIRECTORY,
+        level=const.LOG_LEVEL,
+        levels=const.LOG_LEVELS,
+        sampling=const.LOG_SAMPLING,
+        max_bytes=const.LOG_MAX_BYTES,
+        backups=const.LOG_BACKUPS,
+        interval=const.LOG_ROTATE_INTERVAL,
+        queue_size=const.LOG_QUEUE_SIZE,
+    )
     try:
-        setup_logging()
         logging.info(f"Using {'WIN' if os.name == 'nt' else 'UNIX'} base kernel")
         asyncio.run(main())
     except Exception as e:
         logging.exception("An error occurred")
+    finally:
+        # Writes out whatever is still queued
+        log_listener.stop()
@@ -2,7 +2,7 @@ from modules.handlers.handlers import Handlers
 from modules.libraries.utils import const
 
 # Main handler
-handlers = Handlers(const.DATABASE_NAME)
+handlers = Handlers(const.DATABASE_URL, const.DATABASE_SHARDS)
 
 # Start handler
 start_handler = handlers.StartHandler(parent=handlers)
@@ -17,6 +17,13 @@ all_project_handlers = handlers.AllProjectsHandler(parent=handlers)
 new_task_handler = handlers.NewTaskHandler(parent=handlers)
 edit_task_handler = handlers.EditTaskHandler(parent=handlers)
 delete_task_handler = handlers.DeleteTaskHandler(parent=handlers)
+repeat_task_handler = handlers.RepeatTaskHandler(parent=handlers)
+archive_handler = handlers.ArchiveHandler(parent=handlers)
+next_tasks_handler = handlers.NextTasksHandler(parent=handlers)
+
+# Calendar handlers
+calendar_handler = handlers.CalendarHandler(parent=handlers)
+calendar_feed_handler = handlers.CalendarFeedHandler(parent=handlers)
 
 # SubTask handlers
 new_subtask_handler = handlers.NewSubTaskHandler(parent=handlers)
@@ -26,5 +33,11 @@ delete_subtask_handler = handlers.DeleteSubTaskHandler(parent=handlers)
 # Share handlers
 share_project_handler = handlers.ShareProjectHandler(parent=handlers)
 
+# Notification handlers
+notifications_handler = handlers.NotificationsHandler(parent=handlers)
+
+# Admin handlers
+debug_memory_handler = handlers.DebugMemoryHandler(parent=handlers)
+
 # Help/Info handlers
 info_handler = handlers.InfoHandler(parent=handlers)
@@ -2,23 +2,47 @@ from aiogram import Router, types, F
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.enums import ChatAction
-from modules.libraries.dbms import Database
+from modules.libraries.storage import open_storage
 from modules.libraries.utils import const, _States, _Kbs
-from datetime import datetime
+from modules.libraries.selection import parse_selection
+from modules.libraries import memory
+from modules.libraries.recurrence import (
+    Recurrence,
+    iter_occurrences,
+    format_deadline,
+    display_deadline,
+    parse_display_date,
+)
+from contextvars import ContextVar
+from datetime import datetime, date, timedelta
 from typing import Union
+import asyncio
+import calendar
+import html
+import itertools
 import logging
+import re
+
+# (user id, user name) of the update being handled. aiogram handles every
+# update in a task of its own, so concurrent updates don't see each other's.
+_current_user = ContextVar("current_user", default=(None, None))
 
 
 class Handlers:
-    def __init__(self, db: str):
-        self._db = Database(db)
-        self._user_id = None
-        self._user_name = None
+    def __init__(self, db: str, shards: int = 1):
+        self._db = open_storage(db, shards)
+
+    @property
+    def _user_id(self):
+        return _current_user.get()[0]
+
+    @property
+    def _user_name(self):
+        return _current_user.get()[1]
 
     async def get_info(self, type: Union[types.Message, types.CallbackQuery]):
         if isinstance(type, (types.Message, types.CallbackQuery)):
-            self._user_id = type.from_user.id
-            self._user_name = type.from_user.username
+            _current_user.set((type.from_user.id, type.from_user.username))
         else:
             raise ValueError("Unsupported type provided")
 
@@ -80,7 +104,7 @@ class Handlers:
             shared_projects = [
                 proj
                 for proj in shared_projects
-                if proj["id"] not in {p["id"] for p in own_projects}
+                if proj.id not in {p.id for p in own_projects}
             ]
 
             logging.info(
@@ -116,7 +140,7 @@ class Handlers:
             shared_projects = [
                 proj
                 for proj in shared_projects
-                if proj["id"] not in {p["id"] for p in own_projects}
+                if proj.id not in {p.id for p in own_projects}
             ]
 
             if own_projects or shared_projects:
@@ -140,36 +164,54 @@ class Handlers:
         async def _format_projects(self, projects):
             projects_list = []
             for project in projects:
-                tasks = await self._parent._db.fetch_tasks(project["id"])
+                tasks = await self._parent._db.fetch_tasks(project.id)
                 if tasks:
                     task_list = []
                     for task in tasks:
-                        subtasks = await self._parent._db.fetch_subtasks(task["id"])
+                        subtasks = await self._parent._db.fetch_subtasks(task.id)
                         if subtasks:
                             subtask_list = "\n".join(
-                                f"Subtask ID: {subtask['id']}, Name: {subtask['name']}, Status: {subtask['status']}"
+                                f"Subtask ID: {subtask.id}, Name: {subtask.name}, Status: {subtask.status}"
                                 for subtask in subtasks
                             )
                         else:
                             subtask_list = "No subtasks for this task."
 
                         task_list.append(
-                            f"Task ID: {task['id']}, Name: {task['name']}, "
-                            f"Description: {task['description']}, Deadline: {task['deadline']}, "
-                            f"Priority: {task['priority']}, Status: {task['status']}\nSubtasks:\n{subtask_list}"
+                            f"Task ID: {task.id}, Name: {task.name}, "
+                            f"Description: {task.description}, Deadline: {display_deadline(task.deadline)}, "
+                            f"Priority: {task.priority}, Status: {task.status}"
+                            f"{', overdue' if task.overdue else ''}"
+                            f"{self._format_recurrence(task)}\nSubtasks:\n{subtask_list}"
                         )
                     task_list = "\n".join(task_list)
                 else:
                     task_list = "No tasks for this project."
 
-                description = project.get("description", "No description available")
+                description = project.description or "No description available"
 
                 projects_list.append(
-                    f"Project ID: {project['id']}, Name: {project['name']}, Description: {description}\nTasks:\n{task_list}"
+                    f"Project ID: {project.id}, Name: {project.name}, Description: {description}\nTasks:\n{task_list}"
                 )
 
             return "\n\n".join(projects_list)
 
+        def _format_recurrence(self, task) -> str:
+            if not task.recurrence:
+                return ""
+            today = date.today()
+            upcoming = itertools.islice(
+                iter_occurrences(
+                    task.deadline,
+                    task.recurrence,
+                    today,
+                    today + timedelta(days=const.RECURRENCE_VIEW_DAYS),
+                ),
+                const.RECURRENCE_VIEW_LIMIT,
+            )
+            upcoming = ", ".join(display_deadline(day) for day in upcoming)
+            return f", Repeats: {task.recurrence}, Next: {upcoming or '-'}"
+
     class NewProjectHandler(BaseHandler):
         async def _handle_message(
             self, message: types.Message, state: FSMContext, state_name
@@ -379,7 +421,7 @@ class Handlers:
             projects = data.get("projects")
 
             project_to_delete = next(
-                (project for project in projects if project["id"] == project_id), None
+                (project for project in projects if project.id == project_id), None
             )
 
             if not project_to_delete:
@@ -479,9 +521,7 @@ class Handlers:
 
             projects = await self._parent._db.fetch_projects(self._parent._user_id)
 
-            project = next(
-                (proj for proj in projects if proj["id"] == project_id), None
-            )
+            project = next((proj for proj in projects if proj.id == project_id), None)
             if project is None:
                 await message.answer(
                     f"Проект с ID {project_id} не найден или не принадлежит вам."
@@ -497,7 +537,7 @@ class Handlers:
             )
             await state.update_data(project_id=project_id)
             await message.answer(
-                f"Вы выбрали проект: {project['name']}. Введите название таска."
+                f"Вы выбрали проект: {project.name}. Введите название таска."
             )
             await state.set_state(_States.NewTask.task_name)
 
@@ -524,7 +564,7 @@ class Handlers:
         async def _handle_deadline(self, message: types.Message, state: FSMContext):
             deadline = message.text
             try:
-                datetime.strptime(deadline, "%d.%m.%Y")
+                parsed_deadline = parse_display_date(deadline)
             except ValueError:
                 await message.answer("Неверный формат даты. Пример: 31.12.2022.")
                 logging.warning(
@@ -533,7 +573,7 @@ class Handlers:
                 await state.clear()
                 return
             logging.info(f"User {self._parent._user_id} entered deadline: {deadline}.")
-            await state.update_data(deadline=deadline)
+            await state.update_data(deadline=format_deadline(parsed_deadline))
             await message.answer("Выберите приоритет таска (1, 2, 3, 4, 5).")
             await state.set_state(_States.NewTask.priority)
 
@@ -588,6 +628,11 @@ class Handlers:
             await state.clear()
 
     class EditTaskHandler(BaseHandler):
+        _PROMPT = (
+            "Введите ID таска, который хотите изменить. Можно несколько: "
+            "1,4,7-12 или «все в проекте 3»"
+        )
+
         async def _handle_message(
             self, message: types.Message, state: FSMContext, state_name
         ):
@@ -601,7 +646,7 @@ class Handlers:
                 logging.info(
                     f"User with id {self._parent._user_id} and name {self._parent._user_name} started editing task via command"
                 )
-                await message.answer(text="Введите ID таска, который хотите изменить")
+                await message.answer(text=self._PROMPT)
                 await state.set_state(_States.EditTask.task_id)
 
             elif state_name == _States.EditTask.task_id:
@@ -622,9 +667,7 @@ class Handlers:
                 logging.info(
                     f"User with id {self._parent._user_id} and name {self._parent._user_name} started editing task via callback query"
                 )
-                await callback_query.message.answer(
-                    text="Введите ID таска, который хотите изменить"
-                )
+                await callback_query.message.answer(text=self._PROMPT)
                 await state.set_state(_States.EditTask.task_id)
 
             elif state_name == _States.EditTask.task_id:
@@ -633,23 +676,28 @@ class Handlers:
                 await self._handle_task_progress(callback_query.message, state)
 
         async def _handle_task_id(self, message: types.Message, state: FSMContext):
-            task_id = message.text
             try:
-                task_id = int(task_id)
+                task_ids, project_id = parse_selection(
+                    message.text or "", const.BULK_EDIT_LIMIT
+                )
             except ValueError:
-                await message.answer("ID таска должен быть числом.")
-                await state.clear()
-                return
-
-            task = await self._parent._db.fetch_task(task_id)
-            if not task:
                 await message.answer(
-                    "Таска с таким ID не существует. Попробуйте еще раз."
+                    "Укажите ID таска, список вроде 1,4,7-12 "
+                    f"(не больше {const.BULK_EDIT_LIMIT}) или «все в проекте 3»."
                 )
                 await state.clear()
                 return
 
-            await state.update_data(task_id=task_id)
+            if task_ids is not None and len(task_ids) == 1:
+                task = await self._parent._db.fetch_task(task_ids[0])
+                if not task:
+                    await message.answer(
+                        "Таска с таким ID не существует. Попробуйте еще раз."
+                    )
+                    await state.clear()
+                    return
+
+            await state.update_data(task_ids=task_ids, project_id=project_id)
             await message.answer("Введи прогресс (0 - в прогрессе, 1 - завершено)")
             await state.set_state(_States.EditTask.progress)
 
@@ -670,15 +718,27 @@ class Handlers:
                 return
 
             data = await state.get_data()
-            task_id = data.get("task_id")
+            task_ids = data.get("task_ids")
+            project_id = data.get("project_id")
 
-            success = await self._parent._db.edit_task(task_id, progress)
-            if success:
+            updated = await self._parent._db.edit_tasks(
+                self._parent._user_id, progress, task_ids, project_id
+            )
+            if updated is None:
+                _final_message = "Ошибка при изменении таска. Попробуйте позже."
+                logging.error(f"Failed to edit tasks {task_ids or project_id}.")
+            elif task_ids is not None and len(task_ids) == 1 and updated:
                 _final_message = "Таск успешно изменен. Проверьте командой /projects."
-                logging.info(f"Task successfully edited with ID {task_id}.")
+                logging.info(f"Task successfully edited with ID {task_ids[0]}.")
+            elif updated:
+                skipped = len(task_ids) - len(updated) if task_ids is not None else 0
+                _final_message = f"Изменено тасков: {len(updated)}."
+                if skipped:
+                    _final_message += f" Не найдено или нет доступа: {skipped}."
+                _final_message += " Проверьте командой /projects."
+                logging.info(f"{len(updated)} tasks successfully edited.")
             else:
-                _final_message = "Ошибка при изменении таска. Попробуйте позже."
-                logging.error(f"Failed to edit task with ID {task_id}.")
+                _final_message = "Ни один из указанных тасков не найден."
 
             await message.answer(_final_message)
             await state.clear()
@@ -751,6 +811,341 @@ class Handlers:
             await message.answer(_final_message)
             await state.clear()
 
+    class RepeatTaskHandler(BaseHandler):
+        async def _handle_message(
+            self, message: types.Message, state: FSMContext, state_name
+        ):
+            tasks = await self._parent._db.user_has_tasks(self._parent._user_id)
+            if not tasks:
+                await message.answer("У вас нет тасков для повторения.")
+                await state.clear()
+                return
+
+            if state_name is None:
+                logging.info(
+                    f"User with id {self._parent._user_id} and name {self._parent._user_name} started setting task recurrence via command"
+                )
+                await message.answer(text="Введите ID таска, который хотите повторять")
+                await state.set_state(_States.RepeatTask.task_id)
+
+            elif state_name == _States.RepeatTask.task_id:
+                await self._handle_task_id(message, state)
+            elif state_name == _States.RepeatTask.rule:
+                await self._handle_rule(message, state)
+
+        async def _handle_callback_query(
+            self, callback_query: types.CallbackQuery, state: FSMContext, state_name
+        ):
+            tasks = await self._parent._db.user_has_tasks(self._parent._user_id)
+            if not tasks:
+                await callback_query.message.answer("У вас нет тасков для повторения.")
+                await state.clear()
+                return
+
+            if state_name is None:
+                logging.info(
+                    f"User with id {self._parent._user_id} and name {self._parent._user_name} started setting task recurrence via button"
+                )
+                await callback_query.message.answer(
+                    text="Введите ID таска, который хотите повторять"
+                )
+                await state.set_state(_States.RepeatTask.task_id)
+
+            elif state_name == _States.RepeatTask.task_id:
+                await self._handle_task_id(callback_query.message, state)
+            elif state_name == _States.RepeatTask.rule:
+                await self._handle_rule(callback_query.message, state)
+
+        async def _handle_task_id(self, message: types.Message, state: FSMContext):
+            task_id = message.text
+            try:
+                task_id = int(task_id)
+            except ValueError:
+                await message.answer("ID таска должен быть числом.")
+                await state.clear()
+                return
+
+            task = await self._parent._db.fetch_task(task_id)
+            if not task:
+                await message.answer(
+                    "Таска с таким ID не существует. Попробуйте еще раз."
+                )
+                await state.clear()
+                return
+
+            await state.update_data(task_id=task_id)
+            await message.answer(
+                "Введите правило повторения: daily, weekly, weekly:mon,thu, monthly, "
+                "every:3 (дни), every:2w (недели) или none, чтобы отключить повторение."
+            )
+            await state.set_state(_States.RepeatTask.rule)
+
+        async def _handle_rule(self, message: types.Message, state: FSMContext):
+            rule = message.text.strip().lower()
+            if rule == "none":
+                rule = None
+            else:
+                try:
+                    rule = str(Recurrence.parse(rule))
+                except ValueError:
+                    await message.answer(
+                        "Неверное правило повторения. Пример: weekly:mon,thu"
+                    )
+                    logging.warning(
+                        f"User {self._parent._user_id} entered an invalid recurrence rule: {message.text}."
+                    )
+                    await state.clear()
+                    return
+
+            data = await state.get_data()
+            task_id = data.get("task_id")
+
+            _check = await self._parent._db.set_task_recurrence(task_id, rule)
+            if _check:
+                _final_message = (
+                    "Повторение таска успешно изменено. Проверьте командой /projects."
+                )
+                logging.info(f"Task recurrence successfully set with ID {task_id}.")
+            else:
+                _final_message = (
+                    "Ошибка при изменении повторения таска. Попробуйте позже."
+                )
+                logging.error(f"Failed to set recurrence of task with ID {task_id}.")
+
+            await message.answer(_final_message)
+            await state.clear()
+
+    class CalendarFeedHandler(BaseHandler):
+        async def _handle_message(
+            self, message: types.Message, state: FSMContext, state_name
+        ):
+            await message.answer(await self._feed_message())
+
+        async def _handle_callback_query(
+            self, callback_query: types.CallbackQuery, state: FSMContext, state_name
+        ):
+            await callback_query.message.answer(await self._feed_message())
+
+        async def _feed_message(self) -> str:
+            token = await self._parent._db.fetch_calendar_token(self._parent._user_id)
+            if not token:
+                return (
+                    "Не удалось получить ссылку на календарь. Сначала выполните /start."
+                )
+
+            logging.info(
+                f"User with id {self._parent._user_id} and name {self._parent._user_name} requested calendar feed"
+            )
+            return (
+                "Подпишитесь на эту ссылку в своем календаре, чтобы видеть дедлайны:\n"
+                f"{const.CALENDAR_FEED_URL}/calendar/{token}.ics\n\n"
+                "Не передавайте ссылку другим: по ней доступны все ваши задачи."
+            )
+
+    class CalendarHandler(BaseHandler):
+        async def _handle_message(
+            self, message: types.Message, state: FSMContext, state_name
+        ):
+            today = date.today()
+            logging.info(
+                f"User with id {self._parent._user_id} and name {self._parent._user_name} opened calendar via command"
+            )
+            await message.answer(
+                self._month_title(today.year, today.month),
+                reply_markup=await self._month_kb(today.year, today.month),
+            )
+
+        async def _handle_callback_query(
+            self, callback_query: types.CallbackQuery, state: FSMContext, state_name
+        ):
+            action, _, value = callback_query.data.partition(":")
+
+            if action == "cal":
+                try:
+                    year, month = map(int, value.split("-"))
+                    date(year, month, 1)
+                except ValueError:
+                    await callback_query.answer()
+                    return
+                await callback_query.message.edit_text(
+                    self._month_title(year, month),
+                    reply_markup=await self._month_kb(year, month),
+                )
+            elif action == "cal_day":
+                try:
+                    day = date.fromisoformat(value)
+                except ValueError:
+                    await callback_query.answer()
+                    return
+                await callback_query.message.answer(await self._day_message(day))
+
+            await callback_query.answer()
+
+        def _month_title(self, year: int, month: int) -> str:
+            return f"Дедлайны: {const.MONTH_NAMES[month - 1]} {year}"
+
+        async def _month_kb(self, year: int, month: int):
+            first_day = date(year, month, 1)
+            last_day = date(year, month, calendar.monthrange(year, month)[1])
+            counts = await self._parent._db.fetch_deadline_counts(
+                self._parent._user_id, first_day, last_day
+            )
+            return _Kbs.get_calendar_kb(year, month, counts)
+
+        async def _day_message(self, day: date) -> str:
+            tasks = await self._parent._db.fetch_tasks_by_day(
+                self._parent._user_id, day
+            )
+            if not tasks:
+                return f"На {display_deadline(day)} задач нет."
+
+            task_list = "\n".join(
+                f"Task ID: {task.id}, Name: {task.name}, Project: {task.project_name}, "
+                f"Priority: {task.priority}, Status: {task.status}"
+                for task in tasks
+            )
+            return f"Задачи на {display_deadline(day)}:\n\n{task_list}"
+
+    class ArchiveHandler(BaseHandler):
+        async def _handle_message(
+            self, message: types.Message, state: FSMContext, state_name
+        ):
+            # /archive 2 shows the second page
+            parts = (message.text or "").split(maxsplit=1)
+            page = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else 1
+            await message.answer(await self._archive_message(max(page, 1)))
+
+        async def _handle_callback_query(
+            self, callback_query: types.CallbackQuery, state: FSMContext, state_name
+        ):
+            await callback_query.message.answer(await self._archive_message(1))
+
+        async def _archive_message(self, page: int) -> str:
+            tasks = await self._parent._db.fetch_archived_tasks(
+                self._parent._user_id,
+                const.ARCHIVE_VIEW_LIMIT,
+                (page - 1) * const.ARCHIVE_VIEW_LIMIT,
+            )
+            logging.info(
+                f"User with id {self._parent._user_id} and name {self._parent._user_name} viewed archive page {page}"
+            )
+            if not tasks:
+                return "В архиве пока нет задач." if page == 1 else "Больше задач нет."
+
+            task_list = "\n".join(
+                f"Task ID: {task.id}, Name: {task.name}, Project: {task.project_name}, "
+                f"Deadline: {display_deadline(task.deadline)}, "
+                f"Completed: {display_deadline(task.completed_at[:10]) if task.completed_at else '-'}"
+                for task in tasks
+            )
+            footer = ""
+            if len(tasks) == const.ARCHIVE_VIEW_LIMIT:
+                footer = f"\n\nСледующая страница: /archive {page + 1}"
+            return (
+                f"Задачи, завершенные больше {const.ARCHIVE_AFTER_DAYS} дней назад "
+                f"(страница {page}):\n\n{task_list}{footer}"
+            )
+
+    class NextTasksHandler(BaseHandler):
+        async def _handle_message(
+            self, message: types.Message, state: FSMContext, state_name
+        ):
+            # /next 10 shows ten tasks
+            parts = (message.text or "").split(maxsplit=1)
+            limit = (
+                int(parts[1])
+                if len(parts) > 1 and parts[1].isdigit()
+                else const.NEXT_TASKS_DEFAULT
+            )
+            await message.answer(
+                await self._next_message(min(max(limit, 1), const.NEXT_TASKS_LIMIT))
+            )
+
+        async def _handle_callback_query(
+            self, callback_query: types.CallbackQuery, state: FSMContext, state_name
+        ):
+            await callback_query.message.answer(
+                await self._next_message(const.NEXT_TASKS_DEFAULT)
+            )
+            await callback_query.answer()
+
+        async def _next_message(self, limit: int) -> str:
+            tasks = await self._parent._db.fetch_next_tasks(
+                self._parent._user_id, limit
+            )
+            logging.info(
+                f"User with id {self._parent._user_id} and name {self._parent._user_name} viewed {limit} next tasks"
+            )
+            if not tasks:
+                return "Открытых задач нет."
+
+            task_list = "\n".join(
+                f"{index}. Task ID: {task.id}, Name: {task.name}, Project: {task.project_name}, "
+                f"Priority: {task.priority}, Deadline: {display_deadline(task.deadline)}"
+                f"{' ⚠️' if task.overdue else ''}"
+                for index, task in enumerate(tasks, 1)
+            )
+            return f"Самые срочные задачи:\n\n{task_list}"
+
+    class NotificationsHandler(BaseHandler):
+        async def _handle_message(
+            self, message: types.Message, state: FSMContext, state_name
+        ):
+            settings = await self._parent._db.fetch_notification_settings(
+                self._parent._user_id
+            )
+            if settings is None:
+                await message.answer("Сначала выполните /start.")
+                return
+
+            logging.info(
+                f"User with id {self._parent._user_id} and name {self._parent._user_name} opened notification settings"
+            )
+            await message.answer(
+                self._settings_message(settings),
+                reply_markup=_Kbs.get_notifications_kb(settings),
+            )
+
+        async def _handle_callback_query(
+            self, callback_query: types.CallbackQuery, state: FSMContext, state_name
+        ):
+            settings = await self._parent._db.fetch_notification_settings(
+                self._parent._user_id
+            )
+            if settings is None:
+                await callback_query.answer("Сначала выполните /start.")
+                return
+
+            if callback_query.data == "notifications_toggle":
+                settings["notifications"] = not settings["notifications"]
+            elif callback_query.data == "digest_toggle":
+                settings["digest"] = not settings["digest"]
+
+            _check = await self._parent._db.set_notification_settings(
+                self._parent._user_id, settings["notifications"], settings["digest"]
+            )
+            if not _check:
+                await callback_query.answer("Ошибка при изменении настроек.")
+                return
+
+            logging.info(
+                f"User with id {self._parent._user_id} changed notification settings to {settings}"
+            )
+            await callback_query.message.edit_text(
+                self._settings_message(settings),
+                reply_markup=_Kbs.get_notifications_kb(settings),
+            )
+            await callback_query.answer()
+
+        def _settings_message(self, settings: dict) -> str:
+            return (
+                "Настройки уведомлений\n\n"
+                f"Уведомления: {'включены' if settings['notifications'] else 'выключены'}\n"
+                f"Ежедневная сводка в {const.DIGEST_SEND_AT:%H:%M}: "
+                f"{'включена' if settings['digest'] else 'выключена'}\n\n"
+                "Сводка приходит одним сообщением: просроченные задачи и задачи на сегодня и завтра."
+            )
+
     class NewSubTaskHandler(BaseHandler):
         async def _handle_message(
             self, message: types.Message, state: FSMContext, state_name
@@ -761,7 +1156,7 @@ class Handlers:
                 await state.clear()
                 return
 
-            tasks = await self._parent._db.fetch_tasks(projects[0]["id"])
+            tasks = await self._parent._db.fetch_tasks(projects[0].id)
             if not tasks:
                 await message.answer("У вас нет тасков для создания подзадачи.")
                 await state.clear()
@@ -789,7 +1184,7 @@ class Handlers:
                 await state.clear()
                 return
 
-            tasks = await self._parent.db.fetch_tasks(projects[0]["id"])
+            tasks = await self._parent.db.fetch_tasks(projects[0].id)
             if not tasks:
                 await callback_query.message.answer(
                     "У вас нет тасков для создания подзадачи."
@@ -817,7 +1212,7 @@ class Handlers:
                 await state.clear()
                 return
 
-            _exist = self._parent._db.fetch_task(task_id)
+            _exist = await self._parent._db.fetch_task(task_id)
             if not _exist:
                 await message.answer(
                     "Таска с таким ID не существует. Попробуйте еще раз."
@@ -826,29 +1221,67 @@ class Handlers:
                 return
 
             await state.update_data(task_id=task_id)
-            await message.answer("Выберите название подзадачи")
+            await message.answer(
+                "Введите название подзадачи. Чтобы создать несколько, "
+                "перечислите их с новой строки или списком:\n- первая\n- вторая"
+            )
             await state.set_state(_States.NewSubTask.subtask_name)
 
         async def _handle_subtask_name(self, message: types.Message, state: FSMContext):
-            subtask_name = message.text
+            subtask_names = self._parse_names(message.text or "")
             data = await state.get_data()
             task_id = data.get("task_id")
 
-            _check = await self._parent._db.add_subtask(task_id, subtask_name)
+            if not subtask_names:
+                await message.answer("Название подзадачи не может быть пустым.")
+                await state.clear()
+                return
+            if len(subtask_names) > const.SUBTASK_BATCH_LIMIT:
+                await message.answer(
+                    f"За раз можно создать не больше {const.SUBTASK_BATCH_LIMIT} подзадач."
+                )
+                await state.clear()
+                return
 
-            if _check:
+            _check = await self._parent._db.add_subtasks(task_id, subtask_names)
+
+            if _check and len(subtask_names) == 1:
                 _final_message = (
                     "Подзадача успешно создана. Проверьте командой /projects."
                 )
                 logging.info(f"Subtask successfully added with ID {task_id}.")
+            elif _check:
+                _final_message = (
+                    f"Создано подзадач: {len(subtask_names)}.\n"
+                    + "\n".join(f"- {name}" for name in subtask_names)
+                    + "\n\nПроверьте командой /projects."
+                )
+                logging.info(
+                    f"{len(subtask_names)} subtasks successfully added with ID {task_id}."
+                )
             else:
-                _final_message = "Ошибка при создании подзадачи. Попробуйте позже."
-                logging.error(f"Failed to add subtask with ID {task_id}.")
+                _final_message = "Ошибка при создании подзадач. Попробуйте позже."
+                logging.error(f"Failed to add subtasks with ID {task_id}.")
 
             await message.answer(_final_message)
             await state.clear()
 
+        @staticmethod
+        def _parse_names(text: str) -> list:
+            # One subtask per line, list markers like "-", "•" or "1." are dropped
+            names = []
+            for line in text.splitlines():
+                name = re.sub(r"^\s*(?:[-*•–—]\s*|\d+[.)]\s+)", "", line).strip()
+                if name:
+                    names.append(name)
+            return names
+
     class EditSubTaskHandler(BaseHandler):
+        _PROMPT = (
+            "Выберите ID подзадачи для редактирования (установки как выполненное). "
+            "Можно несколько: 1,4,7-12 или «все в проекте 3»"
+        )
+
         async def _handle_message(
             self, message: types.Message, state: FSMContext, state_name
         ):
@@ -863,9 +1296,7 @@ class Handlers:
                 logging.info(
                     f"User with id {self._parent._user_id} and name {self._parent._user_name} started editing subtask via command"
                 )
-                await message.answer(
-                    text="Выберите ID подзадачи для редактирования (установки как выполненное)"
-                )
+                await message.answer(text=self._PROMPT)
                 await state.set_state(_States.EditSubTask.subtask_id)
 
             elif state_name == _States.EditSubTask.subtask_id:
@@ -885,46 +1316,67 @@ class Handlers:
                 logging.info(
                     f"User with id {self._parent._user_id} and name {self._parent._user_name} started editing subtask via command"
                 )
-                await message.answer(
-                    text="Выберите ID подзадачи для редактирования (установки как выполненное)"
-                )
+                await message.answer(text=self._PROMPT)
                 await state.set_state(_States.EditSubTask.subtask_id)
 
             elif state_name == _States.EditSubTask.subtask_id:
                 await self._handle_subtask_id(message, state)
 
         async def _handle_subtask_id(self, message: types.Message, state: FSMContext):
-            subtask_id = message.text
             try:
-                subtask_id = int(subtask_id)
+                subtask_ids, project_id = parse_selection(
+                    message.text or "", const.BULK_EDIT_LIMIT
+                )
             except ValueError:
-                await message.answer("ID подзадачи должен быть числом.")
-                await state.clear()
-                return
-
-            _exist = await self._parent._db.fetch_subtask(subtask_id)
-
-            if not _exist:
                 await message.answer(
-                    "Подзадача с таким ID не существует. Попробуйте еще раз."
+                    "Укажите ID подзадачи, список вроде 1,4,7-12 "
+                    f"(не больше {const.BULK_EDIT_LIMIT}) или «все в проекте 3»."
                 )
                 await state.clear()
                 return
 
-            _check = await self._parent._db.edit_subtask(subtask_id)
+            if subtask_ids is not None and len(subtask_ids) == 1:
+                _exist = await self._parent._db.fetch_subtask(subtask_ids[0])
 
-            if _check:
+                if not _exist:
+                    await message.answer(
+                        "Подзадача с таким ID не существует. Попробуйте еще раз."
+                    )
+                    await state.clear()
+                    return
+
+            _check = await self._parent._db.edit_subtasks(
+                self._parent._user_id,
+                subtask_ids,
+                project_id,
+                complete_tasks=const.AUTO_COMPLETE_TASKS,
+            )
+
+            if _check is None:
                 _final_message = (
-                    "Статус подзадачи успешно изменен. Проверьте командой /projects."
+                    "Ошибка при изменении статуса подзадачи. Попробуйте позже."
                 )
-                logging.info(
-                    f"Subtask status successfully updated with ID {subtask_id}."
+                logging.error(
+                    f"Failed to update subtask status with IDs {subtask_ids or project_id}."
                 )
+            elif not _check[0]:
+                _final_message = "Ни одна из указанных подзадач не найдена."
             else:
-                _final_message = (
-                    "Ошибка при изменении статуса подзадачи. Попробуйте позже."
+                updated, completed_tasks = _check
+                if subtask_ids is not None and len(subtask_ids) == 1:
+                    _final_message = "Статус подзадачи успешно изменен."
+                else:
+                    _final_message = f"Выполнено подзадач: {len(updated)}."
+                if completed_tasks:
+                    _final_message += (
+                        " Все подзадачи выполнены, завершены таски: "
+                        + ", ".join(str(task_id) for task_id in completed_tasks)
+                        + "."
+                    )
+                _final_message += " Проверьте командой /projects."
+                logging.info(
+                    f"Subtask status successfully updated for {len(updated)} subtasks."
                 )
-                logging.error(f"Failed to update subtask status with ID {subtask_id}.")
 
             await message.answer(_final_message)
             await state.clear()
@@ -1072,32 +1524,35 @@ class Handlers:
                 f"User with id {self._parent._user_id} and name {self._parent._user_name} started sharing project with ID {project_id}"
             )
             await message.answer(
-                text="Выберите ID участника для расширения доступа к проекту"
+                text="Выберите ID или @username участника для расширения доступа к проекту"
             )
             await state.set_state(_States.ShareProject.participator_user_id)
 
         async def _handle_participator_user_id(
             self, message: types.Message, state: FSMContext
         ):
-            participator_user_id = message.text
+            participator = message.text.strip()
             try:
-                int(participator_user_id)
+                _exist = await self._parent._db.fetch_user(int(participator))
             except ValueError:
-                await message.answer("ID участника должен быть числом.")
-                await state.clear()
-                return
+                user_name = participator.removeprefix("@")
+                if not user_name:
+                    await message.answer("Укажите ID или @username участника.")
+                    await state.clear()
+                    return
+                _exist = await self._parent._db.fetch_user_by_name(user_name)
 
-            if participator_user_id == self._parent._user_id:
+            if not _exist:
                 await message.answer(
-                    "Я понимаю, у вас нету друзей, но самого себя добавить в участники нельзя."
+                    "Пользователь с таким ID или username не найден. Попробуйте еще раз."
                 )
                 await state.clear()
                 return
 
-            _exist = await self._parent._db.fetch_user(participator_user_id)
-            if not _exist:
+            participator_user_id = _exist.user_id
+            if participator_user_id == self._parent._user_id:
                 await message.answer(
-                    "Пользователь с таким ID не существует. Попробуйте еще раз."
+                    "Я понимаю, у вас нету друзей, но самого себя добавить в участники нельзя."
                 )
                 await state.clear()
                 return
@@ -1134,6 +1589,41 @@ class Handlers:
             await message.answer(_final_message)
             await state.clear()
 
+    class DebugMemoryHandler(BaseHandler):
+        def __init__(self, parent):
+            super().__init__(parent)
+            # Allocation sites at the previous call, to show what grew since
+            self._sites = None
+
+        async def handle(
+            self, type: Union[types.Message, types.CallbackQuery], state: FSMContext
+        ):
+            # Other users get no answer, as for a command that doesn't exist
+            if type.from_user.id not in const.ADMIN_IDS:
+                logging.warning(
+                    f"User with id {type.from_user.id} tried to run /debug_memory"
+                )
+                return
+            await super().handle(type, state)
+
+        async def _handle_message(
+            self, message: types.Message, state: FSMContext, state_name
+        ):
+            stats = memory.collect()
+            sites = await asyncio.to_thread(memory.allocation_sites)
+            previous, self._sites = self._sites, sites
+            growth = []
+            if sites is not None and previous is not None:
+                growth = memory.top_growth(previous, sites, const.DEBUG_MEMORY_TOP)
+
+            logging.info(f"User with id {self._parent._user_id} viewed memory stats")
+            report = memory.format_stats(stats, growth)
+            if sites is None:
+                report += "\n\ntracemalloc выключен, запустите с PYTHONTRACEMALLOC=1"
+            elif previous is None:
+                report += "\n\nСнимок памяти сохранен, рост покажет следующий вызов"
+            await message.answer(f"<pre>{html.escape(report, quote=False)}</pre>")
+
     class InfoHandler(BaseHandler):
         async def _handle_message(
             self, message: types.Message, state: FSMContext, state_name
@@ -1149,11 +1639,16 @@ class Handlers:
                 "- `/projects` — Просмотр списка проектов.\n\n"
                 "🔹 **Создание и управление задачами**\n"
                 "- `/add_task` — Добавление задачи в проект с дедлайном, приоритетом и подзадачами.\n"
-                "- `/edit_task` — Редактирование задачи: изменение дедлайна, описания, приоритета, прогресса.\n"
-                "- `/delete_task` — Удаление задачи.\n\n"
+                "- `/edit_task` — Редактирование задачи: изменение дедлайна, описания, приоритета, прогресса. Можно сразу несколько: `1,4,7-12` или `все в проекте 3`.\n"
+                "- `/delete_task` — Удаление задачи.\n"
+                "- `/repeat_task` — Повторение задачи: ежедневно, еженедельно, ежемесячно, каждые N дней.\n"
+                "- `/calendar` — Календарь дедлайнов по дням месяца.\n"
+                "- `/calendar_feed` — Ссылка на календарь (.ics) с дедлайнами ваших проектов.\n"
+                f"- `/archive` — Задачи, завершенные больше {const.ARCHIVE_AFTER_DAYS} дней назад.\n"
+                "- `/next [k]` — Самые срочные открытые задачи во всех проектах: по приоритету, затем по дедлайну.\n\n"
                 "🔹 **Подзадачи**\n"
                 "- `/add_subtask` — Добавление подзадачи к задаче.\n"
-                "- `/edit_subtask` — Редактирование подзадачи.\n"
+                "- `/edit_subtask` — Редактирование подзадачи. Можно сразу несколько, как в `/edit_task`.\n"
                 "- `/delete_subtask` — Удаление подзадачи.\n"
                 "- Подзадачи могут быть выполнены отдельно от основной задачи.\n\n"
                 "🔹 **Отслеживание прогресса**\n"
@@ -1162,7 +1657,9 @@ class Handlers:
                 "- Статистика завершенных и активных задач.\n\n"
                 "🔹 **Деление проектов с другими пользователями**\n"
                 "- `/share_project` — Возможность поделиться проектом с другим пользователем по ID или username.\n"
-                "- Совместное управление проектом для добавленных пользователей.\n"
+                "- Совместное управление проектом для добавленных пользователей.\n\n"
+                "🔹 **Уведомления**\n"
+                "- `/notifications` — Настройка уведомлений и ежедневной сводки по дедлайнам.\n"
             )
 
             await message.answer(info_message, parse_mode="Markdown")
@@ -1181,11 +1678,16 @@ class Handlers:
                 "- `/projects` — Просмотр списка проектов.\n\n"
                 "🔹 **Создание и управление задачами**\n"
                 "- `/add_task` — Добавление задачи в проект с дедлайном, приоритетом и подзадачами.\n"
-                "- `/edit_task` — Редактирование задачи: изменение дедлайна, описания, приоритета, прогресса.\n"
-                "- `/delete_task` — Удаление задачи.\n\n"
+                "- `/edit_task` — Редактирование задачи: изменение дедлайна, описания, приоритета, прогресса. Можно сразу несколько: `1,4,7-12` или `все в проекте 3`.\n"
+                "- `/delete_task` — Удаление задачи.\n"
+                "- `/repeat_task` — Повторение задачи: ежедневно, еженедельно, ежемесячно, каждые N дней.\n"
+                "- `/calendar` — Календарь дедлайнов по дням месяца.\n"
+                "- `/calendar_feed` — Ссылка на календарь (.ics) с дедлайнами ваших проектов.\n"
+                f"- `/archive` — Задачи, завершенные больше {const.ARCHIVE_AFTER_DAYS} дней назад.\n"
+                "- `/next [k]` — Самые срочные открытые задачи во всех проектах: по приоритету, затем по дедлайну.\n\n"
                 "🔹 **Подзадачи**\n"
                 "- `/add_subtask` — Добавление подзадачи к задаче.\n"
-                "- `/edit_subtask` — Редактирование подзадачи.\n"
+                "- `/edit_subtask` — Редактирование подзадачи. Можно сразу несколько, как в `/edit_task`.\n"
                 "- `/delete_subtask` — Удаление подзадачи.\n"
                 "- Подзадачи могут быть выполнены отдельно от основной задачи.\n\n"
                 "🔹 **Отслеживание прогресса**\n"
@@ -1194,7 +1696,9 @@ class Handlers:
                 "- Статистика завершенных и активных задач.\n\n"
                 "🔹 **Деление проектов с другими пользователями**\n"
                 "- `/share_project` — Возможность поделиться проектом с другим пользователем по ID или username.\n"
-                "- Совместное управление проектом для добавленных пользователей.\n"
+                "- Совместное управление проектом для добавленных пользователей.\n\n"
+                "🔹 **Уведомления**\n"
+                "- `/notifications` — Настройка уведомлений и ежедневной сводки по дедлайнам.\n"
             )
 
             await callback_query.message.answer(info_message, parse_mode="Markdown")
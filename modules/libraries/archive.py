@@ -0,0 +1,21 @@
+from modules.libraries.storage import Storage
+import asyncio, logging
+
+
+class ArchiveJob:
+    def __init__(self, db: Storage, after_days: int, batch_size: int, interval: float):
+        self._db = db
+        self._after_days = after_days
+        self._batch_size = batch_size
+        self._interval = interval
+        self.archived = 0
+
+    async def run(self) -> None:
+        while True:
+            try:
+                self.archived += await self._db.archive_tasks(
+                    self._after_days, self._batch_size
+                )
+            except Exception as e:
+                logging.error(f"Error occurred while archiving tasks: {e}")
+            await asyncio.sleep(self._interval)
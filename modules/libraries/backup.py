@@ -0,0 +1,95 @@
+from datetime import datetime
+from modules.libraries.dbms import Database
+from pathlib import Path
+from typing import Union
+import asyncio, gzip, logging, os, shutil
+
+
+class BackupJob:
+    def __init__(
+        self,
+        db: Database,
+        directory: str,
+        interval: float,
+        keep: int = 7,
+        compress: bool = True,
+        pages: int = 256,
+        sleep: float = 0.005,
+    ):
+        self._db = db
+        self._directory = Path(directory)
+        self._interval = interval
+        self._keep = keep
+        self._compress = compress
+        self._pages = pages
+        self._sleep = sleep
+        self.backups = 0
+        self.failures = 0
+        self.last = None
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.backup_once()
+            except Exception as e:
+                self.failures += 1
+                logging.error(f"Error occurred while backing up database: {e}")
+            await asyncio.sleep(self._interval)
+
+    async def backup_once(self) -> Union[dict, None]:
+        self._directory.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+        report = {"pages": 0, "duration": 0.0, "restarts": 0, "files": []}
+
+        for schema, source in (
+            ("main", self._db.db_path),
+            ("archive", self._db.archive_path),
+        ):
+            if not os.path.exists(source):
+                continue
+            stem = Path(source).stem
+            target = self._directory / f"{stem}-{stamp}.db"
+            stats = await self._db.backup(schema, str(target), self._pages, self._sleep)
+            if stats is None:
+                self.failures += 1
+                target.unlink(missing_ok=True)
+                return None
+
+            if self._compress:
+                target = await asyncio.get_running_loop().run_in_executor(
+                    None, self._gzip, target
+                )
+            report["pages"] += stats["pages"]
+            report["duration"] += stats["duration"]
+            report["restarts"] += stats["restarts"]
+            report["files"].append(str(target))
+            self._rotate(stem)
+
+        report["pages_per_second"] = (
+            report["pages"] / report["duration"] if report["duration"] else 0.0
+        )
+        self.backups += 1
+        self.last = report
+        logging.info(
+            f"Database backup finished in {report['duration']:.2f}s, "
+            f"{report['pages_per_second']:.0f} pages/s: {', '.join(report['files'])}"
+        )
+        return report
+
+    @staticmethod
+    def _gzip(path: Path) -> Path:
+        compressed = path.with_name(path.name + ".gz")
+        with open(path, "rb") as source, gzip.open(compressed, "wb") as target:
+            shutil.copyfileobj(source, target)
+        path.unlink()
+        return compressed
+
+    def _rotate(self, stem: str) -> None:
+        # Timestamps sort lexically, so the oldest snapshots come first
+        snapshots = sorted(self._directory.glob(f"{stem}-*.db*"))
+        for snapshot in snapshots[: max(len(snapshots) - self._keep, 0)]:
+            snapshot.unlink(missing_ok=True)
+            logging.info(f"Removed old backup {snapshot}")
+
+    def stats(self) -> dict:
+        return {"backups": self.backups, "failures": self.failures, "last": self.last}
@@ -0,0 +1,145 @@
+from aiohttp import web
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+from modules.libraries.storage import Storage
+from modules.libraries.models import Task
+from modules.libraries.recurrence import Recurrence, parse_deadline
+import logging
+
+
+class CalendarFeed:
+    def __init__(self, db: Storage, host: str, port: int):
+        self._db = db
+        self._host = host
+        self._port = port
+        self._runner = None
+
+    async def start(self) -> None:
+        app = web.Application()
+        app.router.add_get("/calendar/{token}.ics", self.handle_feed)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        await web.TCPSite(self._runner, self._host, self._port).start()
+        logging.info(f"Calendar feed is served on {self._host}:{self._port}")
+
+    async def stop(self) -> None:
+        if self._runner:
+            await self._runner.cleanup()
+            self._runner = None
+
+    async def handle_feed(self, request: web.Request) -> web.StreamResponse:
+        user_id = await self._db.fetch_user_by_calendar_token(
+            request.match_info["token"]
+        )
+        if user_id is None:
+            raise web.HTTPNotFound()
+
+        version = await self._db.fetch_calendar_version(user_id)
+        if version is None:
+            raise web.HTTPServiceUnavailable()
+
+        etag, last_modified = version
+        last_modified = (last_modified or datetime(1970, 1, 1)).replace(
+            tzinfo=timezone.utc, microsecond=0
+        )
+        headers = {
+            "ETag": f'"{etag}"',
+            "Last-Modified": format_datetime(last_modified, usegmt=True),
+            "Cache-Control": "private, no-cache",
+        }
+
+        if self._not_modified(request, f'"{etag}"', last_modified):
+            logging.info(f"Calendar feed of user with id {user_id} is not modified")
+            return web.Response(status=304, headers=headers)
+
+        response = web.StreamResponse(headers=headers)
+        response.content_type = "text/calendar"
+        response.charset = "utf-8"
+        await response.prepare(request)
+
+        dtstamp = last_modified.strftime("%Y%m%dT%H%M%SZ")
+        await response.write(
+            self._lines(
+                "BEGIN:VCALENDAR",
+                "VERSION:2.0",
+                "PRODID:-//ProdigyBot//Deadlines//EN",
+                "CALSCALE:GREGORIAN",
+                "X-WR-CALNAME:ProdigyBot",
+            )
+        )
+        async for task in self._db.iter_calendar_tasks(user_id):
+            await response.write(self._event(task, dtstamp))
+        await response.write(self._lines("END:VCALENDAR"))
+        await response.write_eof()
+
+        logging.info(f"Served calendar feed to user with id {user_id}")
+        return response
+
+    def _not_modified(
+        self, request: web.Request, etag: str, last_modified: datetime
+    ) -> bool:
+        if_none_match = request.headers.get("If-None-Match")
+        if if_none_match is not None:
+            return etag in [tag.strip() for tag in if_none_match.split(",")]
+
+        if_modified_since = request.headers.get("If-Modified-Since")
+        if if_modified_since:
+            try:
+                return last_modified <= parsedate_to_datetime(if_modified_since)
+            except (TypeError, ValueError):
+                return False
+        return False
+
+    def _event(self, task: Task, dtstamp: str) -> bytes:
+        try:
+            start = parse_deadline(task.deadline)
+        except (TypeError, ValueError):
+            return b""
+
+        summary = task.name
+        if task.status == "completed":
+            summary = f"✅ {summary}"
+
+        lines = [
+            "BEGIN:VEVENT",
+            f"UID:task-{task.id}@prodigybot",
+            f"DTSTAMP:{dtstamp}",
+            f"DTSTART;VALUE=DATE:{start:%Y%m%d}",
+            f"DTEND;VALUE=DATE:{start + timedelta(days=1):%Y%m%d}",
+            f"SUMMARY:{self._escape(summary)}",
+            f"DESCRIPTION:{self._escape(task.description or '')}",
+            f"CATEGORIES:{self._escape(task.project_name)}",
+            f"PRIORITY:{task.priority or 0}",
+        ]
+        if task.recurrence:
+            try:
+                lines.append(f"RRULE:{Recurrence.parse(task.recurrence).to_rrule()}")
+            except ValueError:
+                pass
+        lines.append("END:VEVENT")
+        return self._lines(*lines)
+
+    @staticmethod
+    def _escape(value: str) -> str:
+        return (
+            value.replace("\\", "\\\\")
+            .replace(";", "\\;")
+            .replace(",", "\\,")
+            .replace("\r\n", "\\n")
+            .replace("\n", "\\n")
+        )
+
+    @staticmethod
+    def _lines(*lines: str) -> bytes:
+        folded = []
+        for line in lines:
+            raw = line.encode("utf-8")
+            # Content lines are folded at 75 octets without splitting UTF-8 sequences
+            while len(raw) > 75:
+                cut = 75
+                while raw[cut] & 0xC0 == 0x80:
+                    cut -= 1
+                folded.append(raw[:cut])
+                raw = b" " + raw[cut:]
+            folded.append(raw)
+        return b"\r\n".join(folded) + b"\r\n"
@@ -0,0 +1,155 @@
+from modules.libraries.storage import Storage
+from typing import Union
+import asyncio, logging, time
+
+WATERMARK = "change_notifier"
+ENTITY_NAMES = {"task": "задача", "subtask": "подзадача"}
+
+
+class ChangeLogPruner:
+    def __init__(self, db: Storage, retention: float, batch_size: int, interval: float):
+        self._db = db
+        self._retention = retention
+        self._batch_size = batch_size
+        self._interval = interval
+        self.pruned = 0
+
+    async def run(self) -> None:
+        while True:
+            try:
+                self.pruned += await self._db.prune_changes(
+                    time.time() - self._retention, self._batch_size
+                )
+            except Exception as e:
+                logging.error(f"Error occurred while pruning changes: {e}")
+            await asyncio.sleep(self._interval)
+
+
+class ChangeNotifier:
+    # Tails the change log and tells the members of a project what the others
+    # changed in it. Everything since the previous run goes into one message
+    # per member, so the window is also how often a member can hear from it.
+    def __init__(
+        self,
+        db: Storage,
+        window: float,
+        batch_size: int,
+        rate: float,
+        notify_limit: int,
+        log: Union[Storage, None] = None,
+        name: str = "",
+    ):
+        self._db = db
+        # The change log tailed, one of db.change_logs(). Watermarks and
+        # notification keys carry the name of the log, seqs are per log.
+        self._log = log or db
+        self._watermark = WATERMARK + name
+        self._key = f"changes{name}"
+        self._window = window
+        self._batch_size = batch_size
+        self._rate = rate
+        self._notify_limit = notify_limit
+        self.notified = 0
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.notify_once()
+            except Exception as e:
+                logging.error(f"Error occurred while notifying about changes: {e}")
+            await asyncio.sleep(self._window)
+
+    async def notify_once(self) -> int:
+        # Notifications are keyed by the last seq they cover, a run that fails
+        # before moving the watermark enqueues the same keys again when redone
+        watermark = await self._db.fetch_watermark(self._watermark)
+        if watermark is None:
+            # The first run starts from now instead of the whole retained log
+            last = await self._log.fetch_last_change_seq()
+            if last is not None:
+                await self._db.set_watermark(self._watermark, str(last))
+            return 0
+
+        after = int(watermark)
+        changes = await self._log.fetch_changes(after, self._batch_size)
+        if not changes:
+            return 0
+        until = changes[-1].seq
+        fanout = await self._log.fetch_change_fanout(after, until)
+        if fanout is None:
+            return 0
+
+        # Rows added and deleted again within the window cancel out
+        messages = {}
+        for user_id, rows in fanout.items():
+            text = self.format_notification(rows)
+            if text:
+                messages[user_id] = text
+
+        # Spaced out at the given rate, a busy project with many members goes
+        # out over a few seconds instead of one burst at the Bot API
+        now = time.time()
+        if messages and not await self._db.enqueue_notifications(
+            [
+                (
+                    f"{self._key}:{user_id}:{until}",
+                    user_id,
+                    text,
+                    now + index / self._rate,
+                )
+                for index, (user_id, text) in enumerate(messages.items())
+            ]
+        ):
+            return 0
+
+        await self._db.set_watermark(self._watermark, str(until))
+        self.notified += len(fanout)
+        logging.info(f"Notified {len(fanout)} users about changes {after + 1}-{until}")
+        return len(fanout)
+
+    def format_notification(self, rows: list) -> Union[str, None]:
+        # rows are ordered by project and seq, every task or subtask is
+        # reported once with the outcome of all its changes
+        projects = {}
+        for row in rows:
+            project = projects.setdefault(
+                row["project_id"], {"name": row["project"], "actors": [], "items": {}}
+            )
+            if row["actor"] and row["actor"] not in project["actors"]:
+                project["actors"].append(row["actor"])
+            item = project["items"].setdefault(
+                (row["entity"], row["entity_id"]), {"first": row["op"]}
+            )
+            item.update(last=row["op"], name=row["name"], status=row["status"])
+
+        lines = []
+        shown = hidden = 0
+        for project in projects.values():
+            items = []
+            for (entity, entity_id), item in project["items"].items():
+                if item["first"] == "insert" and item["last"] == "delete":
+                    continue
+                if item["last"] == "delete":
+                    items.append(f"- {ENTITY_NAMES[entity]} #{entity_id} удалена")
+                    continue
+                if item["first"] == "insert":
+                    outcome = "добавлена"
+                elif item["status"] == "completed":
+                    outcome = "выполнена"
+                else:
+                    outcome = "изменена"
+                items.append(f"- {ENTITY_NAMES[entity]} «{item['name']}» {outcome}")
+            visible = items[: max(self._notify_limit - shown, 0)]
+            hidden += len(items) - len(visible)
+            if not visible:
+                continue
+            shown += len(visible)
+            actors = ", ".join(f"@{actor}" for actor in project["actors"])
+            lines.append(f"«{project['name']}»" + (f" ({actors}):" if actors else ":"))
+            lines.extend(visible)
+
+        if not lines:
+            return None
+        if hidden:
+            lines.append(f"...и еще {hidden}")
+        return "🔔 Изменения в проектах:\n" + "\n".join(lines)
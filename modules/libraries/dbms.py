@@ -1,92 +1,908 @@
 import aiosqlite
+import asyncio
+import json
 import logging
-from typing import Union
+import secrets
+import sqlite3
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+from pathlib import Path
+from datetime import date, datetime
+from modules.libraries.models import Change, Project, Subtask, Task, User
+from modules.libraries.recurrence import format_deadline
+from modules.libraries.storage import Storage, TASK_STATUSES, current_actor
+from typing import AsyncIterator, Union
 
+READER_POOL_SIZE = 4
+# A stepped backup starts over whenever another connection writes, after this
+# many restarts the copy is taken in one step from a single WAL snapshot
+BACKUP_MAX_RESTARTS = 3
 
-class Database:
-    def __init__(self, db: str):
+
+class _BackupRestarted(Exception):
+    pass
+
+
+# Every statement below fits in each connection's prepared statement cache
+STATEMENT_CACHE_SIZE = 256
+
+
+def _change_trigger(table: str, entity: str, key: str, project: str, event: str) -> str:
+    # Appends one row to the change log per changed row, inside the statement's
+    # own transaction. The version counts the entity's changes so far. Trigger
+    # bodies can't name a schema, "changes" resolves to main's.
+    row = "OLD" if event == "DELETE" else "NEW"
+    op = event.split()[0].lower()
+    return f"""
+        CREATE TEMP TRIGGER IF NOT EXISTS changes_{table}_{op}
+        AFTER {event} ON main.{table}
+        BEGIN
+            INSERT INTO changes (entity, entity_id, project_id, op, version, actor, created_at)
+            VALUES (
+                '{entity}',
+                {row}.{key},
+                {project.format(row=row)},
+                '{op}',
+                COALESCE((
+                    SELECT version FROM changes
+                    WHERE entity = '{entity}' AND entity_id = {row}.{key}
+                    ORDER BY seq DESC LIMIT 1
+                ), 0) + 1,
+                change_actor(),
+                (julianday('now') - 2440587.5) * 86400.0
+            );
+        END
+        """
+
+
+def _calendar_trigger(name: str, event: str, user_ids: str) -> str:
+    # Bumps the calendar version of every user the user_ids query returns. The
+    # WHERE keeps the parser from reading ON CONFLICT as a join constraint.
+    return f"""
+        CREATE TRIGGER IF NOT EXISTS {name}
+        AFTER {event}
+        BEGIN
+            INSERT INTO calendar_versions (user_id, version, updated_at)
+            SELECT user_id, 1, CURRENT_TIMESTAMP FROM ({user_ids}) WHERE true
+            ON CONFLICT (user_id) DO UPDATE SET
+                version = version + 1,
+                updated_at = MAX(updated_at, excluded.updated_at);
+        END
+        """
+
+
+class _SQL:
+    # Every statement lives here exactly once. sqlite3 caches prepared statements
+    # per connection by their text, so sharing one string keeps them compiled.
+
+    WRITER_PRAGMAS = (
+        "PRAGMA journal_mode=WAL",
+        "PRAGMA synchronous=NORMAL",
+        "PRAGMA busy_timeout=5000",
+    )
+    READER_PRAGMAS = ("PRAGMA busy_timeout=5000",)
+
+    TABLES = (
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER UNIQUE,
+            user_name TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            notifications BOOLEAN DEFAULT TRUE,
+            digest BOOLEAN DEFAULT FALSE,
+            calendar_token TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS projects (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            name TEXT NOT NULL,
+            description TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            version INTEGER DEFAULT 0,
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS tasks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            project_id INTEGER,
+            name TEXT NOT NULL,
+            description TEXT,
+            deadline TIMESTAMP,
+            priority INTEGER,
+            status TEXT CHECK(status IN ('in progress', 'completed')) DEFAULT 'in progress',
+            recurrence TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            completed_at TIMESTAMP,
+            overdue BOOLEAN DEFAULT FALSE,
+            FOREIGN KEY (project_id) REFERENCES projects (id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS subtasks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            task_id INTEGER,
+            name TEXT NOT NULL,
+            status TEXT CHECK(status IN ('in progress', 'completed')) DEFAULT 'in progress',
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            FOREIGN KEY (task_id) REFERENCES tasks (id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS shared_projects (
+            project_id INTEGER,
+            user_id INTEGER,
+            PRIMARY KEY (project_id, user_id),
+            FOREIGN KEY (project_id) REFERENCES projects (id),
+            FOREIGN KEY (user_id) REFERENCES users (user_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            idempotency_key TEXT NOT NULL UNIQUE,
+            chat_id INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            status TEXT CHECK(status IN ('pending', 'sent', 'failed')) DEFAULT 'pending',
+            attempts INTEGER DEFAULT 0,
+            not_before REAL NOT NULL,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            sent_at TIMESTAMP
+        )
+        """,
+        # Progress markers of periodic jobs, e.g. the last day the overdue sweeper covered
+        """
+        CREATE TABLE IF NOT EXISTS watermarks (
+            name TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+        """,
+        # Per-user counter behind the calendar feed's ETag, bumped by the calendar
+        # triggers. A sum of project versions could repeat once a project or a
+        # membership is gone, this one only grows.
+        """
+        CREATE TABLE IF NOT EXISTS calendar_versions (
+            user_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL,
+            updated_at TIMESTAMP NOT NULL
+        )
+        """,
+        # Append-only log of every mutation, tailed by seq to invalidate caches
+        # or sync incrementally. AUTOINCREMENT never hands out a seq twice.
+        """
+        CREATE TABLE IF NOT EXISTS changes (
+            seq INTEGER PRIMARY KEY AUTOINCREMENT,
+            entity TEXT NOT NULL,
+            entity_id INTEGER NOT NULL,
+            project_id INTEGER,
+            op TEXT CHECK(op IN ('insert', 'update', 'delete')) NOT NULL,
+            version INTEGER NOT NULL,
+            actor INTEGER,
+            created_at REAL NOT NULL
+        )
+        """,
+        # Which shard of how many the file is, see ShardedDatabase (shards.py).
+        # An unsharded database is shard 0 of 1.
+        """
+        CREATE TABLE IF NOT EXISTS shard (
+            id INTEGER PRIMARY KEY CHECK (id = 1),
+            shard INTEGER NOT NULL,
+            shards INTEGER NOT NULL
+        )
+        """,
+    )
+    INSERT_SHARD = "INSERT OR IGNORE INTO shard (id, shard, shards) VALUES (1, ?, ?)"
+    SELECT_SHARD = "SELECT shard, shards FROM shard"
+    # The next AUTOINCREMENT id of a table with id % shards = shard, so an id
+    # alone tells which shard holds the row. Shard 0 of 1 counts up as usual.
+    NEXT_ID = """(
+        SELECT q.seq + ((s.shard - q.seq - 1) % s.shards + s.shards) % s.shards + 1
+        FROM shard s, (
+            SELECT COALESCE(MAX(seq), 0) AS seq FROM sqlite_sequence WHERE name = '{table}'
+        ) q
+    )"""
+
+    # (table, column, definition) added to databases created before the column existed
+    COLUMNS = (
+        ("tasks", "recurrence", "TEXT"),
+        ("users", "calendar_token", "TEXT"),
+        ("users", "digest", "BOOLEAN DEFAULT FALSE"),
+        ("projects", "updated_at", "TIMESTAMP"),
+        ("projects", "version", "INTEGER DEFAULT 0"),
+        ("tasks", "completed_at", "TIMESTAMP"),
+        ("tasks", "overdue", "BOOLEAN DEFAULT FALSE"),
+        ("changes", "project_id", "INTEGER"),
+    )
+    TABLE_INFO = "PRAGMA table_info({table})"
+    ADD_COLUMN = "ALTER TABLE {table} ADD COLUMN {column} {definition}"
+
+    # Deadlines used to be stored as DD.MM.YYYY, which can't be range-scanned
+    MIGRATE_DEADLINES = """
+        UPDATE tasks
+        SET deadline = substr(deadline, 7, 4) || '-' || substr(deadline, 4, 2) || '-' || substr(deadline, 1, 2)
+        WHERE deadline LIKE '__.__.____'
+        """
+    # Tasks completed before completed_at existed start their archive countdown now
+    BACKFILL_COMPLETED_AT = """
+        UPDATE tasks SET completed_at = CURRENT_TIMESTAMP
+        WHERE status = 'completed' AND completed_at IS NULL
+        """
+
+    INDEXES = (
+        "CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox (status, not_before)",
+        "CREATE INDEX IF NOT EXISTS idx_tasks_project_deadline ON tasks (project_id, deadline)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_users_calendar_token ON users (calendar_token)",
+        "CREATE INDEX IF NOT EXISTS idx_projects_user ON projects (user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_users_user_name ON users (user_name COLLATE NOCASE)",
+        "CREATE INDEX IF NOT EXISTS idx_shared_projects_user ON shared_projects (user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_tasks_completed ON tasks (completed_at) WHERE status = 'completed'",
+        # /next walks open tasks in priority order and checks the project in the
+        # index, only the K rows it returns are read from the table
+        "CREATE INDEX IF NOT EXISTS idx_tasks_next ON tasks (status, priority, deadline, project_id)",
+        # The overdue sweeper range-scans open tasks it hasn't flagged by
+        # deadline. It used to cover flagged ones too, which every sweep would
+        # now walk again.
+        "DROP INDEX IF EXISTS idx_tasks_open_deadline",
+        "CREATE INDEX IF NOT EXISTS idx_tasks_unflagged_deadline ON tasks (deadline, id) WHERE status = 'in progress' AND NOT overdue",
+        # The latest change of an entity, for its next version and for pruning
+        "CREATE INDEX IF NOT EXISTS idx_changes_entity ON changes (entity, entity_id, seq)",
+        "CREATE INDEX IF NOT EXISTS idx_changes_created ON changes (created_at)",
+    )
+
+    # Completed tasks move to a separate database file attached as "archive",
+    # so the hot tables only hold active work
+    ATTACH_ARCHIVE = "ATTACH DATABASE ? AS archive"
+    ARCHIVE_PRAGMAS = ("PRAGMA archive.journal_mode=WAL",)
+    ARCHIVE_TABLES = (
+        """
+        CREATE TABLE IF NOT EXISTS archive.tasks (
+            id INTEGER PRIMARY KEY,
+            project_id INTEGER,
+            name TEXT NOT NULL,
+            description TEXT,
+            deadline TIMESTAMP,
+            priority INTEGER,
+            status TEXT,
+            recurrence TEXT,
+            created_at TIMESTAMP,
+            completed_at TIMESTAMP,
+            archived_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS archive.subtasks (
+            id INTEGER PRIMARY KEY,
+            task_id INTEGER,
+            name TEXT NOT NULL,
+            status TEXT,
+            created_at TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS archive.idx_archive_tasks_project ON tasks (project_id, completed_at)",
+        "CREATE INDEX IF NOT EXISTS archive.idx_archive_subtasks_task ON subtasks (task_id)",
+    )
+
+    # Every task change bumps its project, and every project change or
+    # deletion the calendar versions of its owner and members, so checking a
+    # feed for changes reads one row instead of scanning tasks
+    TRIGGERS = (
+        (
+            """
+        CREATE TRIGGER IF NOT EXISTS tasks_touch_project_insert
+        AFTER INSERT ON tasks
+        BEGIN
+            UPDATE projects SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+            WHERE id = NEW.project_id;
+        END
+        """,
+            """
+        CREATE TRIGGER IF NOT EXISTS tasks_touch_project_update
+        AFTER UPDATE ON tasks
+        BEGIN
+            UPDATE projects SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+            WHERE id IN (OLD.project_id, NEW.project_id);
+        END
+        """,
+            """
+        CREATE TRIGGER IF NOT EXISTS tasks_touch_project_delete
+        AFTER DELETE ON tasks
+        BEGIN
+            UPDATE projects SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+            WHERE id = OLD.project_id;
+        END
+        """,
+            """
+        CREATE TRIGGER IF NOT EXISTS projects_touch_update
+        AFTER UPDATE OF name, description ON projects
+        BEGIN
+            UPDATE projects SET version = version + 1, updated_at = CURRENT_TIMESTAMP
+            WHERE id = NEW.id;
+        END
+        """,
+        )
+        + tuple(
+            _calendar_trigger(name, event, user_ids)
+            for name, event, user_ids in (
+                (
+                    "projects_touch_calendar_update",
+                    "UPDATE ON projects WHEN OLD.version IS NOT NEW.version",
+                    "SELECT NEW.user_id AS user_id UNION SELECT user_id FROM shared_projects WHERE project_id = NEW.id",
+                ),
+                (
+                    "projects_touch_calendar_delete",
+                    "DELETE ON projects",
+                    "SELECT OLD.user_id AS user_id UNION SELECT user_id FROM shared_projects WHERE project_id = OLD.id",
+                ),
+                (
+                    "shared_projects_touch_calendar_insert",
+                    "INSERT ON shared_projects",
+                    "SELECT NEW.user_id AS user_id",
+                ),
+                (
+                    "shared_projects_touch_calendar_delete",
+                    "DELETE ON shared_projects",
+                    "SELECT OLD.user_id AS user_id",
+                ),
+            )
+        )
+    )
+
+    # Temporary triggers belong to the writer connection, which defines
+    # change_actor(); other programs writing to the file don't need it. Users
+    # are keyed by their Telegram id, project members by the project. Every
+    # change but a user's carries its project, so it can be fanned out to the
+    # members even once the row is gone.
+    CHANGE_TRIGGERS = tuple(
+        _change_trigger(table, entity, key, project, event)
+        for table, entity, key, project in (
+            ("users", "user", "user_id", "NULL"),
+            ("projects", "project", "id", "{row}.id"),
+            ("tasks", "task", "id", "{row}.project_id"),
+            (
+                "subtasks",
+                "subtask",
+                "id",
+                "(SELECT project_id FROM tasks WHERE id = {row}.task_id)",
+            ),
+            ("shared_projects", "member", "project_id", "{row}.project_id"),
+        )
+        # Version bumps from the calendar triggers aren't changes of the project
+        for event in (
+            "INSERT",
+            "UPDATE OF name, description" if table == "projects" else "UPDATE",
+            "DELETE",
+        )
+    )
+    HAS_CHANGES_TABLE = (
+        "SELECT 1 FROM main.sqlite_master WHERE type = 'table' AND name = 'changes'"
+    )
+
+    # Column lists match the slots of the models in modules.libraries.models
+    USER_COLUMNS = (
+        "id, user_id, user_name, created_at, notifications, digest, calendar_token"
+    )
+    TASK_COLUMNS = "t.id, t.name, t.description, t.deadline, t.priority, t.status, t.recurrence, t.overdue"
+    # Projects a user owns or was given access to, binds user_id twice
+    USER_PROJECT_IDS = """
+        SELECT id FROM projects WHERE user_id = ?
+        UNION
+        SELECT project_id FROM shared_projects WHERE user_id = ?
+        """
+
+    INSERT_USER = "INSERT INTO users (user_id, user_name) VALUES (?,?)"
+    SELECT_USER = f"SELECT {USER_COLUMNS} FROM users WHERE user_id = ?"
+    SELECT_USER_BY_NAME = (
+        f"SELECT {USER_COLUMNS} FROM users WHERE user_name = ? COLLATE NOCASE"
+    )
+    SELECT_USER_IDS = "SELECT user_id FROM users ORDER BY user_id"
+    UPDATE_USER_NAME = (
+        "UPDATE users SET user_name = ? WHERE user_id = ? AND user_name IS NOT ?"
+    )
+
+    INSERT_PROJECT = f"INSERT INTO projects (id, user_id, name, description) VALUES ({NEXT_ID.format(table='projects')},?,?,?)"
+    UPDATE_PROJECT = (
+        "UPDATE projects SET name = ?, description = ? WHERE user_id = ? AND name = ?"
+    )
+    DELETE_PROJECT = "DELETE FROM projects WHERE id = ?"
+    SELECT_PROJECTS = "SELECT id, name, description FROM projects WHERE user_id = ?"
+    SELECT_PROJECT = "SELECT id, name, description FROM projects WHERE id = ?"
+    SELECT_PROJECT_IDS = "SELECT id FROM projects WHERE user_id = ?"
+    SELECT_MEMBER_PROJECTS = """
+        SELECT p.id, p.name, p.description
+        FROM projects p
+        JOIN shared_projects sp ON p.id = sp.project_id
+        WHERE sp.user_id = ?
+        """
+
+    INSERT_TASK = f"INSERT INTO tasks (id, project_id, name, description, deadline, priority) VALUES ({NEXT_ID.format(table='tasks')},?,?,?,?,?)"
+    SELECT_TASKS = f"SELECT {TASK_COLUMNS} FROM tasks t WHERE t.project_id = ?"
+    SELECT_TASK = f"SELECT {TASK_COLUMNS} FROM tasks t WHERE t.id = ?"
+    COUNT_PROJECT_TASKS = "SELECT COUNT(*) FROM tasks WHERE project_id = ?"
+    # Id lists are bound as one JSON array, so a bulk statement has a single text
+    # whatever the number of ids and stays in the statement cache
+    SELECT_TASK_SCHEDULE = "SELECT id, deadline, recurrence FROM tasks WHERE id = ?"
+    SELECT_USER_TASK_SCHEDULES = f"""
+        SELECT id, deadline, recurrence FROM tasks
+        WHERE id IN (SELECT value FROM json_each(?))
+        AND project_id IN ({USER_PROJECT_IDS})
+        """
+    SELECT_PROJECT_TASK_SCHEDULES = f"""
+        SELECT id, deadline, recurrence FROM tasks
+        WHERE project_id = ?
+        AND project_id IN ({USER_PROJECT_IDS})
+        """
+    UPDATE_TASKS_STATUS = """
+        UPDATE tasks
+        SET status = ?,
+            completed_at = CASE WHEN ? = 'completed' THEN COALESCE(completed_at, CURRENT_TIMESTAMP) END
+        WHERE id IN (SELECT value FROM json_each(?))
+        """
+    ADVANCE_TASK = "UPDATE tasks SET deadline = ?, status = 'in progress', overdue = FALSE WHERE id = ?"
+    UPDATE_TASK_RECURRENCE = (
+        "UPDATE tasks SET recurrence = ? WHERE id = ? RETURNING deadline"
+    )
+    DELETE_TASK = "DELETE FROM tasks WHERE id = ? RETURNING deadline, recurrence"
+
+    INSERT_SUBTASK = f"INSERT INTO subtasks (id, task_id, name) VALUES ({NEXT_ID.format(table='subtasks')},?,?)"
+    SELECT_SUBTASKS = "SELECT id, name, status FROM subtasks WHERE task_id IN (SELECT id FROM tasks WHERE project_id = ?)"
+    SELECT_SUBTASK = "SELECT id, name, status FROM subtasks WHERE id = ?"
+    COUNT_PROJECT_SUBTASKS = "SELECT COUNT(*) FROM subtasks WHERE task_id IN (SELECT id FROM tasks WHERE project_id = ?)"
+    COMPLETE_SUBTASK = "UPDATE subtasks SET status = 'completed' WHERE id = ?"
+    COMPLETE_TASK_SUBTASKS = """
+        UPDATE subtasks SET status = 'completed'
+        WHERE task_id IN (SELECT value FROM json_each(?)) AND status != 'completed'
+        """
+    COMPLETE_USER_SUBTASKS = f"""
+        UPDATE subtasks SET status = 'completed'
+        WHERE id IN (SELECT value FROM json_each(?))
+        AND task_id IN (SELECT id FROM tasks WHERE project_id IN ({USER_PROJECT_IDS}))
+        RETURNING id, task_id
+        """
+    COMPLETE_PROJECT_SUBTASKS = f"""
+        UPDATE subtasks SET status = 'completed'
+        WHERE task_id IN (
+            SELECT id FROM tasks
+            WHERE project_id = ? AND project_id IN ({USER_PROJECT_IDS})
+        )
+        RETURNING id, task_id
+        """
+    # Recurring tasks are left alone, finishing a checklist shouldn't move a series
+    COMPLETE_FINISHED_TASKS = """
+        UPDATE tasks SET status = 'completed', completed_at = CURRENT_TIMESTAMP
+        WHERE id IN (SELECT value FROM json_each(?))
+        AND status != 'completed' AND recurrence IS NULL
+        AND NOT EXISTS (
+            SELECT 1 FROM subtasks
+            WHERE subtasks.task_id = tasks.id AND subtasks.status != 'completed'
+        )
+        RETURNING id, deadline
+        """
+    DELETE_SUBTASK = "DELETE FROM subtasks WHERE id = ?"
+
+    COUNT_PROJECT_MEMBER = (
+        "SELECT COUNT(*) FROM shared_projects WHERE project_id = ? AND user_id = ?"
+    )
+    SELECT_PROJECT_MEMBER = (
+        "SELECT 1 FROM shared_projects WHERE project_id = ? AND user_id = ? LIMIT 1"
+    )
+    INSERT_PROJECT_MEMBER = (
+        "INSERT INTO shared_projects (project_id, user_id) VALUES (?,?)"
+    )
+    ENQUEUE_SHARE_NOTIFICATION = """
+        INSERT OR IGNORE INTO outbox (idempotency_key, chat_id, text, not_before)
+        SELECT ?, u.user_id, 'Вам открыли доступ к проекту «' || p.name || '». Проверьте командой /projects.', ?
+        FROM users u, projects p
+        WHERE u.user_id = ? AND p.id = ? AND u.notifications
+        """
+
+    SELECT_CALENDAR_TOKEN = "SELECT calendar_token FROM users WHERE user_id = ?"
+    UPDATE_CALENDAR_TOKEN = "UPDATE users SET calendar_token = ? WHERE user_id = ?"
+    SELECT_USER_BY_CALENDAR_TOKEN = "SELECT user_id FROM users WHERE calendar_token = ?"
+    # Users nothing was bumped for yet are at version 0 since they signed up
+    SELECT_CALENDAR_VERSION = """
+        SELECT COALESCE(v.version, 0), COALESCE(v.updated_at, u.created_at)
+        FROM users u
+        LEFT JOIN calendar_versions v ON v.user_id = u.user_id
+        WHERE u.user_id = ?
+        """
+    SELECT_CALENDAR_TASKS = f"""
+        SELECT {TASK_COLUMNS}, p.name
+        FROM tasks t
+        JOIN projects p ON p.id = t.project_id
+        WHERE t.project_id IN ({USER_PROJECT_IDS})
+        AND t.deadline IS NOT NULL
+        ORDER BY t.deadline
+        """
+    SELECT_DEADLINE_COUNTS = f"""
+        SELECT deadline, recurrence, COUNT(*)
+        FROM tasks
+        WHERE project_id IN ({USER_PROJECT_IDS})
+        AND status != 'completed'
+        AND (
+            deadline BETWEEN ? AND ?
+            OR (recurrence IS NOT NULL AND deadline <= ?)
+        )
+        GROUP BY deadline, recurrence
+        """
+    SELECT_TASKS_BY_DAY = f"""
+        SELECT {TASK_COLUMNS}, p.name
+        FROM tasks t
+        JOIN projects p ON p.id = t.project_id
+        WHERE t.project_id IN ({USER_PROJECT_IDS})
+        AND (
+            t.deadline = ?
+            OR (t.recurrence IS NOT NULL AND t.deadline <= ?)
+        )
+        ORDER BY t.priority
+        """
+
+    # The ORDER BY is the column order of idx_tasks_next, so there is no sort step
+    SELECT_NEXT_TASKS = f"""
+        SELECT {TASK_COLUMNS}, p.name
+        FROM tasks t
+        JOIN projects p ON p.id = t.project_id
+        WHERE t.status = 'in progress'
+        AND t.project_id IN ({USER_PROJECT_IDS})
+        ORDER BY t.priority, t.deadline, t.project_id, t.id
+        LIMIT ?
+        """
+
+    SELECT_NOTIFICATION_SETTINGS = (
+        "SELECT notifications, digest FROM users WHERE user_id = ?"
+    )
+    UPDATE_NOTIFICATION_SETTINGS = """
+        UPDATE users
+        SET notifications = COALESCE(?, notifications), digest = COALESCE(?, digest)
+        WHERE user_id = ?
+        """
+    SELECT_DIGEST_TASKS = f"""
+        SELECT m.user_id, {TASK_COLUMNS}, p.name
+        FROM (
+            SELECT id AS project_id, user_id FROM projects
+            UNION
+            SELECT project_id, user_id FROM shared_projects
+        ) m
+        JOIN users u ON u.user_id = m.user_id
+        JOIN tasks t ON t.project_id = m.project_id
+        JOIN projects p ON p.id = t.project_id
+        WHERE u.notifications AND u.digest
+        AND t.status != 'completed'
+        AND t.deadline <= ?
+        ORDER BY m.user_id, t.deadline, t.priority
+        """
+
+    ENQUEUE_NOTIFICATION = """
+        INSERT OR IGNORE INTO outbox (idempotency_key, chat_id, text, not_before)
+        VALUES (?,?,?,?)
+        """
+    SELECT_OUTBOX_BATCH = """
+        SELECT id, idempotency_key, chat_id, text, attempts
+        FROM outbox
+        WHERE status = 'pending' AND not_before <= ?
+        ORDER BY not_before
+        LIMIT ?
+        """
+    MARK_OUTBOX_SENT = """
+        UPDATE outbox
+        SET status = 'sent', attempts = attempts + 1, sent_at = CURRENT_TIMESTAMP
+        WHERE id = ?
+        """
+    MARK_OUTBOX_RETRY = """
+        UPDATE outbox
+        SET status = CASE WHEN ? IS NULL THEN 'failed' ELSE 'pending' END,
+            attempts = attempts + 1,
+            not_before = COALESCE(?, not_before),
+            last_error = ?
+        WHERE id = ?
+        """
+    PRUNE_OUTBOX = "DELETE FROM outbox WHERE status != 'pending' AND not_before < ?"
+
+    SELECT_WATERMARK = "SELECT value FROM watermarks WHERE name = ?"
+    UPSERT_WATERMARK = """
+        INSERT INTO watermarks (name, value) VALUES (?, ?)
+        ON CONFLICT (name) DO UPDATE SET value = excluded.value
+        """
+    # Open tasks due before until that aren't flagged yet, however they got
+    # there, once for every member of their project who wants notifications
+    SELECT_NEW_OVERDUE_TASKS = f"""
+        SELECT m.user_id, {TASK_COLUMNS}, p.name
+        FROM tasks t INDEXED BY idx_tasks_unflagged_deadline
+        JOIN projects p ON p.id = t.project_id
+        JOIN (
+            SELECT id AS project_id, user_id FROM projects
+            UNION
+            SELECT project_id, user_id FROM shared_projects
+        ) m ON m.project_id = t.project_id
+        JOIN users u ON u.user_id = m.user_id
+        WHERE t.status = 'in progress' AND NOT t.overdue
+        AND t.deadline < ?
+        AND u.notifications
+        ORDER BY m.user_id, t.deadline, t.priority, t.id
+        """
+    # The tasks the sweeper notified about, still open
+    MARK_OVERDUE = """
+        UPDATE tasks SET overdue = TRUE
+        WHERE id IN (SELECT value FROM json_each(?))
+        AND status = 'in progress' AND NOT overdue
+        """
+    # Tasks nobody is notified about are flagged without a notification.
+    # Keyset pagination over idx_tasks_unflagged_deadline: every batch starts
+    # where the previous one stopped instead of rescanning from the start.
+    # Without statistics SQLite would rather take idx_tasks_next for the status.
+    SELECT_QUIET_OVERDUE_BATCH = """
+        SELECT t.id, t.deadline FROM tasks t INDEXED BY idx_tasks_unflagged_deadline
+        WHERE t.status = 'in progress' AND NOT t.overdue
+        AND (t.deadline, t.id) > (?, ?) AND t.deadline < ?
+        AND NOT EXISTS (
+            SELECT 1 FROM projects p JOIN users u ON u.user_id = p.user_id
+            WHERE p.id = t.project_id AND u.notifications
+        )
+        AND NOT EXISTS (
+            SELECT 1 FROM shared_projects sp JOIN users u ON u.user_id = sp.user_id
+            WHERE sp.project_id = t.project_id AND u.notifications
+        )
+        ORDER BY t.deadline, t.id
+        LIMIT ?
+        """
+
+    SELECT_CHANGES = """
+        SELECT seq, entity, entity_id, project_id, op, version, actor, created_at
+        FROM changes
+        WHERE seq > ?
+        ORDER BY seq
+        LIMIT ?
+        """
+    SELECT_LAST_CHANGE_SEQ = "SELECT COALESCE(MAX(seq), 0) FROM changes"
+    # Task and subtask changes users made, once for every other member of the
+    # project who wants notifications. Deleted rows have no name any more.
+    SELECT_CHANGE_FANOUT = """
+        SELECT m.user_id, c.project_id, p.name, a.user_name, c.entity, c.entity_id, c.op,
+            COALESCE(t.name, s.name), COALESCE(t.status, s.status)
+        FROM changes c
+        JOIN projects p ON p.id = c.project_id
+        JOIN (
+            SELECT id AS project_id, user_id FROM projects
+            UNION
+            SELECT project_id, user_id FROM shared_projects
+        ) m ON m.project_id = c.project_id
+        JOIN users u ON u.user_id = m.user_id
+        LEFT JOIN users a ON a.user_id = c.actor
+        LEFT JOIN tasks t ON c.entity = 'task' AND t.id = c.entity_id
+        LEFT JOIN subtasks s ON c.entity = 'subtask' AND s.id = c.entity_id
+        WHERE c.seq > ? AND c.seq <= ?
+        AND c.entity IN ('task', 'subtask')
+        AND c.actor IS NOT NULL AND m.user_id != c.actor
+        AND u.notifications
+        ORDER BY m.user_id, c.project_id, c.seq
+        """
+    # An entity's latest change stays, it carries the version the next one
+    # continues from. Deleted tasks, subtasks and projects never come back, their
+    # ids aren't reused, so that goes too. Keyset pagination over
+    # idx_changes_created, binds the created_at and seq to start after.
+    SELECT_PRUNABLE_CHANGES = """
+        SELECT c.seq, c.created_at FROM changes c
+        WHERE c.created_at < ? AND (c.created_at, c.seq) > (?, ?)
+        AND (
+            (c.op = 'delete' AND c.entity IN ('project', 'task', 'subtask'))
+            OR EXISTS (
+                SELECT 1 FROM changes n
+                WHERE n.entity = c.entity AND n.entity_id = c.entity_id AND n.seq > c.seq
+            )
+        )
+        ORDER BY c.created_at, c.seq
+        LIMIT ?
+        """
+    DELETE_CHANGES = "DELETE FROM changes WHERE seq IN (SELECT value FROM json_each(?))"
+
+    SELECT_ARCHIVABLE_TASKS = """
+        SELECT id FROM tasks
+        WHERE status = 'completed' AND completed_at < datetime('now', ?)
+        ORDER BY completed_at
+        LIMIT ?
+        """
+    # A batch is copied before it is deleted and copies replace, so a batch cut
+    # short between the two files is simply moved again by the next run
+    ARCHIVE_BATCH = (
+        """
+        INSERT OR REPLACE INTO archive.tasks
+            (id, project_id, name, description, deadline, priority, status, recurrence, created_at, completed_at)
+        SELECT id, project_id, name, description, deadline, priority, status, recurrence, created_at, completed_at
+        FROM main.tasks WHERE id IN (SELECT value FROM json_each(?))
+        """,
+        """
+        INSERT OR REPLACE INTO archive.subtasks (id, task_id, name, status, created_at)
+        SELECT id, task_id, name, status, created_at
+        FROM main.subtasks WHERE task_id IN (SELECT value FROM json_each(?))
+        """,
+        "DELETE FROM main.subtasks WHERE task_id IN (SELECT value FROM json_each(?))",
+        "DELETE FROM main.tasks WHERE id IN (SELECT value FROM json_each(?))",
+    )
+    # Archived tasks are completed, they are never overdue
+    SELECT_ARCHIVED_TASKS = f"""
+        SELECT t.id, t.name, t.description, t.deadline, t.priority, t.status, t.recurrence, FALSE, p.name, t.completed_at
+        FROM archive.tasks t
+        JOIN main.projects p ON p.id = t.project_id
+        WHERE t.project_id IN ({USER_PROJECT_IDS})
+        ORDER BY t.completed_at DESC, t.id DESC
+        LIMIT ? OFFSET ?
+        """
+
+
+class Database(Storage):
+    def __init__(
+        self,
+        db: str,
+        readers: int = READER_POOL_SIZE,
+        archive: Union[str, None] = None,
+        shard: int = 0,
+        shards: int = 1,
+    ):
+        super().__init__()
         self.db_path = db
+        self.shard_index = shard
+        self.shard_count = shards
+        # database/prodigy_bot.db -> database/prodigy_bot_archive.db
+        path = Path(db)
+        self.archive_path = archive or str(
+            path.with_name(f"{path.stem}_archive{path.suffix}")
+        )
+        # fetch_* methods share a pool of read-only connections, mutations go
+        # through one writer connection; under WAL readers never wait for it
+        self._readers_count = readers
+        self._readers = None
+        self._reader_waiters = deque()
+        self._writer = None
+        self._writer_lock = asyncio.Lock()
+        self._connect_lock = asyncio.Lock()
+        # Actor of the transaction holding the writer, read by change_actor()
+        self._actor = None
 
-    async def create_tables(self):
-        async with aiosqlite.connect(self.db_path) as db:
-            async with db.cursor() as cursor:
-                await cursor.execute(
-                    """
-                    CREATE TABLE IF NOT EXISTS users (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER UNIQUE,
-                        user_name TEXT NOT NULL,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        notifications BOOLEAN DEFAULT TRUE
-                    )
-                    """
-                )
+    async def connect(self) -> None:
+        async with self._connect_lock:
+            if self._writer is not None:
+                return
 
-                await cursor.execute(
-                    """
-                    CREATE TABLE IF NOT EXISTS projects (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        user_id INTEGER,
-                        name TEXT NOT NULL,
-                        description TEXT,
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY (user_id) REFERENCES users (user_id)
-                    )
-                    """
-                )
+            writer = await aiosqlite.connect(
+                self.db_path, cached_statements=STATEMENT_CACHE_SIZE
+            )
+            for pragma in _SQL.WRITER_PRAGMAS:
+                await writer.execute_fetchall(pragma)
+            await writer.execute(_SQL.ATTACH_ARCHIVE, (self.archive_path,))
+            for pragma in _SQL.ARCHIVE_PRAGMAS:
+                await writer.execute_fetchall(pragma)
+            await writer.create_function("change_actor", 0, self._change_actor)
+            # A new database gets the change triggers from create_tables
+            if await writer.execute_fetchall(_SQL.HAS_CHANGES_TABLE):
+                for statement in _SQL.CHANGE_TRIGGERS:
+                    await writer.execute(statement)
 
-                await cursor.execute(
-                    """
-                    CREATE TABLE IF NOT EXISTS tasks (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        project_id INTEGER,
-                        name TEXT NOT NULL,
-                        description TEXT,
-                        deadline TIMESTAMP,
-                        priority INTEGER,
-                        status TEXT CHECK(status IN ('in progress', 'completed')) DEFAULT 'in progress',
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY (project_id) REFERENCES projects (id)
-                    )
-                    """
+            readers = deque()
+            for _ in range(self._readers_count):
+                reader = await aiosqlite.connect(
+                    f"{Path(self.db_path).resolve().as_uri()}?mode=ro",
+                    uri=True,
+                    cached_statements=STATEMENT_CACHE_SIZE,
                 )
-
-                await cursor.execute(
-                    """
-                    CREATE TABLE IF NOT EXISTS subtasks (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        task_id INTEGER,
-                        name TEXT NOT NULL,
-                        status TEXT CHECK(status IN ('in progress', 'completed')) DEFAULT 'in progress',
-                        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                        FOREIGN KEY (task_id) REFERENCES tasks (id)
-                    )
-                    """
+                for pragma in _SQL.READER_PRAGMAS:
+                    await reader.execute_fetchall(pragma)
+                await reader.execute(
+                    _SQL.ATTACH_ARCHIVE,
+                    (f"{Path(self.archive_path).resolve().as_uri()}?mode=ro",),
                 )
+                readers.append(reader)
+
+            self._writer, self._readers = writer, readers
+            logging.info(
+                f"Opened writer and {self._readers_count} reader connections to {self.db_path}"
+            )
+
+    @asynccontextmanager
+    async def _read(self):
+        if self._writer is None:
+            await self.connect()
+        if self._readers and not self._reader_waiters:
+            conn = self._readers.popleft()
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            self._reader_waiters.append(waiter)
+            try:
+                conn = await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    self._release_reader(waiter.result())
+                else:
+                    self._reader_waiters.remove(waiter)
+                raise
+        try:
+            yield conn
+        finally:
+            self._release_reader(conn)
 
+    def _release_reader(self, conn) -> None:
+        # The connection is handed straight to the longest waiting caller, so a
+        # caller that reads in a tight loop can't take it back ahead of the others
+        while self._reader_waiters:
+            waiter = self._reader_waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(conn)
+                return
+        self._readers.append(conn)
+
+    @asynccontextmanager
+    async def _write(self):
+        if self._writer is None:
+            await self.connect()
+        async with self._writer_lock:
+            self._actor = current_actor.get()
+            try:
+                yield self._writer
+            finally:
+                # Nothing uncommitted may leak into the next writer's transaction
+                if self._writer.in_transaction:
+                    await self._writer.rollback()
+
+    def _change_actor(self) -> Union[int, None]:
+        return self._actor
+
+    def stats(self) -> dict:
+        return {
+            **super().stats(),
+            "idle_readers": len(self._readers or ()),
+            "reader_waiters": len(self._reader_waiters),
+        }
+
+    async def create_tables(self):
+        async with self._write() as db:
+            async with db.cursor() as cursor:
+                for statement in _SQL.TABLES:
+                    await cursor.execute(statement)
+                for table, column, definition in _SQL.COLUMNS:
+                    await self._add_column(cursor, table, column, definition)
+                await cursor.execute(_SQL.MIGRATE_DEADLINES)
+                await cursor.execute(_SQL.BACKFILL_COMPLETED_AT)
+                # Ids already handed out depend on it, a file can't change shard
                 await cursor.execute(
-                    """
-                    CREATE TABLE IF NOT EXISTS shared_projects (
-                        project_id INTEGER,
-                        user_id INTEGER,
-                        PRIMARY KEY (project_id, user_id),
-                        FOREIGN KEY (project_id) REFERENCES projects (id),
-                        FOREIGN KEY (user_id) REFERENCES users (user_id)
-                    )
-                    """
+                    _SQL.INSERT_SHARD, (self.shard_index, self.shard_count)
                 )
+                await cursor.execute(_SQL.SELECT_SHARD)
+                shard = tuple(await cursor.fetchone())
+                if shard != (self.shard_index, self.shard_count):
+                    raise ValueError(
+                        f"{self.db_path} is shard {shard[0]} of {shard[1]}, not {self.shard_index} of {self.shard_count}"
+                    )
+                for statement in (
+                    _SQL.INDEXES
+                    + _SQL.TRIGGERS
+                    + _SQL.CHANGE_TRIGGERS
+                    + _SQL.ARCHIVE_TABLES
+                ):
+                    await cursor.execute(statement)
 
                 logging.info("Successfully created tables")
                 await db.commit()
 
+    async def _add_column(self, cursor, table: str, column: str, definition: str):
+        await cursor.execute(_SQL.TABLE_INFO.format(table=table))
+        columns = [row[1] for row in await cursor.fetchall()]
+        if column not in columns:
+            await cursor.execute(
+                _SQL.ADD_COLUMN.format(
+                    table=table, column=column, definition=definition
+                )
+            )
+            logging.info(f"Added column {column} to table {table}")
+
     async def add_user(self, user_id: int, user_name: str) -> bool:
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._write() as db:
                 async with db.cursor() as cursor:
-                    await cursor.execute(
-                        "INSERT INTO users (user_id, user_name) VALUES (?,?)",
-                        (user_id, user_name),
-                    )
+                    await cursor.execute(_SQL.INSERT_USER, (user_id, user_name or ""))
                     await db.commit()
                     logging.info(f"Added user with ID {user_id} and name {user_name}")
                     return True
@@ -99,28 +915,64 @@ class Database:
             logging.error(f"Error occurred while adding user: {e}")
             return False
 
-    async def fetch_user(self, user_id: int) -> list:
+    async def fetch_user(self, user_id: int) -> Union[User, None]:
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._read() as db:
                 async with db.cursor() as cursor:
-                    await cursor.execute(
-                        "SELECT * FROM users WHERE user_id=?", (user_id,)
-                    )
+                    cursor.row_factory = User.from_row
+                    await cursor.execute(_SQL.SELECT_USER, (user_id,))
                     user = await cursor.fetchone()
                     return user
         except Exception as e:
             logging.error(f"Error occurred while fetching user: {e}")
             return None
 
-    async def new_project(self, user_id: int, name: str, desc: str) -> bool:
+    async def fetch_user_ids(self) -> list:
+        user_ids = []
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._read() as db:
                 async with db.cursor() as cursor:
-                    await cursor.execute(
-                        "INSERT INTO projects (user_id, name, description) VALUES (?,?,?)",
-                        (user_id, name, desc),
+                    await cursor.execute(_SQL.SELECT_USER_IDS)
+                    user_ids = [row[0] for row in await cursor.fetchall()]
+                    logging.info(f"Fetched {len(user_ids)} user ids")
+        except Exception as e:
+            logging.error(f"Error occurred while fetching user ids: {e}")
+        return user_ids
+
+    async def fetch_user_by_name(self, user_name: str) -> Union[User, None]:
+        try:
+            async with self._read() as db:
+                async with db.cursor() as cursor:
+                    cursor.row_factory = User.from_row
+                    await cursor.execute(_SQL.SELECT_USER_BY_NAME, (user_name,))
+                    user = await cursor.fetchone()
+                    return user
+        except Exception as e:
+            logging.error(f"Error occurred while fetching user by name: {e}")
+            return None
+
+    async def update_user_names(self, user_names: list) -> bool:
+        # user_names: (user_id, user_name) pairs, unchanged rows are not rewritten
+        try:
+            async with self._write() as db:
+                async with db.cursor() as cursor:
+                    await cursor.executemany(
+                        _SQL.UPDATE_USER_NAME,
+                        [(name, user_id, name) for user_id, name in user_names],
                     )
                     await db.commit()
+                    logging.info(f"Refreshed {len(user_names)} user names")
+                    return True
+        except Exception as e:
+            logging.error(f"Error occurred while updating user names: {e}")
+            return False
+
+    async def new_project(self, user_id: int, name: str, desc: str) -> bool:
+        try:
+            async with self._write() as db:
+                async with db.cursor() as cursor:
+                    await cursor.execute(_SQL.INSERT_PROJECT, (user_id, name, desc))
+                    await db.commit()
                     logging.info(
                         f"User with id {user_id} successfully created new project with name {name}"
                     )
@@ -133,11 +985,10 @@ class Database:
         self, user_id: int, old_name: str, new_name: str, new_desc: str
     ) -> bool:
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._write() as db:
                 async with db.cursor() as cursor:
                     await cursor.execute(
-                        "UPDATE projects SET name=?, description=? WHERE user_id=? AND name=?",
-                        (new_name, new_desc, user_id, old_name),
+                        _SQL.UPDATE_PROJECT, (new_name, new_desc, user_id, old_name)
                     )
                     await db.commit()
                     logging.info(
@@ -150,12 +1001,11 @@ class Database:
 
     async def delete_project(self, project_id: int) -> bool:
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._write() as db:
                 async with db.cursor() as cursor:
-                    await cursor.execute(
-                        "DELETE FROM projects WHERE id =?", (project_id,)
-                    )
+                    await cursor.execute(_SQL.DELETE_PROJECT, (project_id,))
                     await db.commit()
+                    self._invalidate_calendar()
                     logging.info(f"Deleted project with id {project_id}")
                     return True
         except Exception as e:
@@ -165,30 +1015,22 @@ class Database:
     async def fetch_projects(self, user_id: int) -> list:
         projects = []
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._read() as db:
                 async with db.cursor() as cursor:
-                    await cursor.execute(
-                        "SELECT id, name, description FROM projects WHERE user_id = ?",
-                        (user_id,),
-                    )
-                    rows = await cursor.fetchall()
-                    for row in rows:
-                        projects.append(
-                            {"id": row[0], "name": row[1], "description": row[2]}
-                        )
+                    cursor.row_factory = Project.from_row
+                    await cursor.execute(_SQL.SELECT_PROJECTS, (user_id,))
+                    projects = await cursor.fetchall()
                     logging.info(f"Fetched all projects for user with id {user_id}")
         except Exception as e:
             logging.error(f"Error occurred while fetching projects: {e}")
         return projects
 
-    async def fetch_project(self, project_id: int) -> list:
+    async def fetch_project(self, project_id: int) -> Union[Project, None]:
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._read() as db:
                 async with db.cursor() as cursor:
-                    await cursor.execute(
-                        "SELECT id, name, description FROM projects WHERE id =?",
-                        (project_id,),
-                    )
+                    cursor.row_factory = Project.from_row
+                    await cursor.execute(_SQL.SELECT_PROJECT, (project_id,))
                     project = await cursor.fetchone()
                     return project
         except Exception as e:
@@ -201,14 +1043,14 @@ class Database:
         project_id: int,
         task_name: str,
         task_description: str,
-        task_deadline: any,
+        task_deadline: str,
         priority: int,
     ) -> bool:
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._write() as db:
                 async with db.cursor() as cursor:
                     await cursor.execute(
-                        "INSERT INTO tasks (project_id, name, description, deadline, priority) VALUES (?,?,?,?,?)",
+                        _SQL.INSERT_TASK,
                         (
                             project_id,
                             task_name,
@@ -218,6 +1060,7 @@ class Database:
                         ),
                     )
                     await db.commit()
+                    self._invalidate_calendar(task_deadline)
                     logging.info(
                         f"User with id {user_id} successfully created new task with name {task_name} for project with ID {project_id}"
                     )
@@ -229,48 +1072,25 @@ class Database:
     async def fetch_tasks(self, project_id: int) -> list:
         tasks = []
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._read() as db:
                 async with db.cursor() as cursor:
-                    await cursor.execute(
-                        "SELECT id, name, description, deadline, priority, status FROM tasks WHERE project_id =?",
-                        (project_id,),
-                    )
-                    rows = await cursor.fetchall()
-                    for row in rows:
-                        tasks.append(
-                            {
-                                "id": row[0],
-                                "name": row[1],
-                                "description": row[2],
-                                "deadline": row[3],
-                                "priority": row[4],
-                                "status": row[5],
-                            }
-                        )
+                    cursor.row_factory = Task.from_row
+                    await cursor.execute(_SQL.SELECT_TASKS, (project_id,))
+                    tasks = await cursor.fetchall()
                     logging.info(f"Fetched all tasks for project with id {project_id}")
         except Exception as e:
             logging.error(f"Error occurred while fetching tasks: {e}")
         return tasks
 
-    async def fetch_task(self, task_id: int) -> dict:
+    async def fetch_task(self, task_id: int) -> Union[Task, None]:
         task = None
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._read() as db:
                 async with db.cursor() as cursor:
-                    await cursor.execute(
-                        "SELECT id, name, description, deadline, priority, status FROM tasks WHERE id = ?",
-                        (task_id,),
-                    )
-                    row = await cursor.fetchone()
-                    if row:
-                        task = {
-                            "id": row[0],
-                            "name": row[1],
-                            "description": row[2],
-                            "deadline": row[3],
-                            "priority": row[4],
-                            "status": row[5],
-                        }
+                    cursor.row_factory = Task.from_row
+                    await cursor.execute(_SQL.SELECT_TASK, (task_id,))
+                    task = await cursor.fetchone()
+                    if task:
                         logging.info(f"Fetched task with id {task_id}")
                     else:
                         logging.info(f"Task with id {task_id} not found.")
@@ -281,11 +1101,9 @@ class Database:
 
     async def user_has_tasks(self, user_id: int) -> bool:
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._read() as db:
                 async with db.cursor() as cursor:
-                    await cursor.execute(
-                        "SELECT id FROM projects WHERE user_id = ?", (user_id,)
-                    )
+                    await cursor.execute(_SQL.SELECT_PROJECT_IDS, (user_id,))
                     projects = await cursor.fetchall()
 
                     if not projects:
@@ -294,10 +1112,7 @@ class Database:
 
                     for project in projects:
                         project_id = project[0]
-                        await cursor.execute(
-                            "SELECT COUNT(*) FROM tasks WHERE project_id = ?",
-                            (project_id,),
-                        )
+                        await cursor.execute(_SQL.COUNT_PROJECT_TASKS, (project_id,))
                         task_count = await cursor.fetchone()
 
                         if task_count and task_count[0] > 0:
@@ -313,33 +1128,99 @@ class Database:
             return False
 
     async def edit_task(self, task_id: int, progress: int) -> bool:
-        if progress == 1:
-            progress = "completed"
-        elif progress == 0:
-            progress = "in progress"
-        else:
+        if progress not in TASK_STATUSES:
             logging.error(f"Invalid progress value: {progress}")
             return False
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._write() as db:
                 async with db.cursor() as cursor:
-                    await cursor.execute(
-                        "UPDATE tasks SET status=? WHERE id =?",
-                        (progress, task_id),
-                    )
+                    await cursor.execute(_SQL.SELECT_TASK_SCHEDULE, (task_id,))
+                    rows = await cursor.fetchall()
+                    await self._apply_task_status(cursor, rows, TASK_STATUSES[progress])
                     await db.commit()
-                    logging.info(f"Updated task with id {task_id} to status {progress}")
+                    logging.info(
+                        f"Updated task with id {task_id} to status {TASK_STATUSES[progress]}"
+                    )
                     return True
         except Exception as e:
             logging.error(f"Error occurred while editing task: {e}")
             return False
 
+    async def edit_tasks(
+        self,
+        user_id: int,
+        progress: int,
+        task_ids: Union[list, None] = None,
+        project_id: Union[int, None] = None,
+    ) -> Union[list, None]:
+        # Either explicit ids or every task of a project; tasks outside the
+        # user's projects are skipped. Returns the ids that were updated.
+        if progress not in TASK_STATUSES:
+            logging.error(f"Invalid progress value: {progress}")
+            return None
+        try:
+            async with self._write() as db:
+                async with db.cursor() as cursor:
+                    if project_id is not None:
+                        await cursor.execute(
+                            _SQL.SELECT_PROJECT_TASK_SCHEDULES,
+                            (project_id, user_id, user_id),
+                        )
+                    else:
+                        await cursor.execute(
+                            _SQL.SELECT_USER_TASK_SCHEDULES,
+                            (json.dumps(task_ids), user_id, user_id),
+                        )
+                    rows = await cursor.fetchall()
+                    await self._apply_task_status(cursor, rows, TASK_STATUSES[progress])
+                    await db.commit()
+                    logging.info(
+                        f"User with id {user_id} updated {len(rows)} tasks to status {TASK_STATUSES[progress]}"
+                    )
+                    return [row[0] for row in rows]
+        except Exception as e:
+            logging.error(f"Error occurred while editing tasks: {e}")
+            return None
+
+    async def _apply_task_status(self, cursor, rows: list, status: str) -> None:
+        # rows: (id, deadline, recurrence). Runs inside the caller's transaction.
+        if status == "completed":
+            await cursor.executemany(_SQL.ADVANCE_TASK, self._next_deadlines(rows))
+
+        task_ids = json.dumps(
+            [row[0] for row in rows if status != "completed" or not row[2]]
+        )
+        await cursor.execute(_SQL.UPDATE_TASKS_STATUS, (status, status, task_ids))
+        if status == "completed":
+            await cursor.execute(_SQL.COMPLETE_TASK_SUBTASKS, (task_ids,))
+
+        for _, deadline, rule in rows:
+            self._invalidate_calendar(deadline, recurring=bool(rule))
+
+    async def set_task_recurrence(self, task_id: int, rule: Union[str, None]) -> bool:
+        try:
+            async with self._write() as db:
+                async with db.cursor() as cursor:
+                    await cursor.execute(_SQL.UPDATE_TASK_RECURRENCE, (rule, task_id))
+                    row = await cursor.fetchone()
+                    await db.commit()
+                    if row:
+                        self._invalidate_calendar(row[0], recurring=True)
+                    logging.info(f"Set recurrence of task with id {task_id} to {rule}")
+                    return True
+        except Exception as e:
+            logging.error(f"Error occurred while setting task recurrence: {e}")
+            return False
+
     async def remove_task(self, task_id: int) -> bool:
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._write() as db:
                 async with db.cursor() as cursor:
-                    await cursor.execute("DELETE FROM tasks WHERE id =?", (task_id,))
+                    await cursor.execute(_SQL.DELETE_TASK, (task_id,))
+                    row = await cursor.fetchone()
                     await db.commit()
+                    if row:
+                        self._invalidate_calendar(row[0], recurring=bool(row[1]))
                     logging.info(f"Deleted task with id {task_id}")
                     return True
         except Exception as e:
@@ -348,12 +1229,9 @@ class Database:
 
     async def add_subtask(self, task_id: int, name: str) -> bool:
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._write() as db:
                 async with db.cursor() as cursor:
-                    await cursor.execute(
-                        "INSERT INTO subtasks (task_id, name) VALUES (?,?)",
-                        (task_id, name),
-                    )
+                    await cursor.execute(_SQL.INSERT_SUBTASK, (task_id, name))
                     await db.commit()
                     logging.info(
                         f"Added subtask with name {name} to task with id {task_id}"
@@ -363,20 +1241,31 @@ class Database:
             logging.error(f"Error occurred while adding subtask: {e}")
             return False
 
+    async def add_subtasks(self, task_id: int, names: list) -> bool:
+        # All names are inserted in one transaction, either all or none
+        try:
+            async with self._write() as db:
+                async with db.cursor() as cursor:
+                    await cursor.executemany(
+                        _SQL.INSERT_SUBTASK, [(task_id, name) for name in names]
+                    )
+                    await db.commit()
+                    logging.info(
+                        f"Added {len(names)} subtasks to task with id {task_id}"
+                    )
+                    return True
+        except Exception as e:
+            logging.error(f"Error occurred while adding subtasks: {e}")
+            return False
+
     async def fetch_subtasks(self, project_id: int) -> list:
         subtasks = []
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._read() as db:
                 async with db.cursor() as cursor:
-                    await cursor.execute(
-                        "SELECT id, name, status FROM subtasks WHERE task_id IN (SELECT id FROM tasks WHERE project_id =?)",
-                        (project_id,),
-                    )
-                    rows = await cursor.fetchall()
-                    for row in rows:
-                        subtasks.append(
-                            {"id": row[0], "name": row[1], "status": row[2]}
-                        )
+                    cursor.row_factory = Subtask.from_row
+                    await cursor.execute(_SQL.SELECT_SUBTASKS, (project_id,))
+                    subtasks = await cursor.fetchall()
                     logging.info(
                         f"Fetched all subtasks for project with id {project_id}"
                     )
@@ -384,18 +1273,15 @@ class Database:
             logging.error(f"Error occurred while fetching subtasks: {e}")
         return subtasks
 
-    async def fetch_subtask(self, subtask_id: int) -> list:
+    async def fetch_subtask(self, subtask_id: int) -> Union[Subtask, None]:
         subtask = None
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._read() as db:
                 async with db.cursor() as cursor:
-                    await cursor.execute(
-                        "SELECT id, name, status FROM subtasks WHERE id =?",
-                        (subtask_id,),
-                    )
-                    row = await cursor.fetchone()
-                    if row:
-                        subtask = {"id": row[0], "name": row[1], "status": row[2]}
+                    cursor.row_factory = Subtask.from_row
+                    await cursor.execute(_SQL.SELECT_SUBTASK, (subtask_id,))
+                    subtask = await cursor.fetchone()
+                    if subtask:
                         logging.info(f"Fetched subtask with id {subtask_id}")
                     else:
                         logging.info(f"Subtask with id {subtask_id} not found.")
@@ -407,11 +1293,9 @@ class Database:
 
     async def user_has_subtasks(self, user_id: int) -> bool:
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._read() as db:
                 async with db.cursor() as cursor:
-                    await cursor.execute(
-                        "SELECT id FROM projects WHERE user_id = ?", (user_id,)
-                    )
+                    await cursor.execute(_SQL.SELECT_PROJECT_IDS, (user_id,))
                     projects = await cursor.fetchall()
 
                     if not projects:
@@ -420,14 +1304,7 @@ class Database:
 
                     for project in projects:
                         project_id = project[0]
-                        await cursor.execute(
-                            """
-                            SELECT COUNT(*)
-                            FROM subtasks
-                            WHERE task_id IN (SELECT id FROM tasks WHERE project_id = ?)
-                            """,
-                            (project_id,),
-                        )
+                        await cursor.execute(_SQL.COUNT_PROJECT_SUBTASKS, (project_id,))
                         subtask_count = await cursor.fetchone()
 
                         if subtask_count and subtask_count[0] > 0:
@@ -446,12 +1323,9 @@ class Database:
 
     async def edit_subtask(self, subtask_id: int) -> bool:
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._write() as db:
                 async with db.cursor() as cursor:
-                    await cursor.execute(
-                        "UPDATE subtasks SET status='completed' WHERE id =?",
-                        (subtask_id,),
-                    )
+                    await cursor.execute(_SQL.COMPLETE_SUBTASK, (subtask_id,))
                     await db.commit()
                     logging.info(f"Updated subtask with id {subtask_id} to completed")
                     return True
@@ -461,11 +1335,9 @@ class Database:
 
     async def delete_subtask(self, subtask_id: int) -> bool:
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._write() as db:
                 async with db.cursor() as cursor:
-                    await cursor.execute(
-                        "DELETE FROM subtasks WHERE id =?", (subtask_id,)
-                    )
+                    await cursor.execute(_SQL.DELETE_SUBTASK, (subtask_id,))
                     await db.commit()
                     logging.info(f"Deleted subtask with id {subtask_id}")
                     return True
@@ -473,17 +1345,55 @@ class Database:
             logging.error(f"Error occurred while deleting subtask: {e}")
             return False
 
+    async def edit_subtasks(
+        self,
+        user_id: int,
+        subtask_ids: Union[list, None] = None,
+        project_id: Union[int, None] = None,
+        complete_tasks: bool = False,
+    ) -> Union[tuple, None]:
+        # Marks subtasks completed, optionally completing every task whose last
+        # open subtask was among them. Returns (subtask ids, completed task ids).
+        try:
+            async with self._write() as db:
+                async with db.cursor() as cursor:
+                    if project_id is not None:
+                        await cursor.execute(
+                            _SQL.COMPLETE_PROJECT_SUBTASKS,
+                            (project_id, user_id, user_id),
+                        )
+                    else:
+                        await cursor.execute(
+                            _SQL.COMPLETE_USER_SUBTASKS,
+                            (json.dumps(subtask_ids), user_id, user_id),
+                        )
+                    rows = await cursor.fetchall()
+
+                    completed = []
+                    if complete_tasks and rows:
+                        await cursor.execute(
+                            _SQL.COMPLETE_FINISHED_TASKS,
+                            (json.dumps(sorted({row[1] for row in rows})),),
+                        )
+                        completed = await cursor.fetchall()
+                    await db.commit()
+
+                    for _, deadline in completed:
+                        self._invalidate_calendar(deadline)
+                    logging.info(
+                        f"User with id {user_id} completed {len(rows)} subtasks and {len(completed)} tasks"
+                    )
+                    return [row[0] for row in rows], [row[0] for row in completed]
+        except Exception as e:
+            logging.error(f"Error occurred while editing subtasks: {e}")
+            return None
+
     async def add_shared_project(self, project_id: int, user_id: int) -> bool:
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._write() as db:
                 async with db.cursor() as cursor:
                     await cursor.execute(
-                        """
-                        SELECT COUNT(*) 
-                        FROM shared_projects 
-                        WHERE project_id = ? AND user_id = ?
-                        """,
-                        (project_id, user_id),
+                        _SQL.COUNT_PROJECT_MEMBER, (project_id, user_id)
                     )
                     exists = await cursor.fetchone()
 
@@ -494,13 +1404,19 @@ class Database:
                         return False
 
                     await cursor.execute(
-                        """
-                        INSERT INTO shared_projects (project_id, user_id) 
-                        VALUES (?,?)
-                        """,
-                        (project_id, user_id),
+                        _SQL.INSERT_PROJECT_MEMBER, (project_id, user_id)
+                    )
+                    await cursor.execute(
+                        _SQL.ENQUEUE_SHARE_NOTIFICATION,
+                        (
+                            f"share:{project_id}:{user_id}",
+                            time.time(),
+                            user_id,
+                            project_id,
+                        ),
                     )
                     await db.commit()
+                    self._invalidate_calendar(user_id=user_id)
                     logging.info(
                         f"Successfully added user with id {user_id} to project with id {project_id}."
                     )
@@ -512,33 +1428,16 @@ class Database:
     async def fetch_shared_projects(self, user_id: int) -> list:
         projects = []
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._read() as db:
                 async with db.cursor() as cursor:
-                    await cursor.execute(
-                        """
-                        SELECT id, name 
-                        FROM projects 
-                        WHERE user_id = ?
-                        """,
-                        (user_id,),
-                    )
+                    cursor.row_factory = Project.from_row
+                    await cursor.execute(_SQL.SELECT_PROJECTS, (user_id,))
                     owned_projects = await cursor.fetchall()
 
-                    await cursor.execute(
-                        """
-                        SELECT p.id, p.name
-                        FROM projects p
-                        JOIN shared_projects sp ON p.id = sp.project_id
-                        WHERE sp.user_id = ?
-                        """,
-                        (user_id,),
-                    )
+                    await cursor.execute(_SQL.SELECT_MEMBER_PROJECTS, (user_id,))
                     shared_projects = await cursor.fetchall()
 
-                    all_projects = owned_projects + shared_projects
-
-                    for project in all_projects:
-                        projects.append({"id": project[0], "name": project[1]})
+                    projects = owned_projects + shared_projects
 
                     logging.info(f"Fetched all projects for user with id {user_id}")
 
@@ -549,15 +1448,10 @@ class Database:
 
     async def check_project_member(self, project_id: int, user_id: int) -> bool:
         try:
-            async with aiosqlite.connect(self.db_path) as db:
+            async with self._read() as db:
                 async with db.cursor() as cursor:
                     await cursor.execute(
-                        """
-                        SELECT 1 FROM shared_projects
-                        WHERE project_id = ? AND user_id = ?
-                        LIMIT 1
-                        """,
-                        (project_id, user_id),
+                        _SQL.SELECT_PROJECT_MEMBER, (project_id, user_id)
                     )
                     result = await cursor.fetchone()
                     return result is not None
@@ -565,6 +1459,532 @@ class Database:
             logging.error(f"Error occurred while checking project membership: {e}")
             return False
 
+    async def fetch_calendar_token(self, user_id: int) -> Union[str, None]:
+        try:
+            async with self._write() as db:
+                async with db.cursor() as cursor:
+                    await cursor.execute(_SQL.SELECT_CALENDAR_TOKEN, (user_id,))
+                    row = await cursor.fetchone()
+                    if row is None:
+                        logging.info(f"User with id {user_id} not found.")
+                        return None
+                    if row[0]:
+                        return row[0]
+
+                    token = secrets.token_urlsafe(24)
+                    await cursor.execute(_SQL.UPDATE_CALENDAR_TOKEN, (token, user_id))
+                    await db.commit()
+                    logging.info(f"Created calendar token for user with id {user_id}")
+                    return token
+        except Exception as e:
+            logging.error(f"Error occurred while fetching calendar token: {e}")
+            return None
+
+    async def fetch_user_by_calendar_token(self, token: str) -> Union[int, None]:
+        try:
+            async with self._read() as db:
+                async with db.cursor() as cursor:
+                    await cursor.execute(_SQL.SELECT_USER_BY_CALENDAR_TOKEN, (token,))
+                    row = await cursor.fetchone()
+                    return row[0] if row else None
+        except Exception as e:
+            logging.error(f"Error occurred while fetching user by calendar token: {e}")
+            return None
+
+    async def fetch_calendar_version(self, user_id: int) -> Union[tuple, None]:
+        try:
+            async with self._read() as db:
+                async with db.cursor() as cursor:
+                    await cursor.execute(_SQL.SELECT_CALENDAR_VERSION, (user_id,))
+                    version, updated_at = await cursor.fetchone() or (0, None)
+                    last_modified = (
+                        datetime.fromisoformat(updated_at) if updated_at else None
+                    )
+                    return str(version), last_modified
+        except Exception as e:
+            logging.error(f"Error occurred while fetching calendar version: {e}")
+            return None
+
+    async def iter_calendar_tasks(self, user_id: int) -> AsyncIterator[Task]:
+        try:
+            async with self._read() as db:
+                async with db.cursor() as cursor:
+                    cursor.row_factory = Task.from_row
+                    await cursor.execute(_SQL.SELECT_CALENDAR_TASKS, (user_id, user_id))
+                    async for task in cursor:
+                        yield task
+            logging.info(f"Streamed calendar tasks for user with id {user_id}")
+        except Exception as e:
+            logging.error(f"Error occurred while streaming calendar tasks: {e}")
+
+    async def fetch_notification_settings(self, user_id: int) -> Union[dict, None]:
+        try:
+            async with self._read() as db:
+                async with db.cursor() as cursor:
+                    await cursor.execute(_SQL.SELECT_NOTIFICATION_SETTINGS, (user_id,))
+                    row = await cursor.fetchone()
+                    if row is None:
+                        logging.info(f"User with id {user_id} not found.")
+                        return None
+                    return {"notifications": bool(row[0]), "digest": bool(row[1])}
+        except Exception as e:
+            logging.error(f"Error occurred while fetching notification settings: {e}")
+            return None
+
+    async def set_notification_settings(
+        self,
+        user_id: int,
+        notifications: Union[bool, None] = None,
+        digest: Union[bool, None] = None,
+    ) -> bool:
+        try:
+            async with self._write() as db:
+                async with db.cursor() as cursor:
+                    await cursor.execute(
+                        _SQL.UPDATE_NOTIFICATION_SETTINGS,
+                        (notifications, digest, user_id),
+                    )
+                    await db.commit()
+                    logging.info(
+                        f"Updated notification settings of user with id {user_id}: notifications={notifications}, digest={digest}"
+                    )
+                    return True
+        except Exception as e:
+            logging.error(f"Error occurred while updating notification settings: {e}")
+            return False
+
+    async def fetch_digest_tasks(self, until_day: date) -> dict:
+        # user_id -> open tasks due until the given day, in digest order
+        digests = {}
+        try:
+            async with self._read() as db:
+                async with db.cursor() as cursor:
+                    await cursor.execute(
+                        _SQL.SELECT_DIGEST_TASKS, (format_deadline(until_day),)
+                    )
+                    for row in await cursor.fetchall():
+                        digests.setdefault(row[0], []).append(Task(*row[1:]))
+                    logging.info(f"Fetched digest tasks for {len(digests)} users")
+        except Exception as e:
+            logging.error(f"Error occurred while fetching digest tasks: {e}")
+        return digests
+
+    async def enqueue_notifications(self, notifications: list) -> bool:
+        # notifications: (idempotency_key, chat_id, text, not_before) tuples
+        try:
+            async with self._write() as db:
+                async with db.cursor() as cursor:
+                    await self._enqueue(cursor, notifications)
+                    await db.commit()
+                    logging.info(f"Enqueued {len(notifications)} notifications")
+                    return True
+        except Exception as e:
+            logging.error(f"Error occurred while enqueueing notifications: {e}")
+            return False
+
+    async def _enqueue(self, cursor, notifications: list) -> None:
+        # Duplicate idempotency keys are dropped, so replaying an event is harmless
+        await cursor.executemany(_SQL.ENQUEUE_NOTIFICATION, notifications)
+
+    async def fetch_outbox_batch(self, limit: int) -> list:
+        batch = []
+        try:
+            async with self._read() as db:
+                async with db.cursor() as cursor:
+                    await cursor.execute(_SQL.SELECT_OUTBOX_BATCH, (time.time(), limit))
+                    for row in await cursor.fetchall():
+                        batch.append(
+                            {
+                                "id": row[0],
+                                "idempotency_key": row[1],
+                                "chat_id": row[2],
+                                "text": row[3],
+                                "attempts": row[4],
+                            }
+                        )
+        except Exception as e:
+            logging.error(f"Error occurred while fetching outbox batch: {e}")
+        return batch
+
+    async def mark_outbox_sent(self, outbox_id: int) -> bool:
+        try:
+            async with self._write() as db:
+                async with db.cursor() as cursor:
+                    await cursor.execute(_SQL.MARK_OUTBOX_SENT, (outbox_id,))
+                    await db.commit()
+                    return True
+        except Exception as e:
+            logging.error(f"Error occurred while marking outbox entry as sent: {e}")
+            return False
+
+    async def mark_outbox_retry(
+        self, outbox_id: int, not_before: Union[float, None], error: str
+    ) -> bool:
+        # not_before=None gives up on the entry
+        try:
+            async with self._write() as db:
+                async with db.cursor() as cursor:
+                    await cursor.execute(
+                        _SQL.MARK_OUTBOX_RETRY,
+                        (not_before, not_before, error, outbox_id),
+                    )
+                    await db.commit()
+                    return True
+        except Exception as e:
+            logging.error(f"Error occurred while rescheduling outbox entry: {e}")
+            return False
+
+    async def prune_outbox(self, older_than: float) -> int:
+        try:
+            async with self._write() as db:
+                async with db.cursor() as cursor:
+                    await cursor.execute(_SQL.PRUNE_OUTBOX, (older_than,))
+                    await db.commit()
+                    logging.info(f"Pruned {cursor.rowcount} outbox entries")
+                    return cursor.rowcount
+        except Exception as e:
+            logging.error(f"Error occurred while pruning outbox: {e}")
+            return 0
+
+    async def fetch_watermark(self, name: str) -> Union[str, None]:
+        try:
+            async with self._read() as db:
+                async with db.cursor() as cursor:
+                    await cursor.execute(_SQL.SELECT_WATERMARK, (name,))
+                    row = await cursor.fetchone()
+                    return row[0] if row else None
+        except Exception as e:
+            logging.error(f"Error occurred while fetching watermark {name}: {e}")
+            return None
+
+    async def set_watermark(self, name: str, value: str) -> bool:
+        try:
+            async with self._write() as db:
+                async with db.cursor() as cursor:
+                    await cursor.execute(_SQL.UPSERT_WATERMARK, (name, value))
+                    await db.commit()
+                    logging.info(f"Moved watermark {name} to {value}")
+                    return True
+        except Exception as e:
+            logging.error(f"Error occurred while setting watermark {name}: {e}")
+            return False
+
+    async def fetch_new_overdue_tasks(self, until: str) -> Union[dict, None]:
+        # user_id -> open tasks due before until that the sweeper hasn't flagged
+        overdue = {}
+        try:
+            async with self._read() as db:
+                async with db.cursor() as cursor:
+                    await cursor.execute(_SQL.SELECT_NEW_OVERDUE_TASKS, (until,))
+                    for row in await cursor.fetchall():
+                        overdue.setdefault(row[0], []).append(Task(*row[1:]))
+                    logging.info(f"Fetched new overdue tasks for {len(overdue)} users")
+                    return overdue
+        except Exception as e:
+            logging.error(f"Error occurred while fetching new overdue tasks: {e}")
+            return None
+
+    async def mark_overdue(self, until: str, task_ids: list, batch_size: int) -> int:
+        # Flags the tasks notified about, then the open tasks due before until
+        # that nobody would be notified about; one short transaction per batch.
+        # A task that turned overdue since the fetch waits for the next sweep.
+        marked = 0
+        for start in range(0, len(task_ids), batch_size):
+            try:
+                async with self._write() as db:
+                    async with db.cursor() as cursor:
+                        await cursor.execute(
+                            _SQL.MARK_OVERDUE,
+                            (json.dumps(task_ids[start : start + batch_size]),),
+                        )
+                        marked += cursor.rowcount
+                        await db.commit()
+            except Exception as e:
+                logging.error(f"Error occurred while marking tasks overdue: {e}")
+                return marked
+            await asyncio.sleep(0)
+
+        last = ("", 0)
+        while True:
+            try:
+                async with self._write() as db:
+                    async with db.cursor() as cursor:
+                        await cursor.execute(
+                            _SQL.SELECT_QUIET_OVERDUE_BATCH,
+                            (*last, until, batch_size),
+                        )
+                        rows = await cursor.fetchall()
+                        if not rows:
+                            break
+                        await cursor.execute(
+                            _SQL.MARK_OVERDUE, (json.dumps([row[0] for row in rows]),)
+                        )
+                        await db.commit()
+            except Exception as e:
+                logging.error(f"Error occurred while marking tasks overdue: {e}")
+                break
+
+            marked += len(rows)
+            last = (rows[-1][1], rows[-1][0])
+            if len(rows) < batch_size:
+                break
+            await asyncio.sleep(0)
+
+        logging.info(f"Marked {marked} tasks due before {until} as overdue")
+        return marked
+
+    async def fetch_changes(self, after_seq: int, limit: int) -> list:
+        changes = []
+        try:
+            async with self._read() as db:
+                async with db.cursor() as cursor:
+                    cursor.row_factory = Change.from_row
+                    await cursor.execute(_SQL.SELECT_CHANGES, (after_seq, limit))
+                    changes = await cursor.fetchall()
+        except Exception as e:
+            logging.error(f"Error occurred while fetching changes: {e}")
+        return changes
+
+    async def fetch_last_change_seq(self) -> Union[int, None]:
+        try:
+            async with self._read() as db:
+                async with db.cursor() as cursor:
+                    await cursor.execute(_SQL.SELECT_LAST_CHANGE_SEQ)
+                    return (await cursor.fetchone())[0]
+        except Exception as e:
+            logging.error(f"Error occurred while fetching last change seq: {e}")
+            return None
+
+    async def fetch_change_fanout(
+        self, after_seq: int, until_seq: int
+    ) -> Union[dict, None]:
+        # user_id -> the changes in (after_seq, until_seq] they should hear about
+        fanout = {}
+        try:
+            async with self._read() as db:
+                async with db.cursor() as cursor:
+                    await cursor.execute(
+                        _SQL.SELECT_CHANGE_FANOUT, (after_seq, until_seq)
+                    )
+                    for row in await cursor.fetchall():
+                        fanout.setdefault(row[0], []).append(
+                            {
+                                "project_id": row[1],
+                                "project": row[2],
+                                "actor": row[3],
+                                "entity": row[4],
+                                "entity_id": row[5],
+                                "op": row[6],
+                                "name": row[7],
+                                "status": row[8],
+                            }
+                        )
+                    logging.info(f"Fanned out changes to {len(fanout)} users")
+                    return fanout
+        except Exception as e:
+            logging.error(f"Error occurred while fanning out changes: {e}")
+            return None
+
+    async def prune_changes(self, older_than: float, batch_size: int) -> int:
+        # Drops changes older than the cutoff, one short transaction per batch
+        pruned = 0
+        last = (0.0, 0)
+        while True:
+            try:
+                async with self._write() as db:
+                    async with db.cursor() as cursor:
+                        await cursor.execute(
+                            _SQL.SELECT_PRUNABLE_CHANGES,
+                            (older_than, *last, batch_size),
+                        )
+                        rows = await cursor.fetchall()
+                        if not rows:
+                            break
+                        await cursor.execute(
+                            _SQL.DELETE_CHANGES, (json.dumps([row[0] for row in rows]),)
+                        )
+                        await db.commit()
+            except Exception as e:
+                logging.error(f"Error occurred while pruning changes: {e}")
+                break
+
+            pruned += len(rows)
+            last = (rows[-1][1], rows[-1][0])
+            if len(rows) < batch_size:
+                break
+            await asyncio.sleep(0)
+
+        logging.info(f"Pruned {pruned} changes")
+        return pruned
+
+    async def archive_tasks(self, older_than_days: int, batch_size: int) -> int:
+        # Each batch is its own short transaction, other writers get the
+        # connection between batches
+        archived = 0
+        while True:
+            try:
+                async with self._write() as db:
+                    async with db.cursor() as cursor:
+                        await cursor.execute(
+                            _SQL.SELECT_ARCHIVABLE_TASKS,
+                            (f"-{older_than_days} days", batch_size),
+                        )
+                        task_ids = [row[0] for row in await cursor.fetchall()]
+                        if not task_ids:
+                            break
+                        for statement in _SQL.ARCHIVE_BATCH:
+                            await cursor.execute(statement, (json.dumps(task_ids),))
+                        await db.commit()
+            except Exception as e:
+                logging.error(f"Error occurred while archiving tasks: {e}")
+                break
+
+            archived += len(task_ids)
+            if len(task_ids) < batch_size:
+                break
+            await asyncio.sleep(0)
+
+        logging.info(
+            f"Archived {archived} tasks completed over {older_than_days} days ago"
+        )
+        return archived
+
+    async def fetch_archived_tasks(
+        self, user_id: int, limit: int, offset: int = 0
+    ) -> list:
+        tasks = []
+        try:
+            async with self._read() as db:
+                async with db.cursor() as cursor:
+                    cursor.row_factory = Task.from_row
+                    await cursor.execute(
+                        _SQL.SELECT_ARCHIVED_TASKS, (user_id, user_id, limit, offset)
+                    )
+                    tasks = await cursor.fetchall()
+                    logging.info(f"Fetched archived tasks for user with id {user_id}")
+        except Exception as e:
+            logging.error(f"Error occurred while fetching archived tasks: {e}")
+        return tasks
+
+    async def _fetch_deadline_rows(
+        self, user_id: int, first_day: date, last_day: date
+    ) -> Union[list, None]:
+        try:
+            async with self._read() as db:
+                async with db.cursor() as cursor:
+                    await cursor.execute(
+                        _SQL.SELECT_DEADLINE_COUNTS,
+                        (
+                            user_id,
+                            user_id,
+                            format_deadline(first_day),
+                            format_deadline(last_day),
+                            format_deadline(last_day),
+                        ),
+                    )
+                    rows = await cursor.fetchall()
+                    logging.info(
+                        f"Fetched deadline counts for user with id {user_id} for {first_day:%Y-%m}"
+                    )
+                    return rows
+        except Exception as e:
+            logging.error(f"Error occurred while fetching deadline counts: {e}")
+            return None
+
+    async def fetch_tasks_by_day(self, user_id: int, day: date) -> list:
+        tasks = []
+        try:
+            async with self._read() as db:
+                async with db.cursor() as cursor:
+                    cursor.row_factory = Task.from_row
+                    await cursor.execute(
+                        _SQL.SELECT_TASKS_BY_DAY,
+                        (user_id, user_id, format_deadline(day), format_deadline(day)),
+                    )
+                    tasks = self._due_on(await cursor.fetchall(), day)
+                    logging.info(f"Fetched tasks for user with id {user_id} due {day}")
+        except Exception as e:
+            logging.error(f"Error occurred while fetching tasks by day: {e}")
+        return tasks
+
+    async def fetch_next_tasks(self, user_id: int, limit: int) -> list:
+        tasks = []
+        try:
+            async with self._read() as db:
+                async with db.cursor() as cursor:
+                    cursor.row_factory = Task.from_row
+                    await cursor.execute(
+                        _SQL.SELECT_NEXT_TASKS, (user_id, user_id, limit)
+                    )
+                    tasks = await cursor.fetchall()
+                    logging.info(
+                        f"Fetched {len(tasks)} next tasks for user with id {user_id}"
+                    )
+        except Exception as e:
+            logging.error(f"Error occurred while fetching next tasks: {e}")
+        return tasks
+
+    async def backup(
+        self, schema: str, target: str, pages: int, sleep: float
+    ) -> Union[dict, None]:
+        # schema: "main" or "archive". The copy runs on a worker thread with its
+        # own read-only connection, so neither the event loop nor the writer waits.
+        source = self.db_path if schema == "main" else self.archive_path
+        started = time.perf_counter()
+        try:
+            stats = await asyncio.get_running_loop().run_in_executor(
+                None, self._backup, source, target, pages, sleep
+            )
+        except Exception as e:
+            logging.error(f"Error occurred while backing up {source}: {e}")
+            return None
+
+        stats["duration"] = time.perf_counter() - started
+        stats["pages_per_second"] = (
+            stats["pages"] / stats["duration"] if stats["duration"] else 0.0
+        )
+        logging.info(
+            f"Backed up {source} to {target}: {stats['pages']} pages in {stats['duration']:.2f}s "
+            f"({stats['pages_per_second']:.0f} pages/s, {stats['restarts']} restarts)"
+        )
+        return stats
+
+    def _backup(self, source: str, target: str, pages: int, sleep: float) -> dict:
+        stats = {"pages": 0, "restarts": 0}
+        remaining = None
+
+        def progress(status, left, total):
+            nonlocal remaining
+            # Pages left going up means a write restarted the copy
+            if remaining is not None and left > remaining:
+                stats["restarts"] += 1
+                if stats["restarts"] > BACKUP_MAX_RESTARTS:
+                    raise _BackupRestarted()
+            remaining = left
+            stats["pages"] = total
+            # backup() itself only sleeps after a busy or locked step, the
+            # pause between copied steps is ours: the source is unlocked meanwhile
+            if left > 0:
+                time.sleep(sleep)
+
+        src = sqlite3.connect(f"{Path(source).resolve().as_uri()}?mode=ro", uri=True)
+        dst = sqlite3.connect(target)
+        try:
+            try:
+                src.backup(dst, pages=pages, progress=progress, sleep=sleep)
+            except _BackupRestarted:
+                src.backup(dst, pages=-1, progress=progress)
+        finally:
+            dst.close()
+            src.close()
+        return stats
+
     async def close(self) -> None:
-        if self.conn:
-            await self.conn.close()
+        if self._writer is None:
+            return
+        async with self._writer_lock:
+            await self._writer.close()
+            self._writer = None
+        while self._readers:
+            await self._readers.popleft().close()
+        logging.info(f"Closed connections to {self.db_path}")
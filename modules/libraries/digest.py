@@ -0,0 +1,104 @@
+from datetime import date, datetime, time, timedelta
+from modules.libraries.storage import Storage
+from modules.libraries.recurrence import display_deadline, format_deadline
+import asyncio, logging, zlib
+
+# Day of the last digests enqueued, "YYYY-MM-DD"
+WATERMARK = "digest"
+
+
+class DigestScheduler:
+    def __init__(self, db: Storage, send_at: time, window: int):
+        self._db = db
+        self._send_at = send_at
+        self._window = window
+
+    async def run(self) -> None:
+        await self.catch_up()
+        while True:
+            now = datetime.now()
+            next_run = datetime.combine(now.date(), self._send_at)
+            if next_run <= now:
+                next_run += timedelta(days=1)
+
+            logging.info(f"Next daily digest is scheduled at {next_run}")
+            await asyncio.sleep((next_run - now).total_seconds())
+
+            try:
+                await self.enqueue_digests(next_run.date())
+            except Exception as e:
+                logging.error(f"Error occurred while sending daily digests: {e}")
+
+    async def catch_up(self) -> None:
+        # A bot that was down at send_at sends today's digests when it starts.
+        # Their keys are per day, the outbox drops any that went out already.
+        now = datetime.now()
+        if now.time() < self._send_at:
+            return
+        last = await self._db.fetch_watermark(WATERMARK)
+        if last is not None and last >= now.date().isoformat():
+            return
+        logging.info(f"Catching up on the daily digests of {now.date()}")
+        try:
+            await self.enqueue_digests(now.date())
+        except Exception as e:
+            logging.error(f"Error occurred while catching up on daily digests: {e}")
+
+    async def enqueue_digests(self, today: date) -> None:
+        digests = await self._db.fetch_digest_tasks(today + timedelta(days=1))
+        if not digests:
+            logging.info("No daily digests to send")
+            await self._db.set_watermark(WATERMARK, today.isoformat())
+            return
+
+        # All digests are written to the outbox at once, the relay delivers each
+        # at its own slot of the window
+        started = datetime.now().timestamp()
+        await self._db.enqueue_notifications(
+            [
+                (
+                    f"digest:{user_id}:{today.isoformat()}",
+                    user_id,
+                    self.format_digest(digests[user_id], today),
+                    started + offset,
+                )
+                for user_id, offset in self.schedule(digests)
+            ]
+        )
+        await self._db.set_watermark(WATERMARK, today.isoformat())
+        logging.info(f"Scheduled daily digests for {len(digests)} users")
+
+    def schedule(self, user_ids) -> list:
+        # Users are spread evenly over the window in a stable pseudo-random order,
+        # so everyone gets their digest at roughly the same minute every day
+        ordered = sorted(
+            user_ids, key=lambda user_id: zlib.crc32(str(user_id).encode())
+        )
+        step = self._window / len(ordered) if ordered else 0
+        return [(user_id, index * step) for index, user_id in enumerate(ordered)]
+
+    def format_digest(self, tasks: list, today: date) -> str:
+        sections = {"overdue": [], "today": [], "tomorrow": []}
+        today_iso = format_deadline(today)
+        for task in tasks:
+            if task.deadline < today_iso:
+                section = "overdue"
+            elif task.deadline == today_iso:
+                section = "today"
+            else:
+                section = "tomorrow"
+            sections[section].append(
+                f"- {task.name} ({task.project_name}), "
+                f"до {display_deadline(task.deadline)}, приоритет {task.priority}"
+            )
+
+        titles = {
+            "overdue": "⚠️ Просрочено",
+            "today": "📌 Сегодня",
+            "tomorrow": "🗓 Завтра",
+        }
+        parts = [f"Ежедневная сводка на {display_deadline(today)}"]
+        for section, lines in sections.items():
+            if lines:
+                parts.append(f"{titles[section]}:\n" + "\n".join(lines))
+        return "\n\n".join(parts)
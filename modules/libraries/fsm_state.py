@@ -0,0 +1,44 @@
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.fsm.storage.memory import MemoryStorage, MemoryStorageRecord
+import logging, os, pickle
+
+
+def save_fsm_state(storage: BaseStorage, path: str) -> int:
+    # Writes the chats in the middle of a dialog, so a restart doesn't cut it
+    # short. Returns how many were written.
+    if not isinstance(storage, MemoryStorage):
+        return 0
+    records = {
+        key: (record.state, record.data)
+        for key, record in storage.storage.items()
+        if record.state or record.data
+    }
+    try:
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        # A shutdown killed halfway leaves the previous file intact
+        with open(f"{path}.tmp", "wb") as file:
+            pickle.dump(records, file)
+        os.replace(f"{path}.tmp", path)
+    except Exception as e:
+        logging.error(f"Error occurred while saving FSM state: {e}")
+        return 0
+    logging.info(f"Saved FSM state of {len(records)} chats to {path}")
+    return len(records)
+
+
+def load_fsm_state(storage: BaseStorage, path: str) -> int:
+    # The file is removed once loaded: after a crash, dialogs saved by an
+    # earlier shutdown are stale and must not come back
+    if not isinstance(storage, MemoryStorage) or not os.path.exists(path):
+        return 0
+    try:
+        with open(path, "rb") as file:
+            records = pickle.load(file)
+        os.remove(path)
+    except Exception as e:
+        logging.error(f"Error occurred while loading FSM state: {e}")
+        return 0
+    for key, (state, data) in records.items():
+        storage.storage[key] = MemoryStorageRecord(data=data, state=state)
+    logging.info(f"Loaded FSM state of {len(records)} chats from {path}")
+    return len(records)
@@ -0,0 +1,212 @@
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
+from pathlib import Path
+from typing import Union
+import itertools, logging, os, queue, sys, time
+
+LOG_FORMAT = "[%(asctime)s]:%(levelname)s:%(funcName)s:%(message)s"
+LOG_DATE_FORMAT = "%Y-%m-%d|%H:%M:%S"
+# Modules log through the root logger, so records are told apart by the file
+# that logged them, as a dotted path from the repository root
+ROOT = Path(__file__).resolve().parents[2]
+# record.pathname -> dotted module name
+_MODULE_NAMES = {}
+
+
+def module_name(record: logging.LogRecord) -> str:
+    # "modules.libraries.dbms" for the root logger, the logger's own name for
+    # libraries like aiogram that have one
+    if record.name != "root":
+        return record.name
+    name = _MODULE_NAMES.get(record.pathname)
+    if name is None:
+        path = Path(record.pathname)
+        try:
+            name = ".".join(path.resolve().relative_to(ROOT).with_suffix("").parts)
+        except ValueError:
+            name = path.stem
+        _MODULE_NAMES[record.pathname] = name
+    return name
+
+
+def _level(value: Union[int, str]) -> int:
+    # "warning" and logging.WARNING alike
+    if isinstance(value, int):
+        return value
+    level = logging.getLevelName(value.upper())
+    if not isinstance(level, int):
+        raise ValueError(f"Unknown log level {value}")
+    return level
+
+
+def _lookup(table: dict, name: str, default, cache: dict):
+    # The entry of the longest dotted prefix: "modules.libraries" covers dbms
+    if name not in cache:
+        value, prefix = default, name
+        while prefix:
+            if prefix in table:
+                value = table[prefix]
+                break
+            prefix = prefix.rpartition(".")[0]
+        cache[name] = value
+    return cache[name]
+
+
+class ModuleLevelFilter(logging.Filter):
+    def __init__(self, level: int, levels: dict):
+        super().__init__()
+        self._level = level
+        self._levels = levels
+        self._cache = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        name = module_name(record)
+        return record.levelno >= _lookup(self._levels, name, self._level, self._cache)
+
+
+class SamplingFilter(logging.Filter):
+    # Keeps the first of every N records below WARNING from each call site of a
+    # sampled module, so a line logged on every update still shows up now and
+    # then without filling the disk. Warnings and errors always pass.
+    def __init__(self, rates: dict):
+        super().__init__()
+        self._rates = rates
+        self._cache = {}
+        self._counters = {}
+        self.sampled_out = 0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = _lookup(self._rates, module_name(record), 1, self._cache)
+        if rate <= 1:
+            return True
+        site = (record.pathname, record.lineno)
+        counter = self._counters.get(site)
+        if counter is None:
+            counter = self._counters[site] = itertools.count()
+        if next(counter) % rate == 0:
+            return True
+        self.sampled_out += 1
+        return False
+
+
+class DroppingQueueHandler(QueueHandler):
+    # Never blocks the event loop: when the writer thread falls behind and the
+    # queue holds max_size records, new ones are dropped and counted instead.
+    # SimpleQueue is implemented in C, queue.Queue takes a Python lock per put.
+    def __init__(self, log_queue: queue.SimpleQueue, max_size: int):
+        super().__init__(log_queue)
+        self._max_size = max_size
+        self._exception_formatter = logging.Formatter()
+        self.dropped = 0
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        # Only merges the message, the writer thread formats the line. The
+        # record isn't copied, this is the root logger's only handler.
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = self._exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record: logging.LogRecord) -> None:
+        if self.queue.qsize() >= self._max_size:
+            self.dropped += 1
+            return
+        self.queue.put_nowait(record)
+
+    def stats(self) -> dict:
+        sampled_out = sum(
+            getattr(log_filter, "sampled_out", 0) for log_filter in self.filters
+        )
+        return {
+            "queued": self.queue.qsize(),
+            "dropped": self.dropped,
+            "sampled_out": sampled_out,
+        }
+
+
+class SizeTimeRotatingFileHandler(RotatingFileHandler):
+    # Rolls the file over once it reaches max_bytes or the interval has passed,
+    # whichever comes first. Old files are kept as .1, .2, ... up to backups.
+    def __init__(self, filename: str, max_bytes: int, backups: int, interval: float):
+        super().__init__(
+            filename,
+            maxBytes=max_bytes,
+            backupCount=backups,
+            encoding="utf-8",
+            delay=True,
+        )
+        self._interval = interval
+        self._rollover_at = self._next_rollover(time.time())
+
+    def _next_rollover(self, now: float) -> float:
+        return now - now % self._interval + self._interval
+
+    def shouldRollover(self, record: logging.LogRecord) -> bool:
+        if record.created >= self._rollover_at and os.path.exists(self.baseFilename):
+            return True
+        return bool(super().shouldRollover(record))
+
+    def doRollover(self) -> None:
+        super().doRollover()
+        self._rollover_at = self._next_rollover(time.time())
+
+
+def setup_logging(
+    directory: str,
+    filename: str = "prodigy_bot.log",
+    level: Union[int, str] = logging.INFO,
+    levels: Union[dict, None] = None,
+    sampling: Union[dict, None] = None,
+    max_bytes: int = 10 * 1024 * 1024,
+    backups: int = 10,
+    interval: float = 24 * 60 * 60,
+    queue_size: int = 10000,
+    stream=sys.stderr,
+) -> QueueListener:
+    # Log calls only put the record on a queue, a listener thread formats it
+    # and writes the file. Stop the returned listener on exit to flush it.
+    os.makedirs(directory, exist_ok=True)
+    level = _level(level)
+    levels = {name: _level(value) for name, value in (levels or {}).items()}
+
+    formatter = logging.Formatter(LOG_FORMAT, datefmt=LOG_DATE_FORMAT)
+    file_handler = SizeTimeRotatingFileHandler(
+        os.path.join(directory, filename), max_bytes, backups, interval
+    )
+    handlers = [file_handler]
+    if stream is not None:
+        handlers.append(logging.StreamHandler(stream))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = DroppingQueueHandler(log_queue, queue_size)
+    queue_handler.addFilter(ModuleLevelFilter(level, levels))
+    if sampling:
+        queue_handler.addFilter(SamplingFilter(sampling))
+
+    root = logging.getLogger()
+    for handler in root.handlers[:]:
+        root.removeHandler(handler)
+        handler.close()
+    root.addHandler(queue_handler)
+    # The root level lets the most verbose module through, the filter does the rest
+    root.setLevel(min([level, *levels.values()]))
+    for name, value in levels.items():
+        # Named loggers drop their records before they are even created
+        logging.getLogger(name).setLevel(value)
+
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
+
+
+def queue_stats() -> Union[dict, None]:
+    # None until setup_logging has put the queue in place
+    for handler in logging.getLogger().handlers:
+        if isinstance(handler, DroppingQueueHandler):
+            return handler.stats()
+    return None
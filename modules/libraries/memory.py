@@ -0,0 +1,171 @@
+from aiogram.fsm.storage.base import BaseStorage
+from aiogram.fsm.storage.memory import MemoryStorage
+from dataclasses import fields, is_dataclass
+from fnmatch import fnmatch
+from modules.libraries.logs import ROOT
+from typing import Callable, Union
+import asyncio, logging, os, sys, tracemalloc
+
+# name -> callable returning the component's sizes and counters, registered by
+# whoever creates the component. None means it isn't running.
+_WATCHED = {}
+# Allocation sites top_growth leaves out: tracemalloc's own, the import
+# machinery's and this module's, whose totals are kept for the next comparison.
+# Matched against the file name like fnmatch.
+_IGNORED = (
+    tracemalloc.__file__,
+    __file__,
+    "<frozen importlib._bootstrap>",
+    "<frozen importlib._bootstrap_external>",
+    "<unknown>",
+)
+
+
+def watch(name: str, stats: Callable[[], Union[dict, None]]) -> None:
+    _WATCHED[name] = stats
+
+
+def rss_bytes() -> Union[int, None]:
+    # The current resident set size on Linux, the peak one elsewhere
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def deep_size(obj, limit: int = 100000) -> int:
+    # Bytes held by obj and the containers and dataclasses it references, each
+    # counted once. Stops after limit objects, the result is then a lower bound.
+    seen = set()
+    pending = [obj]
+    size = 0
+    while pending and len(seen) < limit:
+        item = pending.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        size += sys.getsizeof(item)
+        if isinstance(item, dict):
+            pending.extend(item.keys())
+            pending.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            pending.extend(item)
+        elif is_dataclass(item) and not isinstance(item, type):
+            # Like FSM records. vars() would give every such object a dict
+            # of its own on Python 3.11+, growing what is being measured.
+            pending.extend(getattr(item, field.name) for field in fields(item))
+    return size
+
+
+def fsm_stats(storage: BaseStorage) -> dict:
+    # MemoryStorage keeps a record for every chat it was ever asked about
+    if not isinstance(storage, MemoryStorage):
+        return {"type": type(storage).__name__}
+    records = storage.storage
+    return {
+        "keys": len(records),
+        "in_dialog": sum(1 for record in records.values() if record.state),
+        "with_data": sum(1 for record in records.values() if record.data),
+        "bytes": deep_size(records),
+    }
+
+
+def collect() -> dict:
+    stats = {"process": {"rss": rss_bytes()}}
+    try:
+        stats["process"]["tasks"] = len(asyncio.all_tasks())
+    except RuntimeError:
+        pass
+    if tracemalloc.is_tracing():
+        current, peak = tracemalloc.get_traced_memory()
+        stats["tracemalloc"] = {"current": current, "peak": peak}
+    for name, component_stats in _WATCHED.items():
+        try:
+            value = component_stats()
+        except Exception as e:
+            logging.error(f"Error occurred while collecting {name} stats: {e}")
+            continue
+        if value is not None:
+            stats[name] = value
+    return stats
+
+
+def allocation_sites(key_type: str = "lineno") -> Union[dict, None]:
+    # traceback -> (size, count) of the live allocations of each site, None
+    # unless tracemalloc is tracing, e.g. started with PYTHONTRACEMALLOC=1.
+    # Only the totals are kept, a whole snapshot holds on to every trace.
+    # Grouping half a million traces takes seconds, call it from a thread.
+    if not tracemalloc.is_tracing():
+        return None
+    statistics = tracemalloc.take_snapshot().statistics(key_type)
+    return {stat.traceback: (stat.size, stat.count) for stat in statistics}
+
+
+def top_growth(old: dict, new: dict, limit: int = 10, ignore: tuple = ()) -> list:
+    # (traceback, size diff, count diff) of the sites of allocation_sites()
+    # that grew the most from old to new
+    patterns = _IGNORED + tuple(ignore)
+    growth = []
+    for traceback, (size, count) in new.items():
+        old_size, old_count = old.get(traceback, (0, 0))
+        if size > old_size and not any(
+            fnmatch(traceback[0].filename, pattern) for pattern in patterns
+        ):
+            growth.append((traceback, size - old_size, count - old_count))
+    growth.sort(key=lambda site: site[1], reverse=True)
+    return growth[:limit]
+
+
+def format_site(traceback: tracemalloc.Traceback) -> str:
+    frame = traceback[0]
+    path = frame.filename
+    if "site-packages" in path:
+        path = path.split("site-packages", 1)[1].lstrip("/\\")
+    else:
+        try:
+            path = os.path.relpath(path, ROOT)
+        except ValueError:
+            pass
+    return f"{path}:{frame.lineno}"
+
+
+def format_bytes(size: Union[int, None]) -> str:
+    if size is None:
+        return "-"
+    for unit in ("B", "KiB", "MiB"):
+        if abs(size) < 1024:
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} GiB"
+
+
+def format_stats(stats: dict, growth: list = ()) -> str:
+    lines = []
+    for name, values in stats.items():
+        values = ", ".join(
+            f"{key}={_format_value(name, key, value)}" for key, value in values.items()
+        )
+        lines.append(f"{name}: {values}")
+    if growth:
+        lines.append("")
+        lines.append("Top growing allocation sites:")
+        lines.extend(
+            f"{format_bytes(size):>10} {count:>+8} {format_site(traceback)}"
+            for traceback, size, count in growth
+        )
+    return "\n".join(lines)
+
+
+def _format_value(name: str, key: str, value) -> str:
+    if key in ("rss", "bytes") or name == "tracemalloc":
+        return format_bytes(value)
+    if isinstance(value, float):
+        return f"{value:.4g}"
+    return str(value)
@@ -0,0 +1,142 @@
+from typing import Union
+
+
+class Row:
+    # Rows are plain slotted objects instead of dicts: no per-row __dict__ and
+    # no repeated key strings. Subclasses list their slots in SELECT order.
+    __slots__ = ()
+
+    @classmethod
+    def from_row(cls, cursor, row: tuple) -> "Row":
+        # sqlite3 row factory, runs on the connection thread
+        return cls(*row)
+
+    def __repr__(self) -> str:
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+
+class User(Row):
+    __slots__ = (
+        "id",
+        "user_id",
+        "user_name",
+        "created_at",
+        "notifications",
+        "digest",
+        "calendar_token",
+    )
+
+    def __init__(
+        self,
+        id: int,
+        user_id: int,
+        user_name: str,
+        created_at: str,
+        notifications: bool,
+        digest: bool,
+        calendar_token: Union[str, None],
+    ):
+        self.id = id
+        self.user_id = user_id
+        self.user_name = user_name
+        self.created_at = created_at
+        self.notifications = bool(notifications)
+        self.digest = bool(digest)
+        self.calendar_token = calendar_token
+
+
+class Project(Row):
+    __slots__ = ("id", "name", "description")
+
+    def __init__(self, id: int, name: str, description: Union[str, None]):
+        self.id = id
+        self.name = name
+        self.description = description
+
+
+class Task(Row):
+    __slots__ = (
+        "id",
+        "name",
+        "description",
+        "deadline",
+        "priority",
+        "status",
+        "recurrence",
+        "overdue",
+        "project_name",
+        "completed_at",
+    )
+
+    def __init__(
+        self,
+        id: int,
+        name: str,
+        description: Union[str, None],
+        deadline: Union[str, None],
+        priority: int,
+        status: str,
+        recurrence: Union[str, None],
+        overdue: bool = False,
+        project_name: Union[str, None] = None,
+        completed_at: Union[str, None] = None,
+    ):
+        self.id = id
+        self.name = name
+        self.description = description
+        self.deadline = deadline
+        self.priority = priority
+        self.status = status
+        self.recurrence = recurrence
+        # Set by the overdue sweeper once the deadline has passed
+        self.overdue = bool(overdue)
+        # Only set by queries that join the project or read the archive
+        self.project_name = project_name
+        self.completed_at = completed_at
+
+
+class Subtask(Row):
+    __slots__ = ("id", "name", "status")
+
+    def __init__(self, id: int, name: str, status: str):
+        self.id = id
+        self.name = name
+        self.status = status
+
+
+class Change(Row):
+    __slots__ = (
+        "seq",
+        "entity",
+        "entity_id",
+        "project_id",
+        "op",
+        "version",
+        "actor",
+        "created_at",
+    )
+
+    def __init__(
+        self,
+        seq: int,
+        entity: str,
+        entity_id: int,
+        project_id: Union[int, None],
+        op: str,
+        version: int,
+        actor: Union[int, None],
+        created_at: float,
+    ):
+        self.seq = seq
+        # "user", "project", "task", "subtask" or "member" (a project's members)
+        self.entity = entity
+        self.entity_id = entity_id
+        # The project a change belongs to, None for users
+        self.project_id = project_id
+        # "insert", "update" or "delete"
+        self.op = op
+        # Counts the changes of this entity, a copy at a lower version is stale
+        self.version = version
+        self.actor = actor
+        self.created_at = created_at
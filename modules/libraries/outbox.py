@@ -0,0 +1,115 @@
+from aiogram import Bot
+from aiogram.exceptions import (
+    TelegramBadRequest,
+    TelegramForbiddenError,
+    TelegramRetryAfter,
+)
+from modules.libraries.storage import Storage
+import asyncio, logging, time
+
+
+class OutboxRelay:
+    def __init__(
+        self,
+        db: Storage,
+        bot: Bot,
+        batch_size: int = 50,
+        interval: float = 1.0,
+        max_attempts: int = 8,
+        base_delay: float = 2.0,
+        max_delay: float = 15 * 60,
+        retention: float = 7 * 24 * 60 * 60,
+    ):
+        self._db = db
+        self._bot = bot
+        self._batch_size = batch_size
+        self._interval = interval
+        self._max_attempts = max_attempts
+        self._base_delay = base_delay
+        self._max_delay = max_delay
+        self._retention = retention
+        self._stopping = asyncio.Event()
+        self.sent = 0
+        self.retried = 0
+        self.failed = 0
+
+    async def run(self) -> None:
+        last_prune = 0.0
+        while not self._stopping.is_set():
+            try:
+                delivered = await self.drain_once()
+            except Exception as e:
+                logging.error(f"Error occurred while draining outbox: {e}")
+                delivered = 0
+
+            if time.time() - last_prune > 60 * 60:
+                # Sent keys are kept for the retention period to deduplicate replays
+                await self._db.prune_outbox(time.time() - self._retention)
+                last_prune = time.time()
+
+            if delivered < self._batch_size:
+                try:
+                    await asyncio.wait_for(self._stopping.wait(), self._interval)
+                except asyncio.TimeoutError:
+                    pass
+
+    def stop(self) -> None:
+        # run() returns once the message being sent is marked, the rest of the
+        # batch stays in the outbox for the next start
+        self._stopping.set()
+
+    async def drain_once(self) -> int:
+        batch = await self._db.fetch_outbox_batch(self._batch_size)
+        for entry in batch:
+            if self._stopping.is_set():
+                break
+            # Cancelling the relay also waits for the message being sent to be
+            # marked: cut off between the send and the mark, it would go out
+            # again after a restart
+            delivery = asyncio.ensure_future(self._deliver(entry))
+            try:
+                await asyncio.shield(delivery)
+            except asyncio.CancelledError:
+                await delivery
+                raise
+        return len(batch)
+
+    async def _deliver(self, entry: dict) -> None:
+        try:
+            await self._bot.send_message(
+                entry["chat_id"], entry["text"], parse_mode=None
+            )
+        except TelegramRetryAfter as e:
+            await self._retry(entry, e.retry_after, str(e))
+            return
+        except (TelegramForbiddenError, TelegramBadRequest) as e:
+            # The user blocked the bot or the chat is gone, retrying won't help
+            await self._db.mark_outbox_retry(entry["id"], None, str(e))
+            self.failed += 1
+            logging.warning(
+                f"Dropped notification {entry['idempotency_key']} for chat {entry['chat_id']}: {e}"
+            )
+            return
+        except Exception as e:
+            delay = min(self._base_delay * 2 ** entry["attempts"], self._max_delay)
+            await self._retry(entry, delay, str(e))
+            return
+
+        # Marked right after each send, so a crash can repeat at most one message
+        await self._db.mark_outbox_sent(entry["id"])
+        self.sent += 1
+
+    async def _retry(self, entry: dict, delay: float, error: str) -> None:
+        if entry["attempts"] + 1 >= self._max_attempts:
+            await self._db.mark_outbox_retry(entry["id"], None, error)
+            self.failed += 1
+            logging.error(
+                f"Gave up on notification {entry['idempotency_key']} after {entry['attempts'] + 1} attempts: {error}"
+            )
+            return
+
+        await self._db.mark_outbox_retry(entry["id"], time.time() + delay, error)
+        self.retried += 1
+        logging.warning(
+            f"Retrying notification {entry['idempotency_key']} in {delay:.0f}s: {error}"
+        )
@@ -0,0 +1,76 @@
+from datetime import date
+from modules.libraries.recurrence import display_deadline, format_deadline
+from modules.libraries.storage import Storage
+import asyncio, logging, time
+
+WATERMARK = "overdue_sweeper"
+
+
+class OverdueSweeper:
+    def __init__(
+        self, db: Storage, interval: float, batch_size: int, notify_limit: int
+    ):
+        self._db = db
+        self._interval = interval
+        self._batch_size = batch_size
+        self._notify_limit = notify_limit
+        self.marked = 0
+
+    async def run(self) -> None:
+        while True:
+            try:
+                await self.sweep(date.today())
+            except Exception as e:
+                logging.error(f"Error occurred while sweeping overdue tasks: {e}")
+            await asyncio.sleep(self._interval)
+
+    async def sweep(self, today: date) -> int:
+        # Every run looks at all open tasks due before today that aren't
+        # flagged, so tasks created with a past deadline, reopened, or moved on
+        # to a date that has passed already are caught as well. Only the tasks
+        # fetched here are flagged, one that turns overdue meanwhile is left
+        # for the next run and its notification. Every step can be repeated:
+        # notifications carry the run's number as idempotency key and flagged
+        # tasks are skipped, so a failed run is simply redone.
+        until = format_deadline(today)
+        overdue = await self._db.fetch_new_overdue_tasks(until)
+        if overdue is None:
+            return 0
+
+        # The watermark numbers the runs that notified someone. It used to
+        # hold the last day swept.
+        last = await self._db.fetch_watermark(WATERMARK) or ""
+        number = int(last) + 1 if last.isdigit() else 1
+        now = time.time()
+        if overdue and not await self._db.enqueue_notifications(
+            [
+                (
+                    f"overdue:{user_id}:{number}",
+                    user_id,
+                    self.format_notification(tasks),
+                    now,
+                )
+                for user_id, tasks in overdue.items()
+            ]
+        ):
+            return 0
+
+        task_ids = sorted({task.id for tasks in overdue.values() for task in tasks})
+        marked = await self._db.mark_overdue(until, task_ids, self._batch_size)
+        self.marked += marked
+        if overdue:
+            await self._db.set_watermark(WATERMARK, str(number))
+        if marked:
+            logging.info(
+                f"Overdue sweep before {until}: {marked} tasks, {len(overdue)} users notified"
+            )
+        return marked
+
+    def format_notification(self, tasks: list) -> str:
+        lines = [
+            f"- {task.name} ({task.project_name}), до {display_deadline(task.deadline)}"
+            for task in tasks[: self._notify_limit]
+        ]
+        if len(tasks) > self._notify_limit:
+            lines.append(f"...и еще {len(tasks) - self._notify_limit}")
+        return "⚠️ Просрочены задачи:\n" + "\n".join(lines)
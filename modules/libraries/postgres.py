@@ -0,0 +1,1564 @@
+import asyncio
+import logging
+import secrets
+import time
+from contextlib import asynccontextmanager
+from datetime import date
+from modules.libraries.models import Change, Project, Subtask, Task, User
+from modules.libraries.recurrence import format_deadline
+from modules.libraries.storage import Storage, TASK_STATUSES, current_actor
+from typing import AsyncIterator, Union
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+POOL_MIN_SIZE = 2
+POOL_MAX_SIZE = 10
+STATEMENT_CACHE_SIZE = 256
+
+
+class _SQL:
+    # The PostgreSQL twin of dbms._SQL. asyncpg prepares each statement once per
+    # connection and caches it by its text. Id lists are bound as one bigint[],
+    # so bulk statements keep a single text too. Statements that look at a
+    # user's projects take the user id as $1.
+
+    TABLES = (
+        """
+        CREATE TABLE IF NOT EXISTS users (
+            id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            user_id BIGINT UNIQUE,
+            user_name TEXT NOT NULL,
+            created_at TIMESTAMP DEFAULT LOCALTIMESTAMP,
+            notifications BOOLEAN DEFAULT TRUE,
+            digest BOOLEAN DEFAULT FALSE,
+            calendar_token TEXT
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS projects (
+            id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            user_id BIGINT REFERENCES users (user_id),
+            name TEXT NOT NULL,
+            description TEXT,
+            created_at TIMESTAMP DEFAULT LOCALTIMESTAMP,
+            updated_at TIMESTAMP DEFAULT LOCALTIMESTAMP,
+            version INTEGER DEFAULT 0
+        )
+        """,
+        # Deadlines stay "YYYY-MM-DD" text like in SQLite, which sorts and
+        # range-scans the same as a date
+        """
+        CREATE TABLE IF NOT EXISTS tasks (
+            id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            project_id BIGINT REFERENCES projects (id) ON DELETE CASCADE,
+            name TEXT NOT NULL,
+            description TEXT,
+            deadline TEXT,
+            priority INTEGER,
+            status TEXT CHECK(status IN ('in progress', 'completed')) DEFAULT 'in progress',
+            recurrence TEXT,
+            created_at TIMESTAMP DEFAULT LOCALTIMESTAMP,
+            completed_at TIMESTAMP,
+            overdue BOOLEAN DEFAULT FALSE
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS subtasks (
+            id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            task_id BIGINT REFERENCES tasks (id) ON DELETE CASCADE,
+            name TEXT NOT NULL,
+            status TEXT CHECK(status IN ('in progress', 'completed')) DEFAULT 'in progress',
+            created_at TIMESTAMP DEFAULT LOCALTIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS shared_projects (
+            project_id BIGINT REFERENCES projects (id) ON DELETE CASCADE,
+            user_id BIGINT REFERENCES users (user_id),
+            PRIMARY KEY (project_id, user_id)
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS outbox (
+            id BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+            idempotency_key TEXT NOT NULL UNIQUE,
+            chat_id BIGINT NOT NULL,
+            text TEXT NOT NULL,
+            status TEXT CHECK(status IN ('pending', 'sent', 'failed')) DEFAULT 'pending',
+            attempts INTEGER DEFAULT 0,
+            not_before DOUBLE PRECISION NOT NULL,
+            last_error TEXT,
+            created_at TIMESTAMP DEFAULT LOCALTIMESTAMP,
+            sent_at TIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS watermarks (
+            name TEXT PRIMARY KEY,
+            value TEXT NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS calendar_versions (
+            user_id BIGINT PRIMARY KEY,
+            version INTEGER NOT NULL,
+            updated_at TIMESTAMP NOT NULL
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS changes (
+            seq BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+            entity TEXT NOT NULL,
+            entity_id BIGINT NOT NULL,
+            project_id BIGINT,
+            op TEXT CHECK(op IN ('insert', 'update', 'delete')) NOT NULL,
+            version INTEGER NOT NULL,
+            actor BIGINT,
+            created_at DOUBLE PRECISION NOT NULL
+        )
+        """,
+    )
+
+    # Columns added after the PostgreSQL backend first shipped
+    COLUMNS = (
+        "ALTER TABLE tasks ADD COLUMN IF NOT EXISTS overdue BOOLEAN DEFAULT FALSE",
+        "ALTER TABLE changes ADD COLUMN IF NOT EXISTS project_id BIGINT",
+    )
+
+    INDEXES = (
+        "CREATE INDEX IF NOT EXISTS idx_outbox_pending ON outbox (status, not_before)",
+        "CREATE INDEX IF NOT EXISTS idx_tasks_project_deadline ON tasks (project_id, deadline)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS idx_users_calendar_token ON users (calendar_token)",
+        "CREATE INDEX IF NOT EXISTS idx_projects_user ON projects (user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_users_user_name ON users (lower(user_name))",
+        "CREATE INDEX IF NOT EXISTS idx_shared_projects_user ON shared_projects (user_id)",
+        "CREATE INDEX IF NOT EXISTS idx_subtasks_task ON subtasks (task_id)",
+        "CREATE INDEX IF NOT EXISTS idx_tasks_completed ON tasks (completed_at) WHERE status = 'completed'",
+        "CREATE INDEX IF NOT EXISTS idx_tasks_next ON tasks (status, priority, deadline, project_id)",
+        "DROP INDEX IF EXISTS idx_tasks_open_deadline",
+        "CREATE INDEX IF NOT EXISTS idx_tasks_unflagged_deadline ON tasks (deadline, id) WHERE status = 'in progress' AND NOT overdue",
+        "CREATE INDEX IF NOT EXISTS idx_changes_entity ON changes (entity, entity_id, seq)",
+        "CREATE INDEX IF NOT EXISTS idx_changes_created ON changes (created_at, seq)",
+    )
+
+    # The archive is a schema of the same database, so moving a batch is one
+    # transaction instead of a copy that may be repeated
+    ARCHIVE_TABLES = (
+        "CREATE SCHEMA IF NOT EXISTS archive",
+        """
+        CREATE TABLE IF NOT EXISTS archive.tasks (
+            id BIGINT PRIMARY KEY,
+            project_id BIGINT,
+            name TEXT NOT NULL,
+            description TEXT,
+            deadline TEXT,
+            priority INTEGER,
+            status TEXT,
+            recurrence TEXT,
+            created_at TIMESTAMP,
+            completed_at TIMESTAMP,
+            archived_at TIMESTAMP DEFAULT LOCALTIMESTAMP
+        )
+        """,
+        """
+        CREATE TABLE IF NOT EXISTS archive.subtasks (
+            id BIGINT PRIMARY KEY,
+            task_id BIGINT,
+            name TEXT NOT NULL,
+            status TEXT,
+            created_at TIMESTAMP
+        )
+        """,
+        "CREATE INDEX IF NOT EXISTS idx_archive_tasks_project ON archive.tasks (project_id, completed_at)",
+        "CREATE INDEX IF NOT EXISTS idx_archive_subtasks_task ON archive.subtasks (task_id)",
+    )
+
+    # Same bookkeeping as the SQLite triggers: every task change bumps its
+    # project's version for the calendar feed
+    TRIGGERS = (
+        """
+        CREATE OR REPLACE FUNCTION tasks_touch_project() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            UPDATE projects SET version = version + 1, updated_at = LOCALTIMESTAMP
+            WHERE id IN (
+                CASE WHEN TG_OP <> 'INSERT' THEN OLD.project_id END,
+                CASE WHEN TG_OP <> 'DELETE' THEN NEW.project_id END
+            );
+            RETURN NULL;
+        END
+        $$
+        """,
+        "DROP TRIGGER IF EXISTS tasks_touch_project ON tasks",
+        """
+        CREATE TRIGGER tasks_touch_project
+        AFTER INSERT OR UPDATE OR DELETE ON tasks
+        FOR EACH ROW EXECUTE FUNCTION tasks_touch_project()
+        """,
+        """
+        CREATE OR REPLACE FUNCTION projects_touch() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        BEGIN
+            NEW.version := OLD.version + 1;
+            NEW.updated_at := LOCALTIMESTAMP;
+            RETURN NEW;
+        END
+        $$
+        """,
+        "DROP TRIGGER IF EXISTS projects_touch_update ON projects",
+        """
+        CREATE TRIGGER projects_touch_update
+        BEFORE UPDATE OF name, description ON projects
+        FOR EACH ROW EXECUTE FUNCTION projects_touch()
+        """,
+        # A project's version change or deletion, and a membership coming or
+        # going, bump the calendar versions of the users concerned. Members of
+        # a deleted project are bumped by the cascade to shared_projects.
+        # Users are locked in id order, so concurrent bumps can't deadlock.
+        """
+        CREATE OR REPLACE FUNCTION calendar_touch() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        DECLARE
+            changed JSONB := to_jsonb(CASE WHEN TG_OP = 'DELETE' THEN OLD ELSE NEW END);
+        BEGIN
+            INSERT INTO calendar_versions (user_id, version, updated_at)
+            SELECT user_id, 1, LOCALTIMESTAMP FROM (
+                SELECT (changed ->> 'user_id')::bigint AS user_id
+                UNION
+                SELECT user_id FROM shared_projects
+                WHERE TG_TABLE_NAME = 'projects' AND project_id = (changed ->> 'id')::bigint
+            ) concerned
+            WHERE user_id IS NOT NULL
+            ORDER BY user_id
+            ON CONFLICT (user_id) DO UPDATE SET
+                version = calendar_versions.version + 1,
+                updated_at = GREATEST(calendar_versions.updated_at, EXCLUDED.updated_at);
+            RETURN NULL;
+        END
+        $$
+        """,
+        "DROP TRIGGER IF EXISTS projects_touch_calendar_update ON projects",
+        """
+        CREATE TRIGGER projects_touch_calendar_update
+        AFTER UPDATE ON projects
+        FOR EACH ROW WHEN (OLD.version IS DISTINCT FROM NEW.version)
+        EXECUTE FUNCTION calendar_touch()
+        """,
+        "DROP TRIGGER IF EXISTS projects_touch_calendar_delete ON projects",
+        """
+        CREATE TRIGGER projects_touch_calendar_delete
+        AFTER DELETE ON projects
+        FOR EACH ROW EXECUTE FUNCTION calendar_touch()
+        """,
+        "DROP TRIGGER IF EXISTS shared_projects_touch_calendar ON shared_projects",
+        """
+        CREATE TRIGGER shared_projects_touch_calendar
+        AFTER INSERT OR DELETE ON shared_projects
+        FOR EACH ROW EXECUTE FUNCTION calendar_touch()
+        """,
+    )
+
+    # The change log, as in SQLite. Identity values are handed out before
+    # commit, so concurrent writers could commit seq 11 before seq 10 and a
+    # reader tailing from 11 would never see 10. The advisory lock keeps
+    # writers that log changes in seq order until they commit, which is the
+    # one-writer-at-a-time SQLite runs with anyway. The actor comes from the
+    # transaction-local prodigy.actor setting. Arguments: the entity, its id
+    # column and its project column; subtasks look their project up.
+    RECORD_CHANGE = """
+        CREATE OR REPLACE FUNCTION record_change() RETURNS trigger
+        LANGUAGE plpgsql AS $$
+        DECLARE
+            changed JSONB := to_jsonb(CASE WHEN TG_OP = 'DELETE' THEN OLD ELSE NEW END);
+            changed_id BIGINT := (changed ->> TG_ARGV[1])::bigint;
+            changed_project BIGINT;
+        BEGIN
+            PERFORM pg_advisory_xact_lock(hashtext('changes'));
+            IF TG_TABLE_NAME = 'subtasks' THEN
+                SELECT project_id INTO changed_project
+                FROM tasks WHERE id = (changed ->> 'task_id')::bigint;
+            ELSIF TG_NARGS > 2 THEN
+                changed_project := (changed ->> TG_ARGV[2])::bigint;
+            END IF;
+            INSERT INTO changes (entity, entity_id, project_id, op, version, actor, created_at)
+            VALUES (
+                TG_ARGV[0],
+                changed_id,
+                changed_project,
+                lower(TG_OP),
+                COALESCE((
+                    SELECT version FROM changes
+                    WHERE entity = TG_ARGV[0] AND entity_id = changed_id
+                    ORDER BY seq DESC LIMIT 1
+                ), 0) + 1,
+                NULLIF(current_setting('prodigy.actor', true), '')::bigint,
+                extract(epoch FROM clock_timestamp())
+            );
+            RETURN NULL;
+        END
+        $$
+        """
+    CHANGE_TRIGGERS = (RECORD_CHANGE,) + tuple(
+        statement
+        for table, arguments in (
+            ("users", "'user', 'user_id'"),
+            ("projects", "'project', 'id', 'id'"),
+            ("tasks", "'task', 'id', 'project_id'"),
+            ("subtasks", "'subtask', 'id'"),
+            ("shared_projects", "'member', 'project_id', 'project_id'"),
+        )
+        for statement in (
+            f"DROP TRIGGER IF EXISTS changes_{table} ON {table}",
+            f"""
+            CREATE TRIGGER changes_{table}
+            AFTER INSERT OR DELETE OR UPDATE{" OF name, description" if table == "projects" else ""} ON {table}
+            FOR EACH ROW EXECUTE FUNCTION record_change({arguments})
+            """,
+        )
+    )
+    SET_ACTOR = "SELECT set_config('prodigy.actor', $1, true)"
+
+    # Timestamps leave the database in the text form SQLite hands out
+    USER_COLUMNS = "id, user_id, user_name, to_char(created_at, 'YYYY-MM-DD HH24:MI:SS'), notifications, digest, calendar_token"
+    TASK_COLUMNS = "t.id, t.name, t.description, t.deadline, t.priority, t.status, t.recurrence, t.overdue"
+    USER_PROJECT_IDS = """
+        SELECT id FROM projects WHERE user_id = $1
+        UNION
+        SELECT project_id FROM shared_projects WHERE user_id = $1
+        """
+
+    INSERT_USER = "INSERT INTO users (user_id, user_name) VALUES ($1, $2) ON CONFLICT (user_id) DO NOTHING"
+    SELECT_USER = f"SELECT {USER_COLUMNS} FROM users WHERE user_id = $1"
+    SELECT_USER_BY_NAME = (
+        f"SELECT {USER_COLUMNS} FROM users WHERE lower(user_name) = lower($1) LIMIT 1"
+    )
+    SELECT_USER_IDS = "SELECT user_id FROM users ORDER BY user_id"
+    UPDATE_USER_NAME = "UPDATE users SET user_name = $1 WHERE user_id = $2 AND user_name IS DISTINCT FROM $1"
+
+    INSERT_PROJECT = (
+        "INSERT INTO projects (user_id, name, description) VALUES ($1, $2, $3)"
+    )
+    UPDATE_PROJECT = "UPDATE projects SET name = $1, description = $2 WHERE user_id = $3 AND name = $4"
+    DELETE_PROJECT = "DELETE FROM projects WHERE id = $1"
+    SELECT_PROJECTS = (
+        "SELECT id, name, description FROM projects WHERE user_id = $1 ORDER BY id"
+    )
+    SELECT_PROJECT = "SELECT id, name, description FROM projects WHERE id = $1"
+    SELECT_MEMBER_PROJECTS = """
+        SELECT p.id, p.name, p.description
+        FROM projects p
+        JOIN shared_projects sp ON p.id = sp.project_id
+        WHERE sp.user_id = $1
+        ORDER BY p.id
+        """
+
+    INSERT_TASK = "INSERT INTO tasks (project_id, name, description, deadline, priority) VALUES ($1, $2, $3, $4, $5)"
+    # Same order SQLite reads them in through idx_tasks_project_deadline
+    SELECT_TASKS = f"""
+        SELECT {TASK_COLUMNS} FROM tasks t
+        WHERE t.project_id = $1
+        ORDER BY t.deadline NULLS FIRST, t.id
+        """
+    SELECT_TASK = f"SELECT {TASK_COLUMNS} FROM tasks t WHERE t.id = $1"
+    USER_HAS_TASKS = """
+        SELECT EXISTS (
+            SELECT 1 FROM tasks
+            WHERE project_id IN (SELECT id FROM projects WHERE user_id = $1)
+        )
+        """
+    # Rows are locked, so two bulk edits can't advance the same series twice
+    SELECT_TASK_SCHEDULE = (
+        "SELECT id, deadline, recurrence FROM tasks WHERE id = $1 FOR UPDATE"
+    )
+    SELECT_USER_TASK_SCHEDULES = f"""
+        SELECT id, deadline, recurrence FROM tasks
+        WHERE id = ANY($2::bigint[])
+        AND project_id IN ({USER_PROJECT_IDS})
+        ORDER BY id
+        FOR UPDATE
+        """
+    SELECT_PROJECT_TASK_SCHEDULES = f"""
+        SELECT id, deadline, recurrence FROM tasks
+        WHERE project_id = $2
+        AND project_id IN ({USER_PROJECT_IDS})
+        ORDER BY deadline NULLS FIRST, id
+        FOR UPDATE
+        """
+    UPDATE_TASKS_STATUS = """
+        UPDATE tasks
+        SET status = $1,
+            completed_at = CASE WHEN $1 = 'completed' THEN COALESCE(completed_at, LOCALTIMESTAMP) END
+        WHERE id = ANY($2::bigint[])
+        """
+    ADVANCE_TASK = "UPDATE tasks SET deadline = $1, status = 'in progress', overdue = FALSE WHERE id = $2"
+    UPDATE_TASK_RECURRENCE = (
+        "UPDATE tasks SET recurrence = $1 WHERE id = $2 RETURNING deadline"
+    )
+    DELETE_TASK = "DELETE FROM tasks WHERE id = $1 RETURNING deadline, recurrence"
+
+    INSERT_SUBTASK = "INSERT INTO subtasks (task_id, name) VALUES ($1, $2)"
+    SELECT_SUBTASKS = """
+        SELECT id, name, status FROM subtasks
+        WHERE task_id IN (SELECT id FROM tasks WHERE project_id = $1)
+        ORDER BY id
+        """
+    SELECT_SUBTASK = "SELECT id, name, status FROM subtasks WHERE id = $1"
+    USER_HAS_SUBTASKS = """
+        SELECT EXISTS (
+            SELECT 1 FROM subtasks
+            WHERE task_id IN (
+                SELECT id FROM tasks
+                WHERE project_id IN (SELECT id FROM projects WHERE user_id = $1)
+            )
+        )
+        """
+    COMPLETE_SUBTASK = "UPDATE subtasks SET status = 'completed' WHERE id = $1"
+    COMPLETE_TASK_SUBTASKS = """
+        UPDATE subtasks SET status = 'completed'
+        WHERE task_id = ANY($1::bigint[]) AND status <> 'completed'
+        """
+    COMPLETE_USER_SUBTASKS = f"""
+        UPDATE subtasks SET status = 'completed'
+        WHERE id = ANY($2::bigint[])
+        AND task_id IN (SELECT id FROM tasks WHERE project_id IN ({USER_PROJECT_IDS}))
+        RETURNING id, task_id
+        """
+    COMPLETE_PROJECT_SUBTASKS = f"""
+        UPDATE subtasks SET status = 'completed'
+        WHERE task_id IN (
+            SELECT id FROM tasks
+            WHERE project_id = $2 AND project_id IN ({USER_PROJECT_IDS})
+        )
+        RETURNING id, task_id
+        """
+    COMPLETE_FINISHED_TASKS = """
+        UPDATE tasks SET status = 'completed', completed_at = LOCALTIMESTAMP
+        WHERE id = ANY($1::bigint[])
+        AND status <> 'completed' AND recurrence IS NULL
+        AND NOT EXISTS (
+            SELECT 1 FROM subtasks
+            WHERE subtasks.task_id = tasks.id AND subtasks.status <> 'completed'
+        )
+        RETURNING id, deadline
+        """
+    DELETE_SUBTASK = "DELETE FROM subtasks WHERE id = $1"
+
+    SELECT_PROJECT_MEMBER = (
+        "SELECT 1 FROM shared_projects WHERE project_id = $1 AND user_id = $2"
+    )
+    INSERT_PROJECT_MEMBER = "INSERT INTO shared_projects (project_id, user_id) VALUES ($1, $2) ON CONFLICT DO NOTHING"
+    ENQUEUE_SHARE_NOTIFICATION = """
+        INSERT INTO outbox (idempotency_key, chat_id, text, not_before)
+        SELECT $1, u.user_id, 'Вам открыли доступ к проекту «' || p.name || '». Проверьте командой /projects.', $2
+        FROM users u, projects p
+        WHERE u.user_id = $3 AND p.id = $4 AND u.notifications
+        ON CONFLICT (idempotency_key) DO NOTHING
+        """
+
+    SELECT_CALENDAR_TOKEN = (
+        "SELECT calendar_token FROM users WHERE user_id = $1 FOR UPDATE"
+    )
+    UPDATE_CALENDAR_TOKEN = "UPDATE users SET calendar_token = $1 WHERE user_id = $2"
+    SELECT_USER_BY_CALENDAR_TOKEN = (
+        "SELECT user_id FROM users WHERE calendar_token = $1"
+    )
+    SELECT_CALENDAR_VERSION = """
+        SELECT COALESCE(v.version, 0), COALESCE(v.updated_at, u.created_at)
+        FROM users u
+        LEFT JOIN calendar_versions v ON v.user_id = u.user_id
+        WHERE u.user_id = $1
+        """
+    SELECT_CALENDAR_TASKS = f"""
+        SELECT {TASK_COLUMNS}, p.name
+        FROM tasks t
+        JOIN projects p ON p.id = t.project_id
+        WHERE t.project_id IN ({USER_PROJECT_IDS})
+        AND t.deadline IS NOT NULL
+        ORDER BY t.deadline
+        """
+    SELECT_DEADLINE_COUNTS = f"""
+        SELECT deadline, recurrence, COUNT(*)
+        FROM tasks
+        WHERE project_id IN ({USER_PROJECT_IDS})
+        AND status <> 'completed'
+        AND (
+            deadline BETWEEN $2 AND $3
+            OR (recurrence IS NOT NULL AND deadline <= $3)
+        )
+        GROUP BY deadline, recurrence
+        """
+    SELECT_TASKS_BY_DAY = f"""
+        SELECT {TASK_COLUMNS}, p.name
+        FROM tasks t
+        JOIN projects p ON p.id = t.project_id
+        WHERE t.project_id IN ({USER_PROJECT_IDS})
+        AND (
+            t.deadline = $2
+            OR (t.recurrence IS NOT NULL AND t.deadline <= $2)
+        )
+        ORDER BY t.priority
+        """
+
+    SELECT_NEXT_TASKS = f"""
+        SELECT {TASK_COLUMNS}, p.name
+        FROM tasks t
+        JOIN projects p ON p.id = t.project_id
+        WHERE t.status = 'in progress'
+        AND t.project_id IN ({USER_PROJECT_IDS})
+        ORDER BY t.priority, t.deadline, t.project_id, t.id
+        LIMIT $2
+        """
+
+    SELECT_NOTIFICATION_SETTINGS = (
+        "SELECT notifications, digest FROM users WHERE user_id = $1"
+    )
+    UPDATE_NOTIFICATION_SETTINGS = """
+        UPDATE users
+        SET notifications = COALESCE($1, notifications), digest = COALESCE($2, digest)
+        WHERE user_id = $3
+        """
+    SELECT_DIGEST_TASKS = f"""
+        SELECT m.user_id, {TASK_COLUMNS}, p.name
+        FROM (
+            SELECT id AS project_id, user_id FROM projects
+            UNION
+            SELECT project_id, user_id FROM shared_projects
+        ) m
+        JOIN users u ON u.user_id = m.user_id
+        JOIN tasks t ON t.project_id = m.project_id
+        JOIN projects p ON p.id = t.project_id
+        WHERE u.notifications AND u.digest
+        AND t.status <> 'completed'
+        AND t.deadline <= $1
+        ORDER BY m.user_id, t.deadline, t.priority
+        """
+
+    ENQUEUE_NOTIFICATION = """
+        INSERT INTO outbox (idempotency_key, chat_id, text, not_before)
+        VALUES ($1, $2, $3, $4)
+        ON CONFLICT (idempotency_key) DO NOTHING
+        """
+    SELECT_OUTBOX_BATCH = """
+        SELECT id, idempotency_key, chat_id, text, attempts
+        FROM outbox
+        WHERE status = 'pending' AND not_before <= $1
+        ORDER BY not_before
+        LIMIT $2
+        """
+    MARK_OUTBOX_SENT = """
+        UPDATE outbox
+        SET status = 'sent', attempts = attempts + 1, sent_at = LOCALTIMESTAMP
+        WHERE id = $1
+        """
+    MARK_OUTBOX_RETRY = """
+        UPDATE outbox
+        SET status = CASE WHEN $1::double precision IS NULL THEN 'failed' ELSE 'pending' END,
+            attempts = attempts + 1,
+            not_before = COALESCE($1, not_before),
+            last_error = $2
+        WHERE id = $3
+        """
+    PRUNE_OUTBOX = "DELETE FROM outbox WHERE status <> 'pending' AND not_before < $1"
+
+    SELECT_WATERMARK = "SELECT value FROM watermarks WHERE name = $1"
+    UPSERT_WATERMARK = """
+        INSERT INTO watermarks (name, value) VALUES ($1, $2)
+        ON CONFLICT (name) DO UPDATE SET value = excluded.value
+        """
+    SELECT_NEW_OVERDUE_TASKS = f"""
+        SELECT m.user_id, {TASK_COLUMNS}, p.name
+        FROM tasks t
+        JOIN projects p ON p.id = t.project_id
+        JOIN (
+            SELECT id AS project_id, user_id FROM projects
+            UNION
+            SELECT project_id, user_id FROM shared_projects
+        ) m ON m.project_id = t.project_id
+        JOIN users u ON u.user_id = m.user_id
+        WHERE t.status = 'in progress' AND NOT t.overdue
+        AND t.deadline < $1
+        AND u.notifications
+        ORDER BY m.user_id, t.deadline, t.priority, t.id
+        """
+    MARK_OVERDUE = """
+        UPDATE tasks SET overdue = TRUE
+        WHERE id = ANY($1::bigint[]) AND status = 'in progress' AND NOT overdue
+        """
+    SELECT_QUIET_OVERDUE_BATCH = """
+        SELECT t.id, t.deadline FROM tasks t
+        WHERE t.status = 'in progress' AND NOT t.overdue
+        AND (t.deadline, t.id) > ($1, $2) AND t.deadline < $3
+        AND NOT EXISTS (
+            SELECT 1 FROM projects p JOIN users u ON u.user_id = p.user_id
+            WHERE p.id = t.project_id AND u.notifications
+        )
+        AND NOT EXISTS (
+            SELECT 1 FROM shared_projects sp JOIN users u ON u.user_id = sp.user_id
+            WHERE sp.project_id = t.project_id AND u.notifications
+        )
+        ORDER BY t.deadline, t.id
+        LIMIT $4
+        """
+
+    SELECT_CHANGES = """
+        SELECT seq, entity, entity_id, project_id, op, version, actor, created_at
+        FROM changes
+        WHERE seq > $1
+        ORDER BY seq
+        LIMIT $2
+        """
+    SELECT_LAST_CHANGE_SEQ = "SELECT COALESCE(MAX(seq), 0) FROM changes"
+    SELECT_CHANGE_FANOUT = """
+        SELECT m.user_id, c.project_id, p.name, a.user_name, c.entity, c.entity_id, c.op,
+            COALESCE(t.name, s.name), COALESCE(t.status, s.status)
+        FROM changes c
+        JOIN projects p ON p.id = c.project_id
+        JOIN (
+            SELECT id AS project_id, user_id FROM projects
+            UNION
+            SELECT project_id, user_id FROM shared_projects
+        ) m ON m.project_id = c.project_id
+        JOIN users u ON u.user_id = m.user_id
+        LEFT JOIN users a ON a.user_id = c.actor
+        LEFT JOIN tasks t ON c.entity = 'task' AND t.id = c.entity_id
+        LEFT JOIN subtasks s ON c.entity = 'subtask' AND s.id = c.entity_id
+        WHERE c.seq > $1 AND c.seq <= $2
+        AND c.entity IN ('task', 'subtask')
+        AND c.actor IS NOT NULL AND m.user_id <> c.actor
+        AND u.notifications
+        ORDER BY m.user_id, c.project_id, c.seq
+        """
+    SELECT_PRUNABLE_CHANGES = """
+        SELECT c.seq, c.created_at FROM changes c
+        WHERE c.created_at < $1 AND (c.created_at, c.seq) > ($2, $3)
+        AND (
+            (c.op = 'delete' AND c.entity IN ('project', 'task', 'subtask'))
+            OR EXISTS (
+                SELECT 1 FROM changes n
+                WHERE n.entity = c.entity AND n.entity_id = c.entity_id AND n.seq > c.seq
+            )
+        )
+        ORDER BY c.created_at, c.seq
+        LIMIT $4
+        """
+    DELETE_CHANGES = "DELETE FROM changes WHERE seq = ANY($1::bigint[])"
+
+    SELECT_ARCHIVABLE_TASKS = """
+        SELECT id FROM tasks
+        WHERE status = 'completed'
+        AND completed_at < LOCALTIMESTAMP - make_interval(days => $1)
+        ORDER BY completed_at
+        LIMIT $2
+        """
+    # Subtasks go first, deleting a task would cascade to them
+    ARCHIVE_BATCH = (
+        """
+        INSERT INTO archive.tasks
+            (id, project_id, name, description, deadline, priority, status, recurrence, created_at, completed_at)
+        SELECT id, project_id, name, description, deadline, priority, status, recurrence, created_at, completed_at
+        FROM tasks WHERE id = ANY($1::bigint[])
+        ON CONFLICT (id) DO NOTHING
+        """,
+        """
+        INSERT INTO archive.subtasks (id, task_id, name, status, created_at)
+        SELECT id, task_id, name, status, created_at
+        FROM subtasks WHERE task_id = ANY($1::bigint[])
+        ON CONFLICT (id) DO NOTHING
+        """,
+        "DELETE FROM subtasks WHERE task_id = ANY($1::bigint[])",
+        "DELETE FROM tasks WHERE id = ANY($1::bigint[])",
+    )
+    SELECT_ARCHIVED_TASKS = f"""
+        SELECT t.id, t.name, t.description, t.deadline, t.priority, t.status, t.recurrence, FALSE, p.name, to_char(t.completed_at, 'YYYY-MM-DD HH24:MI:SS')
+        FROM archive.tasks t
+        JOIN projects p ON p.id = t.project_id
+        WHERE t.project_id IN ({USER_PROJECT_IDS})
+        ORDER BY t.completed_at DESC, t.id DESC
+        LIMIT $2 OFFSET $3
+        """
+
+
+def _rowcount(status: str) -> int:
+    # asyncpg returns the command tag, e.g. "DELETE 12" or "INSERT 0 1"
+    return int(status.rsplit(" ", 1)[-1])
+
+
+class PostgresDatabase(Storage):
+    def __init__(
+        self, dsn: str, min_size: int = POOL_MIN_SIZE, max_size: int = POOL_MAX_SIZE
+    ):
+        super().__init__()
+        self.dsn = dsn
+        self._min_size = min_size
+        self._max_size = max_size
+        self._pool = None
+        self._connect_lock = asyncio.Lock()
+
+    async def connect(self) -> None:
+        async with self._connect_lock:
+            if self._pool is not None:
+                return
+            if asyncpg is None:
+                raise RuntimeError(
+                    "PostgreSQL storage needs asyncpg, install it with pip install asyncpg"
+                )
+
+            # Timestamps are stored without a time zone, keep them in UTC like
+            # SQLite's CURRENT_TIMESTAMP
+            self._pool = await asyncpg.create_pool(
+                self.dsn,
+                min_size=self._min_size,
+                max_size=self._max_size,
+                statement_cache_size=STATEMENT_CACHE_SIZE,
+                server_settings={"timezone": "UTC"},
+            )
+            logging.info(
+                f"Opened PostgreSQL pool of {self._min_size}-{self._max_size} connections"
+            )
+
+    @asynccontextmanager
+    async def _read(self):
+        if self._pool is None:
+            await self.connect()
+        async with self._pool.acquire() as conn:
+            yield conn
+
+    @asynccontextmanager
+    async def _write(self):
+        if self._pool is None:
+            await self.connect()
+        async with self._pool.acquire() as conn:
+            async with conn.transaction():
+                actor = current_actor.get()
+                if actor is not None:
+                    await conn.execute(_SQL.SET_ACTOR, str(actor))
+                yield conn
+
+    def stats(self) -> dict:
+        if self._pool is None:
+            return super().stats()
+        return {
+            **super().stats(),
+            "pool_size": self._pool.get_size(),
+            "idle_connections": self._pool.get_idle_size(),
+        }
+
+    async def create_tables(self):
+        async with self._write() as conn:
+            for statement in (
+                _SQL.TABLES
+                + _SQL.COLUMNS
+                + _SQL.INDEXES
+                + _SQL.ARCHIVE_TABLES
+                + _SQL.TRIGGERS
+                + _SQL.CHANGE_TRIGGERS
+            ):
+                await conn.execute(statement)
+            logging.info("Successfully created tables")
+
+    async def add_user(self, user_id: int, user_name: str) -> bool:
+        try:
+            async with self._write() as conn:
+                status = await conn.execute(_SQL.INSERT_USER, user_id, user_name or "")
+            if _rowcount(status):
+                logging.info(f"Added user with ID {user_id} and name {user_name}")
+            else:
+                logging.info(
+                    f"User with name ID {user_id} and name {user_name} already exists"
+                )
+            return True
+        except Exception as e:
+            logging.error(f"Error occurred while adding user: {e}")
+            return False
+
+    async def fetch_user(self, user_id: int) -> Union[User, None]:
+        try:
+            async with self._read() as conn:
+                row = await conn.fetchrow(_SQL.SELECT_USER, user_id)
+                return User(*row) if row else None
+        except Exception as e:
+            logging.error(f"Error occurred while fetching user: {e}")
+            return None
+
+    async def fetch_user_ids(self) -> list:
+        user_ids = []
+        try:
+            async with self._read() as conn:
+                user_ids = [row[0] for row in await conn.fetch(_SQL.SELECT_USER_IDS)]
+                logging.info(f"Fetched {len(user_ids)} user ids")
+        except Exception as e:
+            logging.error(f"Error occurred while fetching user ids: {e}")
+        return user_ids
+
+    async def fetch_user_by_name(self, user_name: str) -> Union[User, None]:
+        try:
+            async with self._read() as conn:
+                row = await conn.fetchrow(_SQL.SELECT_USER_BY_NAME, user_name)
+                return User(*row) if row else None
+        except Exception as e:
+            logging.error(f"Error occurred while fetching user by name: {e}")
+            return None
+
+    async def update_user_names(self, user_names: list) -> bool:
+        try:
+            async with self._write() as conn:
+                await conn.executemany(
+                    _SQL.UPDATE_USER_NAME,
+                    [(name, user_id) for user_id, name in user_names],
+                )
+            logging.info(f"Refreshed {len(user_names)} user names")
+            return True
+        except Exception as e:
+            logging.error(f"Error occurred while updating user names: {e}")
+            return False
+
+    async def new_project(self, user_id: int, name: str, desc: str) -> bool:
+        try:
+            async with self._write() as conn:
+                await conn.execute(_SQL.INSERT_PROJECT, user_id, name, desc)
+            logging.info(
+                f"User with id {user_id} successfully created new project with name {name}"
+            )
+            return True
+        except Exception as e:
+            logging.error(f"Error occurred while adding project: {e}")
+            return False
+
+    async def edit_project(
+        self, user_id: int, old_name: str, new_name: str, new_desc: str
+    ) -> bool:
+        try:
+            async with self._write() as conn:
+                await conn.execute(
+                    _SQL.UPDATE_PROJECT, new_name, new_desc, user_id, old_name
+                )
+            logging.info(
+                f"User with id {user_id} successfully edited project with name {old_name} to {new_name}"
+            )
+            return True
+        except Exception as e:
+            logging.error(f"Error occurred while editing project: {e}")
+            return False
+
+    async def delete_project(self, project_id: int) -> bool:
+        try:
+            async with self._write() as conn:
+                await conn.execute(_SQL.DELETE_PROJECT, project_id)
+            self._invalidate_calendar()
+            logging.info(f"Deleted project with id {project_id}")
+            return True
+        except Exception as e:
+            logging.error(f"Error occurred while deleting project: {e}")
+            return False
+
+    async def fetch_projects(self, user_id: int) -> list:
+        projects = []
+        try:
+            async with self._read() as conn:
+                rows = await conn.fetch(_SQL.SELECT_PROJECTS, user_id)
+                projects = [Project(*row) for row in rows]
+                logging.info(f"Fetched all projects for user with id {user_id}")
+        except Exception as e:
+            logging.error(f"Error occurred while fetching projects: {e}")
+        return projects
+
+    async def fetch_project(self, project_id: int) -> Union[Project, None]:
+        try:
+            async with self._read() as conn:
+                row = await conn.fetchrow(_SQL.SELECT_PROJECT, project_id)
+                return Project(*row) if row else None
+        except Exception as e:
+            logging.error(f"Error occurred while fetching project: {e}")
+            return None
+
+    async def new_task(
+        self,
+        user_id: int,
+        project_id: int,
+        task_name: str,
+        task_description: str,
+        task_deadline: str,
+        priority: int,
+    ) -> bool:
+        try:
+            async with self._write() as conn:
+                await conn.execute(
+                    _SQL.INSERT_TASK,
+                    project_id,
+                    task_name,
+                    task_description,
+                    task_deadline,
+                    priority,
+                )
+            self._invalidate_calendar(task_deadline)
+            logging.info(
+                f"User with id {user_id} successfully created new task with name {task_name} for project with ID {project_id}"
+            )
+            return True
+        except Exception as e:
+            logging.error(f"Error occurred while adding task: {e}")
+            return False
+
+    async def fetch_tasks(self, project_id: int) -> list:
+        tasks = []
+        try:
+            async with self._read() as conn:
+                rows = await conn.fetch(_SQL.SELECT_TASKS, project_id)
+                tasks = [Task(*row) for row in rows]
+                logging.info(f"Fetched all tasks for project with id {project_id}")
+        except Exception as e:
+            logging.error(f"Error occurred while fetching tasks: {e}")
+        return tasks
+
+    async def fetch_task(self, task_id: int) -> Union[Task, None]:
+        task = None
+        try:
+            async with self._read() as conn:
+                row = await conn.fetchrow(_SQL.SELECT_TASK, task_id)
+                if row:
+                    task = Task(*row)
+                    logging.info(f"Fetched task with id {task_id}")
+                else:
+                    logging.info(f"Task with id {task_id} not found.")
+        except Exception as e:
+            logging.error(f"Error occurred while fetching task with id {task_id}: {e}")
+        return task
+
+    async def user_has_tasks(self, user_id: int) -> bool:
+        try:
+            async with self._read() as conn:
+                return await conn.fetchval(_SQL.USER_HAS_TASKS, user_id)
+        except Exception as e:
+            logging.error(f"Error occurred while checking user tasks: {e}")
+            return False
+
+    async def edit_task(self, task_id: int, progress: int) -> bool:
+        if progress not in TASK_STATUSES:
+            logging.error(f"Invalid progress value: {progress}")
+            return False
+        try:
+            async with self._write() as conn:
+                rows = await conn.fetch(_SQL.SELECT_TASK_SCHEDULE, task_id)
+                await self._apply_task_status(conn, rows, TASK_STATUSES[progress])
+            logging.info(
+                f"Updated task with id {task_id} to status {TASK_STATUSES[progress]}"
+            )
+            return True
+        except Exception as e:
+            logging.error(f"Error occurred while editing task: {e}")
+            return False
+
+    async def edit_tasks(
+        self,
+        user_id: int,
+        progress: int,
+        task_ids: Union[list, None] = None,
+        project_id: Union[int, None] = None,
+    ) -> Union[list, None]:
+        if progress not in TASK_STATUSES:
+            logging.error(f"Invalid progress value: {progress}")
+            return None
+        try:
+            async with self._write() as conn:
+                if project_id is not None:
+                    rows = await conn.fetch(
+                        _SQL.SELECT_PROJECT_TASK_SCHEDULES, user_id, project_id
+                    )
+                else:
+                    rows = await conn.fetch(
+                        _SQL.SELECT_USER_TASK_SCHEDULES, user_id, task_ids
+                    )
+                await self._apply_task_status(conn, rows, TASK_STATUSES[progress])
+            logging.info(
+                f"User with id {user_id} updated {len(rows)} tasks to status {TASK_STATUSES[progress]}"
+            )
+            return [row[0] for row in rows]
+        except Exception as e:
+            logging.error(f"Error occurred while editing tasks: {e}")
+            return None
+
+    async def _apply_task_status(self, conn, rows: list, status: str) -> None:
+        # rows: (id, deadline, recurrence). Runs inside the caller's transaction.
+        if status == "completed":
+            advanced = self._next_deadlines(rows)
+            if advanced:
+                await conn.executemany(_SQL.ADVANCE_TASK, advanced)
+
+        task_ids = [row[0] for row in rows if status != "completed" or not row[2]]
+        await conn.execute(_SQL.UPDATE_TASKS_STATUS, status, task_ids)
+        if status == "completed":
+            await conn.execute(_SQL.COMPLETE_TASK_SUBTASKS, task_ids)
+
+        for _, deadline, rule in rows:
+            self._invalidate_calendar(deadline, recurring=bool(rule))
+
+    async def set_task_recurrence(self, task_id: int, rule: Union[str, None]) -> bool:
+        try:
+            async with self._write() as conn:
+                deadline = await conn.fetchrow(
+                    _SQL.UPDATE_TASK_RECURRENCE, rule, task_id
+                )
+            if deadline:
+                self._invalidate_calendar(deadline[0], recurring=True)
+            logging.info(f"Set recurrence of task with id {task_id} to {rule}")
+            return True
+        except Exception as e:
+            logging.error(f"Error occurred while setting task recurrence: {e}")
+            return False
+
+    async def remove_task(self, task_id: int) -> bool:
+        try:
+            async with self._write() as conn:
+                row = await conn.fetchrow(_SQL.DELETE_TASK, task_id)
+            if row:
+                self._invalidate_calendar(row[0], recurring=bool(row[1]))
+            logging.info(f"Deleted task with id {task_id}")
+            return True
+        except Exception as e:
+            logging.error(f"Error occurred while deleting task: {e}")
+            return False
+
+    async def add_subtask(self, task_id: int, name: str) -> bool:
+        try:
+            async with self._write() as conn:
+                await conn.execute(_SQL.INSERT_SUBTASK, task_id, name)
+            logging.info(f"Added subtask with name {name} to task with id {task_id}")
+            return True
+        except Exception as e:
+            logging.error(f"Error occurred while adding subtask: {e}")
+            return False
+
+    async def add_subtasks(self, task_id: int, names: list) -> bool:
+        try:
+            async with self._write() as conn:
+                await conn.executemany(
+                    _SQL.INSERT_SUBTASK, [(task_id, name) for name in names]
+                )
+            logging.info(f"Added {len(names)} subtasks to task with id {task_id}")
+            return True
+        except Exception as e:
+            logging.error(f"Error occurred while adding subtasks: {e}")
+            return False
+
+    async def fetch_subtasks(self, project_id: int) -> list:
+        subtasks = []
+        try:
+            async with self._read() as conn:
+                rows = await conn.fetch(_SQL.SELECT_SUBTASKS, project_id)
+                subtasks = [Subtask(*row) for row in rows]
+                logging.info(f"Fetched all subtasks for project with id {project_id}")
+        except Exception as e:
+            logging.error(f"Error occurred while fetching subtasks: {e}")
+        return subtasks
+
+    async def fetch_subtask(self, subtask_id: int) -> Union[Subtask, None]:
+        subtask = None
+        try:
+            async with self._read() as conn:
+                row = await conn.fetchrow(_SQL.SELECT_SUBTASK, subtask_id)
+                if row:
+                    subtask = Subtask(*row)
+                    logging.info(f"Fetched subtask with id {subtask_id}")
+                else:
+                    logging.info(f"Subtask with id {subtask_id} not found.")
+        except Exception as e:
+            logging.error(
+                f"Error occurred while fetching subtask with id {subtask_id}: {e}"
+            )
+        return subtask
+
+    async def user_has_subtasks(self, user_id: int) -> bool:
+        try:
+            async with self._read() as conn:
+                return await conn.fetchval(_SQL.USER_HAS_SUBTASKS, user_id)
+        except Exception as e:
+            logging.error(f"Error occurred while checking user subtasks: {e}")
+            return False
+
+    async def edit_subtask(self, subtask_id: int) -> bool:
+        try:
+            async with self._write() as conn:
+                await conn.execute(_SQL.COMPLETE_SUBTASK, subtask_id)
+            logging.info(f"Updated subtask with id {subtask_id} to completed")
+            return True
+        except Exception as e:
+            logging.error(f"Error occurred while editing subtask: {e}")
+            return False
+
+    async def delete_subtask(self, subtask_id: int) -> bool:
+        try:
+            async with self._write() as conn:
+                await conn.execute(_SQL.DELETE_SUBTASK, subtask_id)
+            logging.info(f"Deleted subtask with id {subtask_id}")
+            return True
+        except Exception as e:
+            logging.error(f"Error occurred while deleting subtask: {e}")
+            return False
+
+    async def edit_subtasks(
+        self,
+        user_id: int,
+        subtask_ids: Union[list, None] = None,
+        project_id: Union[int, None] = None,
+        complete_tasks: bool = False,
+    ) -> Union[tuple, None]:
+        try:
+            async with self._write() as conn:
+                if project_id is not None:
+                    rows = await conn.fetch(
+                        _SQL.COMPLETE_PROJECT_SUBTASKS, user_id, project_id
+                    )
+                else:
+                    rows = await conn.fetch(
+                        _SQL.COMPLETE_USER_SUBTASKS, user_id, subtask_ids
+                    )
+
+                completed = []
+                if complete_tasks and rows:
+                    completed = await conn.fetch(
+                        _SQL.COMPLETE_FINISHED_TASKS,
+                        sorted({row[1] for row in rows}),
+                    )
+
+            for _, deadline in completed:
+                self._invalidate_calendar(deadline)
+            logging.info(
+                f"User with id {user_id} completed {len(rows)} subtasks and {len(completed)} tasks"
+            )
+            return [row[0] for row in rows], [row[0] for row in completed]
+        except Exception as e:
+            logging.error(f"Error occurred while editing subtasks: {e}")
+            return None
+
+    async def add_shared_project(self, project_id: int, user_id: int) -> bool:
+        try:
+            async with self._write() as conn:
+                status = await conn.execute(
+                    _SQL.INSERT_PROJECT_MEMBER, project_id, user_id
+                )
+                if not _rowcount(status):
+                    logging.info(
+                        f"User with id {user_id} is already added to project with id {project_id}."
+                    )
+                    return False
+
+                await conn.execute(
+                    _SQL.ENQUEUE_SHARE_NOTIFICATION,
+                    f"share:{project_id}:{user_id}",
+                    time.time(),
+                    user_id,
+                    project_id,
+                )
+            self._invalidate_calendar(user_id=user_id)
+            logging.info(
+                f"Successfully added user with id {user_id} to project with id {project_id}."
+            )
+            return True
+        except Exception as e:
+            logging.error(f"Error occurred while adding user to project: {e}")
+            return False
+
+    async def fetch_shared_projects(self, user_id: int) -> list:
+        projects = []
+        try:
+            async with self._read() as conn:
+                owned_projects = await conn.fetch(_SQL.SELECT_PROJECTS, user_id)
+                shared_projects = await conn.fetch(_SQL.SELECT_MEMBER_PROJECTS, user_id)
+                projects = [Project(*row) for row in owned_projects + shared_projects]
+                logging.info(f"Fetched all projects for user with id {user_id}")
+        except Exception as e:
+            logging.error(f"Error occurred while fetching projects: {e}")
+        return projects
+
+    async def check_project_member(self, project_id: int, user_id: int) -> bool:
+        try:
+            async with self._read() as conn:
+                row = await conn.fetchrow(
+                    _SQL.SELECT_PROJECT_MEMBER, project_id, user_id
+                )
+                return row is not None
+        except Exception as e:
+            logging.error(f"Error occurred while checking project membership: {e}")
+            return False
+
+    async def fetch_calendar_token(self, user_id: int) -> Union[str, None]:
+        try:
+            async with self._write() as conn:
+                row = await conn.fetchrow(_SQL.SELECT_CALENDAR_TOKEN, user_id)
+                if row is None:
+                    logging.info(f"User with id {user_id} not found.")
+                    return None
+                if row[0]:
+                    return row[0]
+
+                token = secrets.token_urlsafe(24)
+                await conn.execute(_SQL.UPDATE_CALENDAR_TOKEN, token, user_id)
+            logging.info(f"Created calendar token for user with id {user_id}")
+            return token
+        except Exception as e:
+            logging.error(f"Error occurred while fetching calendar token: {e}")
+            return None
+
+    async def fetch_user_by_calendar_token(self, token: str) -> Union[int, None]:
+        try:
+            async with self._read() as conn:
+                return await conn.fetchval(_SQL.SELECT_USER_BY_CALENDAR_TOKEN, token)
+        except Exception as e:
+            logging.error(f"Error occurred while fetching user by calendar token: {e}")
+            return None
+
+    async def fetch_calendar_version(self, user_id: int) -> Union[tuple, None]:
+        try:
+            async with self._read() as conn:
+                version, updated_at = await conn.fetchrow(
+                    _SQL.SELECT_CALENDAR_VERSION, user_id
+                ) or (0, None)
+                return str(version), updated_at
+        except Exception as e:
+            logging.error(f"Error occurred while fetching calendar version: {e}")
+            return None
+
+    async def iter_calendar_tasks(self, user_id: int) -> AsyncIterator[Task]:
+        try:
+            async with self._read() as conn:
+                # Server-side cursors only live inside a transaction
+                async with conn.transaction(readonly=True):
+                    async for row in conn.cursor(_SQL.SELECT_CALENDAR_TASKS, user_id):
+                        yield Task(*row)
+            logging.info(f"Streamed calendar tasks for user with id {user_id}")
+        except Exception as e:
+            logging.error(f"Error occurred while streaming calendar tasks: {e}")
+
+    async def fetch_notification_settings(self, user_id: int) -> Union[dict, None]:
+        try:
+            async with self._read() as conn:
+                row = await conn.fetchrow(_SQL.SELECT_NOTIFICATION_SETTINGS, user_id)
+                if row is None:
+                    logging.info(f"User with id {user_id} not found.")
+                    return None
+                return {"notifications": bool(row[0]), "digest": bool(row[1])}
+        except Exception as e:
+            logging.error(f"Error occurred while fetching notification settings: {e}")
+            return None
+
+    async def set_notification_settings(
+        self,
+        user_id: int,
+        notifications: Union[bool, None] = None,
+        digest: Union[bool, None] = None,
+    ) -> bool:
+        try:
+            async with self._write() as conn:
+                await conn.execute(
+                    _SQL.UPDATE_NOTIFICATION_SETTINGS, notifications, digest, user_id
+                )
+            logging.info(
+                f"Updated notification settings of user with id {user_id}: notifications={notifications}, digest={digest}"
+            )
+            return True
+        except Exception as e:
+            logging.error(f"Error occurred while updating notification settings: {e}")
+            return False
+
+    async def fetch_digest_tasks(self, until_day: date) -> dict:
+        digests = {}
+        try:
+            async with self._read() as conn:
+                rows = await conn.fetch(
+                    _SQL.SELECT_DIGEST_TASKS, format_deadline(until_day)
+                )
+                for row in rows:
+                    digests.setdefault(row[0], []).append(Task(*row[1:]))
+                logging.info(f"Fetched digest tasks for {len(digests)} users")
+        except Exception as e:
+            logging.error(f"Error occurred while fetching digest tasks: {e}")
+        return digests
+
+    async def enqueue_notifications(self, notifications: list) -> bool:
+        try:
+            async with self._write() as conn:
+                await self._enqueue(conn, notifications)
+            logging.info(f"Enqueued {len(notifications)} notifications")
+            return True
+        except Exception as e:
+            logging.error(f"Error occurred while enqueueing notifications: {e}")
+            return False
+
+    async def _enqueue(self, conn, notifications: list) -> None:
+        # Duplicate idempotency keys are dropped, so replaying an event is harmless
+        if notifications:
+            await conn.executemany(_SQL.ENQUEUE_NOTIFICATION, notifications)
+
+    async def fetch_outbox_batch(self, limit: int) -> list:
+        batch = []
+        try:
+            async with self._read() as conn:
+                rows = await conn.fetch(_SQL.SELECT_OUTBOX_BATCH, time.time(), limit)
+                batch = [dict(row) for row in rows]
+        except Exception as e:
+            logging.error(f"Error occurred while fetching outbox batch: {e}")
+        return batch
+
+    async def mark_outbox_sent(self, outbox_id: int) -> bool:
+        try:
+            async with self._write() as conn:
+                await conn.execute(_SQL.MARK_OUTBOX_SENT, outbox_id)
+            return True
+        except Exception as e:
+            logging.error(f"Error occurred while marking outbox entry as sent: {e}")
+            return False
+
+    async def mark_outbox_retry(
+        self, outbox_id: int, not_before: Union[float, None], error: str
+    ) -> bool:
+        try:
+            async with self._write() as conn:
+                await conn.execute(_SQL.MARK_OUTBOX_RETRY, not_before, error, outbox_id)
+            return True
+        except Exception as e:
+            logging.error(f"Error occurred while rescheduling outbox entry: {e}")
+            return False
+
+    async def prune_outbox(self, older_than: float) -> int:
+        try:
+            async with self._write() as conn:
+                pruned = _rowcount(await conn.execute(_SQL.PRUNE_OUTBOX, older_than))
+            logging.info(f"Pruned {pruned} outbox entries")
+            return pruned
+        except Exception as e:
+            logging.error(f"Error occurred while pruning outbox: {e}")
+            return 0
+
+    async def fetch_watermark(self, name: str) -> Union[str, None]:
+        try:
+            async with self._read() as conn:
+                return await conn.fetchval(_SQL.SELECT_WATERMARK, name)
+        except Exception as e:
+            logging.error(f"Error occurred while fetching watermark {name}: {e}")
+            return None
+
+    async def set_watermark(self, name: str, value: str) -> bool:
+        try:
+            async with self._write() as conn:
+                await conn.execute(_SQL.UPSERT_WATERMARK, name, value)
+            logging.info(f"Moved watermark {name} to {value}")
+            return True
+        except Exception as e:
+            logging.error(f"Error occurred while setting watermark {name}: {e}")
+            return False
+
+    async def fetch_new_overdue_tasks(self, until: str) -> Union[dict, None]:
+        overdue = {}
+        try:
+            async with self._read() as conn:
+                rows = await conn.fetch(_SQL.SELECT_NEW_OVERDUE_TASKS, until)
+                for row in rows:
+                    overdue.setdefault(row[0], []).append(Task(*row[1:]))
+                logging.info(f"Fetched new overdue tasks for {len(overdue)} users")
+                return overdue
+        except Exception as e:
+            logging.error(f"Error occurred while fetching new overdue tasks: {e}")
+            return None
+
+    async def mark_overdue(self, until: str, task_ids: list, batch_size: int) -> int:
+        marked = 0
+        for start in range(0, len(task_ids), batch_size):
+            try:
+                async with self._write() as conn:
+                    marked += _rowcount(
+                        await conn.execute(
+                            _SQL.MARK_OVERDUE, task_ids[start : start + batch_size]
+                        )
+                    )
+            except Exception as e:
+                logging.error(f"Error occurred while marking tasks overdue: {e}")
+                return marked
+            await asyncio.sleep(0)
+
+        last = ("", 0)
+        while True:
+            try:
+                async with self._write() as conn:
+                    rows = await conn.fetch(
+                        _SQL.SELECT_QUIET_OVERDUE_BATCH, *last, until, batch_size
+                    )
+                    if not rows:
+                        break
+                    await conn.execute(_SQL.MARK_OVERDUE, [row[0] for row in rows])
+            except Exception as e:
+                logging.error(f"Error occurred while marking tasks overdue: {e}")
+                break
+
+            marked += len(rows)
+            last = (rows[-1][1], rows[-1][0])
+            if len(rows) < batch_size:
+                break
+            await asyncio.sleep(0)
+
+        logging.info(f"Marked {marked} tasks due before {until} as overdue")
+        return marked
+
+    async def fetch_changes(self, after_seq: int, limit: int) -> list:
+        try:
+            async with self._read() as conn:
+                rows = await conn.fetch(_SQL.SELECT_CHANGES, after_seq, limit)
+                return [Change(*row) for row in rows]
+        except Exception as e:
+            logging.error(f"Error occurred while fetching changes: {e}")
+            return []
+
+    async def fetch_last_change_seq(self) -> Union[int, None]:
+        try:
+            async with self._read() as conn:
+                return await conn.fetchval(_SQL.SELECT_LAST_CHANGE_SEQ)
+        except Exception as e:
+            logging.error(f"Error occurred while fetching last change seq: {e}")
+            return None
+
+    async def fetch_change_fanout(
+        self, after_seq: int, until_seq: int
+    ) -> Union[dict, None]:
+        fanout = {}
+        try:
+            async with self._read() as conn:
+                rows = await conn.fetch(_SQL.SELECT_CHANGE_FANOUT, after_seq, until_seq)
+                for row in rows:
+                    fanout.setdefault(row[0], []).append(
+                        {
+                            "project_id": row[1],
+                            "project": row[2],
+                            "actor": row[3],
+                            "entity": row[4],
+                            "entity_id": row[5],
+                            "op": row[6],
+                            "name": row[7],
+                            "status": row[8],
+                        }
+                    )
+                logging.info(f"Fanned out changes to {len(fanout)} users")
+                return fanout
+        except Exception as e:
+            logging.error(f"Error occurred while fanning out changes: {e}")
+            return None
+
+    async def prune_changes(self, older_than: float, batch_size: int) -> int:
+        pruned = 0
+        last = (0.0, 0)
+        while True:
+            try:
+                async with self._write() as conn:
+                    rows = await conn.fetch(
+                        _SQL.SELECT_PRUNABLE_CHANGES, older_than, *last, batch_size
+                    )
+                    if not rows:
+                        break
+                    await conn.execute(_SQL.DELETE_CHANGES, [row[0] for row in rows])
+            except Exception as e:
+                logging.error(f"Error occurred while pruning changes: {e}")
+                break
+
+            pruned += len(rows)
+            last = (rows[-1][1], rows[-1][0])
+            if len(rows) < batch_size:
+                break
+            await asyncio.sleep(0)
+
+        logging.info(f"Pruned {pruned} changes")
+        return pruned
+
+    async def archive_tasks(self, older_than_days: int, batch_size: int) -> int:
+        archived = 0
+        while True:
+            try:
+                async with self._write() as conn:
+                    rows = await conn.fetch(
+                        _SQL.SELECT_ARCHIVABLE_TASKS, older_than_days, batch_size
+                    )
+                    task_ids = [row[0] for row in rows]
+                    if not task_ids:
+                        break
+                    for statement in _SQL.ARCHIVE_BATCH:
+                        await conn.execute(statement, task_ids)
+            except Exception as e:
+                logging.error(f"Error occurred while archiving tasks: {e}")
+                break
+
+            archived += len(task_ids)
+            if len(task_ids) < batch_size:
+                break
+            await asyncio.sleep(0)
+
+        logging.info(
+            f"Archived {archived} tasks completed over {older_than_days} days ago"
+        )
+        return archived
+
+    async def fetch_archived_tasks(
+        self, user_id: int, limit: int, offset: int = 0
+    ) -> list:
+        tasks = []
+        try:
+            async with self._read() as conn:
+                rows = await conn.fetch(
+                    _SQL.SELECT_ARCHIVED_TASKS, user_id, limit, offset
+                )
+                tasks = [Task(*row) for row in rows]
+                logging.info(f"Fetched archived tasks for user with id {user_id}")
+        except Exception as e:
+            logging.error(f"Error occurred while fetching archived tasks: {e}")
+        return tasks
+
+    async def _fetch_deadline_rows(
+        self, user_id: int, first_day: date, last_day: date
+    ) -> Union[list, None]:
+        try:
+            async with self._read() as conn:
+                rows = await conn.fetch(
+                    _SQL.SELECT_DEADLINE_COUNTS,
+                    user_id,
+                    format_deadline(first_day),
+                    format_deadline(last_day),
+                )
+                logging.info(
+                    f"Fetched deadline counts for user with id {user_id} for {first_day:%Y-%m}"
+                )
+                return rows
+        except Exception as e:
+            logging.error(f"Error occurred while fetching deadline counts: {e}")
+            return None
+
+    async def fetch_tasks_by_day(self, user_id: int, day: date) -> list:
+        tasks = []
+        try:
+            async with self._read() as conn:
+                rows = await conn.fetch(
+                    _SQL.SELECT_TASKS_BY_DAY, user_id, format_deadline(day)
+                )
+                tasks = self._due_on([Task(*row) for row in rows], day)
+                logging.info(f"Fetched tasks for user with id {user_id} due {day}")
+        except Exception as e:
+            logging.error(f"Error occurred while fetching tasks by day: {e}")
+        return tasks
+
+    async def fetch_next_tasks(self, user_id: int, limit: int) -> list:
+        tasks = []
+        try:
+            async with self._read() as conn:
+                rows = await conn.fetch(_SQL.SELECT_NEXT_TASKS, user_id, limit)
+                tasks = [Task(*row) for row in rows]
+                logging.info(
+                    f"Fetched {len(tasks)} next tasks for user with id {user_id}"
+                )
+        except Exception as e:
+            logging.error(f"Error occurred while fetching next tasks: {e}")
+        return tasks
+
+    async def close(self) -> None:
+        if self._pool is None:
+            return
+        await self._pool.close()
+        self._pool = None
+        logging.info("Closed PostgreSQL pool")
@@ -0,0 +1,152 @@
+import calendar
+from datetime import date, datetime, timedelta
+from typing import Iterator, Optional, Union
+
+# Deadlines are stored as ISO dates so they sort and range-scan by index,
+# users type and read them as DD.MM.YYYY.
+DEADLINE_FORMAT = "%Y-%m-%d"
+DISPLAY_FORMAT = "%d.%m.%Y"
+
+WEEKDAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+RRULE_WEEKDAYS = ["MO", "TU", "WE", "TH", "FR", "SA", "SU"]
+
+
+def parse_deadline(value: str) -> date:
+    return datetime.strptime(value, DEADLINE_FORMAT).date()
+
+
+def format_deadline(value: date) -> str:
+    return value.strftime(DEADLINE_FORMAT)
+
+
+def parse_display_date(value: str) -> date:
+    return datetime.strptime(value.strip(), DISPLAY_FORMAT).date()
+
+
+def display_deadline(value: Union[str, date, None]) -> str:
+    if isinstance(value, date):
+        return value.strftime(DISPLAY_FORMAT)
+    try:
+        return parse_deadline(value).strftime(DISPLAY_FORMAT)
+    except (TypeError, ValueError):
+        return str(value)
+
+
+class Recurrence:
+    # Rules: daily, weekly, weekly:mon,thu, monthly, every:3 (days), every:2w (weeks).
+    # The task deadline anchors the series, occurrences are expanded lazily and never stored.
+
+    def __init__(self, kind: str, interval: int = 1, weekdays: tuple = ()):
+        self.kind = kind
+        self.interval = interval
+        self.weekdays = tuple(sorted(set(weekdays)))
+
+    @classmethod
+    def parse(cls, rule: str) -> "Recurrence":
+        rule = rule.strip().lower()
+        kind, _, args = rule.partition(":")
+
+        if kind == "daily" and not args:
+            return cls("daily")
+        if kind == "monthly" and not args:
+            return cls("monthly")
+        if kind == "weekly":
+            if not args:
+                return cls("weekly")
+            try:
+                weekdays = [WEEKDAYS.index(day.strip()[:3]) for day in args.split(",")]
+            except ValueError:
+                raise ValueError(f"Invalid weekdays in rule: {rule}")
+            return cls("weekly", weekdays=weekdays)
+        if kind == "every" and args:
+            days = 7 if args.endswith("w") else 1
+            try:
+                interval = int(args.rstrip("dw"))
+            except ValueError:
+                raise ValueError(f"Invalid interval in rule: {rule}")
+            if interval < 1:
+                raise ValueError(f"Interval must be positive: {rule}")
+            return cls("every", interval=interval * days)
+
+        raise ValueError(f"Unknown recurrence rule: {rule}")
+
+    def __str__(self) -> str:
+        if self.kind == "weekly" and self.weekdays:
+            return "weekly:" + ",".join(WEEKDAYS[day] for day in self.weekdays)
+        if self.kind == "every":
+            return f"every:{self.interval}"
+        return self.kind
+
+    def to_rrule(self) -> str:
+        if self.kind == "daily":
+            return "FREQ=DAILY"
+        if self.kind == "every":
+            return f"FREQ=DAILY;INTERVAL={self.interval}"
+        if self.kind == "monthly":
+            return "FREQ=MONTHLY"
+        if self.weekdays:
+            days = ",".join(RRULE_WEEKDAYS[day] for day in self.weekdays)
+            return f"FREQ=WEEKLY;BYDAY={days}"
+        return "FREQ=WEEKLY"
+
+    def _iter_from(self, anchor: date) -> Iterator[date]:
+        if self.kind == "daily":
+            step = timedelta(days=1)
+        elif self.kind == "every":
+            step = timedelta(days=self.interval)
+        elif self.kind == "weekly" and not self.weekdays:
+            step = timedelta(weeks=1)
+        else:
+            step = None
+
+        if step is not None:
+            current = anchor
+            while True:
+                yield current
+                current += step
+
+        elif self.kind == "weekly":
+            week_start = anchor - timedelta(days=anchor.weekday())
+            while True:
+                for day in self.weekdays:
+                    current = week_start + timedelta(days=day)
+                    if current >= anchor:
+                        yield current
+                week_start += timedelta(weeks=1)
+
+        elif self.kind == "monthly":
+            year, month = anchor.year, anchor.month
+            while True:
+                last_day = calendar.monthrange(year, month)[1]
+                yield date(year, month, min(anchor.day, last_day))
+                month += 1
+                if month > 12:
+                    year, month = year + 1, 1
+
+    def occurrences(self, anchor: date, start: date, end: date) -> Iterator[date]:
+        for current in self._iter_from(anchor):
+            if current > end:
+                return
+            if current >= start:
+                yield current
+
+    def next_after(self, anchor: date, after: date) -> date:
+        for current in self._iter_from(anchor):
+            if current > after:
+                return current
+
+
+def iter_occurrences(
+    deadline: Optional[str], rule: Optional[str], start: date, end: date
+) -> Iterator[date]:
+    try:
+        anchor = parse_deadline(deadline)
+    except (TypeError, ValueError):
+        return
+
+    if not rule:
+        if start <= anchor <= end:
+            yield anchor
+        return
+
+    yield from Recurrence.parse(rule).occurrences(anchor, start, end)
@@ -0,0 +1,236 @@
+"""
+Splits an unsharded SQLite database into the catalog and shard files that
+ShardedDatabase (shards.py) opens when DATABASE_SHARDS is more than one.
+
+Stop the bot first. The source file and its archive are brought up to the
+current schema, as the bot does on start, and then only read; they stay in
+place. Projects go to the shard of their owner with their tasks, subtasks,
+memberships and archived tasks. Every project, task and subtask id becomes
+(id + offset) * shards + shard, so ids route to their shard from then on. The
+offset is the highest id the source ever handed out, which puts every new id
+above all the old ones: ids shown to users before the split, in messages,
+lists and buttons, match no row instead of somebody else's. The tool warns
+about it, tell users to open their projects again. Rows of projects deleted
+earlier are left out.
+
+The change log isn't copied, every shard starts a log of its own and the
+change notifications start from the first change after the split.
+
+Run from the repository root:
+python -m modules.libraries.reshard database/prodigy_bot.db --shards 4
+"""
+
+from modules.libraries.changes import WATERMARK
+from modules.libraries.dbms import Database
+from modules.libraries.shards import ShardedDatabase, owner_shard
+from pathlib import Path
+import argparse, asyncio, os, sqlite3, sys
+
+# Tasks before their projects: the triggers that bump a project's version on
+# every task change find no project yet and leave versions as they were
+SHARD_STATEMENTS = (
+    """
+    INSERT INTO main.users (id, user_id, user_name, created_at, notifications, digest)
+    SELECT id, user_id, user_name, created_at, notifications, digest FROM src.users
+    """,
+    """
+    INSERT INTO main.tasks (id, project_id, name, description, deadline, priority, status, recurrence, created_at, completed_at, overdue)
+    SELECT (t.id + :offset) * :shards + :shard, (t.project_id + :offset) * :shards + :shard, t.name, t.description, t.deadline,
+        t.priority, t.status, t.recurrence, t.created_at, t.completed_at, t.overdue
+    FROM src.tasks t
+    JOIN src.projects p ON p.id = t.project_id
+    WHERE owner_shard(p.user_id) = :shard
+    """,
+    """
+    INSERT INTO main.subtasks (id, task_id, name, status, created_at)
+    SELECT (s.id + :offset) * :shards + :shard, (s.task_id + :offset) * :shards + :shard, s.name, s.status, s.created_at
+    FROM src.subtasks s
+    JOIN src.tasks t ON t.id = s.task_id
+    JOIN src.projects p ON p.id = t.project_id
+    WHERE owner_shard(p.user_id) = :shard
+    """,
+    """
+    INSERT INTO main.projects (id, user_id, name, description, created_at, updated_at, version)
+    SELECT (id + :offset) * :shards + :shard, user_id, name, description, created_at, updated_at, version
+    FROM src.projects
+    WHERE owner_shard(user_id) = :shard
+    """,
+    """
+    INSERT INTO main.shared_projects (project_id, user_id)
+    SELECT (sp.project_id + :offset) * :shards + :shard, sp.user_id
+    FROM src.shared_projects sp
+    JOIN src.projects p ON p.id = sp.project_id
+    WHERE owner_shard(p.user_id) = :shard
+    """,
+)
+ARCHIVE_STATEMENTS = (
+    """
+    INSERT INTO archive.tasks (id, project_id, name, description, deadline, priority, status, recurrence, created_at, completed_at, archived_at)
+    SELECT (t.id + :offset) * :shards + :shard, (t.project_id + :offset) * :shards + :shard, t.name, t.description, t.deadline,
+        t.priority, t.status, t.recurrence, t.created_at, t.completed_at, t.archived_at
+    FROM src_archive.tasks t
+    JOIN src.projects p ON p.id = t.project_id
+    WHERE owner_shard(p.user_id) = :shard
+    """,
+    """
+    INSERT INTO archive.subtasks (id, task_id, name, status, created_at)
+    SELECT (s.id + :offset) * :shards + :shard, (s.task_id + :offset) * :shards + :shard, s.name, s.status, s.created_at
+    FROM src_archive.subtasks s
+    JOIN src_archive.tasks t ON t.id = s.task_id
+    JOIN src.projects p ON p.id = t.project_id
+    WHERE owner_shard(p.user_id) = :shard
+    """,
+)
+# Watermarks of the change log count seqs of the unsharded log. Calendar
+# versions carry on in the catalog, one up: the feeds' task ids changed.
+CATALOG_STATEMENTS = (
+    """
+    INSERT INTO main.calendar_versions (user_id, version, updated_at)
+    SELECT u.user_id, COALESCE(v.version, 0) + 1, CURRENT_TIMESTAMP
+    FROM src.users u
+    LEFT JOIN src.calendar_versions v ON v.user_id = u.user_id
+    """,
+    """
+    INSERT INTO main.users (id, user_id, user_name, created_at, notifications, digest, calendar_token)
+    SELECT id, user_id, user_name, created_at, notifications, digest, calendar_token FROM src.users
+    """,
+    """
+    INSERT INTO main.shared_projects (project_id, user_id)
+    SELECT (sp.project_id + :offset) * :shards + owner_shard(p.user_id), sp.user_id
+    FROM src.shared_projects sp
+    JOIN src.projects p ON p.id = sp.project_id
+    """,
+    """
+    INSERT INTO main.outbox (id, idempotency_key, chat_id, text, status, attempts, not_before, last_error, created_at, sent_at)
+    SELECT id, idempotency_key, chat_id, text, status, attempts, not_before, last_error, created_at, sent_at
+    FROM src.outbox
+    """,
+    f"""
+    INSERT INTO main.watermarks (name, value)
+    SELECT name, value FROM src.watermarks WHERE name NOT LIKE '{WATERMARK}%'
+    """,
+)
+# Ids of deleted rows too, they may still be in chat history. Archived rows
+# keep the ids the main file handed out.
+OFFSET = """
+    SELECT MAX(id) FROM (
+        SELECT MAX(seq) AS id FROM src.sqlite_sequence
+        WHERE name IN ('projects', 'tasks', 'subtasks')
+        UNION ALL SELECT MAX(id) FROM src.projects
+        UNION ALL SELECT MAX(id) FROM src.tasks
+        UNION ALL SELECT MAX(id) FROM src.subtasks
+        UNION ALL SELECT MAX(id) FROM src_archive.tasks
+        UNION ALL SELECT MAX(id) FROM src_archive.subtasks
+    )
+    """
+COUNTS = {
+    "projects": "SELECT COUNT(*) FROM {schema}.projects",
+    "tasks": "SELECT COUNT(*) FROM {schema}.tasks",
+    "subtasks": "SELECT COUNT(*) FROM {schema}.subtasks",
+    "archived tasks": "SELECT COUNT(*) FROM {archive}.tasks",
+}
+
+
+async def prepare(source: str, sharded: ShardedDatabase) -> None:
+    # The source gets the current schema, the new files their tables and
+    # their shard numbers
+    for db in (Database(source), *sharded.databases):
+        await db.create_tables()
+        await db.close()
+
+
+def connect(db: Database, source: Database, shards: int) -> sqlite3.Connection:
+    conn = sqlite3.connect(db.db_path)
+    conn.execute("ATTACH DATABASE ? AS archive", (db.archive_path,))
+    conn.execute(
+        "ATTACH DATABASE ? AS src",
+        (f"{Path(source.db_path).resolve().as_uri()}?mode=ro",),
+    )
+    conn.execute(
+        "ATTACH DATABASE ? AS src_archive",
+        (f"{Path(source.archive_path).resolve().as_uri()}?mode=ro",),
+    )
+    conn.create_function(
+        "owner_shard",
+        1,
+        lambda user_id: owner_shard(user_id, shards),
+        deterministic=True,
+    )
+    return conn
+
+
+def count(conn: sqlite3.Connection, schema: str, archive: str) -> dict:
+    return {
+        name: conn.execute(query.format(schema=schema, archive=archive)).fetchone()[0]
+        for name, query in COUNTS.items()
+    }
+
+
+def reshard(source_path: str, shards: int) -> bool:
+    if not os.path.exists(source_path):
+        print(f"No database at {source_path}")
+        return False
+    sharded = ShardedDatabase(source_path, shards)
+    existing = [db.db_path for db in sharded.databases if os.path.exists(db.db_path)]
+    if existing:
+        print(f"Already there, remove them first: {', '.join(existing)}")
+        return False
+
+    asyncio.run(prepare(source_path, sharded))
+    source = Database(source_path)
+
+    conn = connect(sharded.catalog, source, shards)
+    offset = conn.execute(OFFSET).fetchone()[0] or 0
+    params = {"shards": shards, "offset": offset}
+    with conn:
+        for statement in CATALOG_STATEMENTS:
+            conn.execute(statement, params)
+    before = count(conn, "src", "src_archive")
+    conn.close()
+
+    copied = dict.fromkeys(COUNTS, 0)
+    for index, shard in enumerate(sharded.shards):
+        conn = connect(shard, source, shards)
+        params = {"shards": shards, "shard": index, "offset": offset}
+        with conn:
+            for statement in SHARD_STATEMENTS + ARCHIVE_STATEMENTS:
+                conn.execute(statement, params)
+        counts = count(conn, "main", "archive")
+        conn.close()
+        print(
+            f"{shard.db_path}: "
+            + ", ".join(f"{number} {name}" for name, number in counts.items())
+        )
+        for name, number in counts.items():
+            copied[name] += number
+
+    left_out = {name: before[name] - copied[name] for name in COUNTS}
+    left_out = {name: number for name, number in left_out.items() if number}
+    if left_out:
+        print(
+            "Left out of deleted projects: "
+            + ", ".join(f"{number} {name}" for name, number in left_out.items())
+        )
+    print(
+        f"Warning: project, task and subtask ids are now (id + {offset}) * {shards} + shard. "
+        "Ids in messages and buttons sent before the split match nothing any more, "
+        "acting on them fails. Tell users to open /projects again for the new ids."
+    )
+    print(
+        f"Catalog: {sharded.catalog.db_path}. Start the bot with DATABASE_SHARDS={shards}"
+    )
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("source", help="the unsharded SQLite database")
+    parser.add_argument("--shards", type=int, required=True)
+    args = parser.parse_args()
+    if args.shards < 2:
+        parser.error("--shards must be at least 2")
+    sys.exit(0 if reshard(args.source, args.shards) else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,37 @@
+import re
+from typing import Tuple, Union
+
+PROJECT_SELECTION = re.compile(
+    r"^(?:all in project|все в проекте)\s+(\d+)$", re.IGNORECASE
+)
+
+
+def parse_selection(
+    text: str, limit: int
+) -> Tuple[Union[list, None], Union[int, None]]:
+    # "1,4,7-12" -> ([1, 4, 7, 8, 9, 10, 11, 12], None)
+    # "all in project 3" / "все в проекте 3" -> (None, 3)
+    text = text.strip()
+    match = PROJECT_SELECTION.match(text)
+    if match:
+        return None, int(match.group(1))
+
+    ids = set()
+    for part in re.split(r"[,\s]+", text):
+        if not part:
+            continue
+        first, dash, last = part.partition("-")
+        try:
+            first = int(first)
+            last = int(last) if dash else first
+        except ValueError:
+            raise ValueError(f"Invalid id or range: {part}")
+        if first < 1 or last < first:
+            raise ValueError(f"Invalid id or range: {part}")
+        if last - first + 1 + len(ids) > limit:
+            raise ValueError(f"Selection is larger than {limit} ids")
+        ids.update(range(first, last + 1))
+
+    if not ids:
+        raise ValueError("Empty selection")
+    return sorted(ids), None
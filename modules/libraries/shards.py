@@ -0,0 +1,557 @@
+from datetime import date
+from modules.libraries.dbms import Database, READER_POOL_SIZE
+from modules.libraries.models import Project, Subtask, Task, User
+from modules.libraries.storage import Storage
+from pathlib import Path
+from typing import AsyncIterator, Union
+import asyncio, heapq, logging, os, time, zlib
+
+
+class _SQL:
+    # Statements on the catalog, the shards run Database's own
+    SELECT_MEMBER_PROJECT_IDS = (
+        "SELECT project_id FROM shared_projects WHERE user_id = ?"
+    )
+    INSERT_PROJECT_MEMBER = (
+        "INSERT OR IGNORE INTO shared_projects (project_id, user_id) VALUES (?,?)"
+    )
+    # The catalog has no projects, the name comes from the project's shard
+    ENQUEUE_SHARE_NOTIFICATION = """
+        INSERT OR IGNORE INTO outbox (idempotency_key, chat_id, text, not_before)
+        SELECT ?, user_id, 'Вам открыли доступ к проекту «' || ? || '». Проверьте командой /projects.', ?
+        FROM users
+        WHERE user_id = ? AND notifications
+        """
+
+
+def shard_paths(db: str, shards: int) -> tuple:
+    # database/prodigy_bot.db -> (database/prodigy_bot_catalog.db,
+    # [database/prodigy_bot_shard0.db, ...]), each shard with its own archive
+    path = Path(db)
+    catalog = path.with_name(f"{path.stem}_catalog{path.suffix}")
+    return str(catalog), [
+        str(path.with_name(f"{path.stem}_shard{index}{path.suffix}"))
+        for index in range(shards)
+    ]
+
+
+def owner_shard(user_id: int, shards: int) -> int:
+    # Stable across processes and Python versions, unlike hash()
+    return zlib.crc32(str(user_id).encode()) % shards
+
+
+class ShardedDatabase(Storage):
+    # Splits the SQLite database into shard files, each with a writer of its
+    # own. A project, its tasks and subtasks live on the shard picked by its
+    # owner's user_id, and every id a shard hands out is congruent to the
+    # shard's index modulo the shard count, so any id routes without a lookup.
+    #
+    # The catalog file holds what is global: users, project memberships, the
+    # outbox and watermarks. Users are also copied to every shard and
+    # memberships to the project's shard, so each shard answers the digest,
+    # overdue and change queries on its own. The catalog is written last and
+    # is what user-scoped reads go by.
+    def __init__(self, db: str, shards: int, readers: int = READER_POOL_SIZE):
+        super().__init__()
+        self.db_path = db
+        catalog, paths = shard_paths(db, shards)
+        self.catalog = Database(catalog, readers=readers)
+        self.shards = [
+            Database(path, readers=readers, shard=index, shards=shards)
+            for index, path in enumerate(paths)
+        ]
+        self.databases = [self.catalog, *self.shards]
+
+    def _owner(self, user_id: int) -> Database:
+        return self.shards[owner_shard(user_id, len(self.shards))]
+
+    def _holder(self, row_id: int) -> Database:
+        return self.shards[row_id % len(self.shards)]
+
+    async def _user_shards(self, user_id: int) -> list:
+        # The owner's shard first, then those of the projects shared with them
+        indexes = {owner_shard(user_id, len(self.shards)): None}
+        try:
+            async with self.catalog._read() as db:
+                async with db.cursor() as cursor:
+                    await cursor.execute(_SQL.SELECT_MEMBER_PROJECT_IDS, (user_id,))
+                    for row in await cursor.fetchall():
+                        indexes.setdefault(row[0] % len(self.shards))
+        except Exception as e:
+            logging.error(f"Error occurred while fetching shards of user: {e}")
+        return [self.shards[index] for index in indexes]
+
+    async def _replicate(self, method: str, *args) -> bool:
+        # Catalog first, it is the copy reads go by. A shard that missed the
+        # write is caught up by the caller's retry, all these writes repeat.
+        if not await getattr(self.catalog, method)(*args):
+            return False
+        results = await asyncio.gather(
+            *(getattr(shard, method)(*args) for shard in self.shards)
+        )
+        return all(results)
+
+    async def connect(self) -> None:
+        await asyncio.gather(*(db.connect() for db in self.databases))
+
+    def stats(self) -> dict:
+        stats = {"shards": len(self.shards)}
+        for db in self.databases:
+            for key, value in db.stats().items():
+                stats[key] = stats.get(key, 0) + value
+        return stats
+
+    def change_logs(self) -> list:
+        # The catalog only logs user changes, nobody is notified of those
+        return list(self.shards)
+
+    async def create_tables(self):
+        # Shards started on an empty catalog would hide the data of the
+        # unsharded file; it is split with python -m modules.libraries.reshard
+        if not os.path.exists(self.catalog.db_path) and os.path.exists(self.db_path):
+            raise ValueError(
+                f"{self.db_path} holds an unsharded database, split it into "
+                f"{len(self.shards)} shards with python -m modules.libraries.reshard"
+            )
+        await asyncio.gather(*(db.create_tables() for db in self.databases))
+
+    async def close(self) -> None:
+        await asyncio.gather(*(db.close() for db in self.databases))
+
+    # Users, on the catalog and every shard
+
+    async def add_user(self, user_id: int, user_name: str) -> bool:
+        return await self._replicate("add_user", user_id, user_name)
+
+    async def fetch_user(self, user_id: int) -> Union[User, None]:
+        return await self.catalog.fetch_user(user_id)
+
+    async def fetch_user_ids(self) -> list:
+        return await self.catalog.fetch_user_ids()
+
+    async def fetch_user_by_name(self, user_name: str) -> Union[User, None]:
+        return await self.catalog.fetch_user_by_name(user_name)
+
+    async def update_user_names(self, user_names: list) -> bool:
+        return await self._replicate("update_user_names", user_names)
+
+    async def fetch_calendar_token(self, user_id: int) -> Union[str, None]:
+        return await self.catalog.fetch_calendar_token(user_id)
+
+    async def fetch_user_by_calendar_token(self, token: str) -> Union[int, None]:
+        return await self.catalog.fetch_user_by_calendar_token(token)
+
+    async def fetch_notification_settings(self, user_id: int) -> Union[dict, None]:
+        return await self.catalog.fetch_notification_settings(user_id)
+
+    async def set_notification_settings(
+        self,
+        user_id: int,
+        notifications: Union[bool, None] = None,
+        digest: Union[bool, None] = None,
+    ) -> bool:
+        return await self._replicate(
+            "set_notification_settings", user_id, notifications, digest
+        )
+
+    # Projects, tasks and subtasks, on one shard each
+
+    async def new_project(self, user_id: int, name: str, desc: str) -> bool:
+        return await self._owner(user_id).new_project(user_id, name, desc)
+
+    async def edit_project(
+        self, user_id: int, old_name: str, new_name: str, new_desc: str
+    ) -> bool:
+        return await self._owner(user_id).edit_project(
+            user_id, old_name, new_name, new_desc
+        )
+
+    async def delete_project(self, project_id: int) -> bool:
+        return await self._holder(project_id).delete_project(project_id)
+
+    async def fetch_projects(self, user_id: int) -> list:
+        return await self._owner(user_id).fetch_projects(user_id)
+
+    async def fetch_project(self, project_id: int) -> Union[Project, None]:
+        return await self._holder(project_id).fetch_project(project_id)
+
+    async def new_task(
+        self,
+        user_id: int,
+        project_id: int,
+        task_name: str,
+        task_description: str,
+        task_deadline: str,
+        priority: int,
+    ) -> bool:
+        return await self._holder(project_id).new_task(
+            user_id, project_id, task_name, task_description, task_deadline, priority
+        )
+
+    async def fetch_tasks(self, project_id: int) -> list:
+        return await self._holder(project_id).fetch_tasks(project_id)
+
+    async def fetch_task(self, task_id: int) -> Union[Task, None]:
+        return await self._holder(task_id).fetch_task(task_id)
+
+    async def user_has_tasks(self, user_id: int) -> bool:
+        return await self._owner(user_id).user_has_tasks(user_id)
+
+    async def edit_task(self, task_id: int, progress: int) -> bool:
+        return await self._holder(task_id).edit_task(task_id, progress)
+
+    async def edit_tasks(
+        self,
+        user_id: int,
+        progress: int,
+        task_ids: Union[list, None] = None,
+        project_id: Union[int, None] = None,
+    ) -> Union[list, None]:
+        if project_id is not None:
+            return await self._holder(project_id).edit_tasks(
+                user_id, progress, project_id=project_id
+            )
+        results = await asyncio.gather(
+            *(
+                shard.edit_tasks(user_id, progress, ids)
+                for shard, ids in self._group(task_ids).items()
+            )
+        )
+        if any(result is None for result in results):
+            return None
+        return [task_id for result in results for task_id in result]
+
+    async def set_task_recurrence(self, task_id: int, rule: Union[str, None]) -> bool:
+        return await self._holder(task_id).set_task_recurrence(task_id, rule)
+
+    async def remove_task(self, task_id: int) -> bool:
+        return await self._holder(task_id).remove_task(task_id)
+
+    async def add_subtask(self, task_id: int, name: str) -> bool:
+        return await self._holder(task_id).add_subtask(task_id, name)
+
+    async def add_subtasks(self, task_id: int, names: list) -> bool:
+        return await self._holder(task_id).add_subtasks(task_id, names)
+
+    async def fetch_subtasks(self, project_id: int) -> list:
+        return await self._holder(project_id).fetch_subtasks(project_id)
+
+    async def fetch_subtask(self, subtask_id: int) -> Union[Subtask, None]:
+        return await self._holder(subtask_id).fetch_subtask(subtask_id)
+
+    async def user_has_subtasks(self, user_id: int) -> bool:
+        return await self._owner(user_id).user_has_subtasks(user_id)
+
+    async def edit_subtask(self, subtask_id: int) -> bool:
+        return await self._holder(subtask_id).edit_subtask(subtask_id)
+
+    async def delete_subtask(self, subtask_id: int) -> bool:
+        return await self._holder(subtask_id).delete_subtask(subtask_id)
+
+    async def edit_subtasks(
+        self,
+        user_id: int,
+        subtask_ids: Union[list, None] = None,
+        project_id: Union[int, None] = None,
+        complete_tasks: bool = False,
+    ) -> Union[tuple, None]:
+        if project_id is not None:
+            return await self._holder(project_id).edit_subtasks(
+                user_id, project_id=project_id, complete_tasks=complete_tasks
+            )
+        results = await asyncio.gather(
+            *(
+                shard.edit_subtasks(user_id, ids, complete_tasks=complete_tasks)
+                for shard, ids in self._group(subtask_ids).items()
+            )
+        )
+        if any(result is None for result in results):
+            return None
+        return (
+            [subtask_id for subtasks, _ in results for subtask_id in subtasks],
+            [task_id for _, tasks in results for task_id in tasks],
+        )
+
+    def _group(self, ids: list) -> dict:
+        # shard -> the ids it holds
+        groups = {}
+        for row_id in ids:
+            groups.setdefault(self._holder(row_id), []).append(row_id)
+        return groups
+
+    # Shared projects: the membership goes to the project's shard for its
+    # queries and to the catalog, which says on which shards a user has any
+
+    async def add_shared_project(self, project_id: int, user_id: int) -> bool:
+        if await self.catalog.check_project_member(project_id, user_id):
+            logging.info(
+                f"User with id {user_id} is already added to project with id {project_id}."
+            )
+            return False
+        shard = self._holder(project_id)
+        project = await shard.fetch_project(project_id)
+        if project is None:
+            logging.info(f"Project with id {project_id} not found.")
+            return False
+        try:
+            # A failure between the two writes leaves the user out of the
+            # project's lists until they are added again, which completes it
+            async with shard._write() as db:
+                await db.execute(_SQL.INSERT_PROJECT_MEMBER, (project_id, user_id))
+                await db.commit()
+            shard._invalidate_calendar(user_id=user_id)
+            async with self.catalog._write() as db:
+                async with db.cursor() as cursor:
+                    await cursor.execute(
+                        _SQL.INSERT_PROJECT_MEMBER, (project_id, user_id)
+                    )
+                    await cursor.execute(
+                        _SQL.ENQUEUE_SHARE_NOTIFICATION,
+                        (
+                            f"share:{project_id}:{user_id}",
+                            project.name,
+                            time.time(),
+                            user_id,
+                        ),
+                    )
+                    await db.commit()
+            logging.info(
+                f"Successfully added user with id {user_id} to project with id {project_id}."
+            )
+            return True
+        except Exception as e:
+            logging.error(f"Error occurred while adding user to project: {e}")
+            return False
+
+    async def check_project_member(self, project_id: int, user_id: int) -> bool:
+        return await self.catalog.check_project_member(project_id, user_id)
+
+    # A user's reads run on the shards of their projects concurrently and are
+    # merged in the order a single database returns them
+
+    async def fetch_shared_projects(self, user_id: int) -> list:
+        results = await asyncio.gather(
+            *(
+                shard.fetch_shared_projects(user_id)
+                for shard in await self._user_shards(user_id)
+            )
+        )
+        return [project for projects in results for project in projects]
+
+    async def fetch_calendar_version(self, user_id: int) -> Union[tuple, None]:
+        # Every file, not just the user's shards: a shard drops out of those
+        # with the user's last project on it and the sum would go down
+        results = await asyncio.gather(
+            *(db.fetch_calendar_version(user_id) for db in self.databases)
+        )
+        if any(result is None for result in results):
+            return None
+        version = 0
+        last_modified = None
+        for etag, modified in results:
+            version += int(etag)
+            if modified and (last_modified is None or modified > last_modified):
+                last_modified = modified
+        return str(version), last_modified
+
+    async def iter_calendar_tasks(self, user_id: int) -> AsyncIterator[Task]:
+        # A k-way merge by deadline, streaming like a single database does
+        iterators = [
+            shard.iter_calendar_tasks(user_id)
+            for shard in await self._user_shards(user_id)
+        ]
+        try:
+            heads = await asyncio.gather(*(_next(iterator) for iterator in iterators))
+            heap = [
+                (task.deadline, index, task)
+                for index, task in enumerate(heads)
+                if task is not None
+            ]
+            heapq.heapify(heap)
+            while heap:
+                _, index, task = heap[0]
+                yield task
+                task = await _next(iterators[index])
+                if task is None:
+                    heapq.heappop(heap)
+                else:
+                    heapq.heapreplace(heap, (task.deadline, index, task))
+        finally:
+            for iterator in iterators:
+                await iterator.aclose()
+
+    async def fetch_deadline_counts(
+        self, user_id: int, first_day: date, last_day: date
+    ) -> dict:
+        # Every shard caches its own counts and invalidates them on its writes
+        counts = {}
+        for shard_counts in await asyncio.gather(
+            *(
+                shard.fetch_deadline_counts(user_id, first_day, last_day)
+                for shard in await self._user_shards(user_id)
+            )
+        ):
+            for day, count in shard_counts.items():
+                counts[day] = counts.get(day, 0) + count
+        return counts
+
+    async def _fetch_deadline_rows(
+        self, user_id: int, first_day: date, last_day: date
+    ) -> Union[list, None]:
+        results = await asyncio.gather(
+            *(
+                shard._fetch_deadline_rows(user_id, first_day, last_day)
+                for shard in await self._user_shards(user_id)
+            )
+        )
+        if any(result is None for result in results):
+            return None
+        return [row for rows in results for row in rows]
+
+    async def fetch_tasks_by_day(self, user_id: int, day: date) -> list:
+        results = await asyncio.gather(
+            *(
+                shard.fetch_tasks_by_day(user_id, day)
+                for shard in await self._user_shards(user_id)
+            )
+        )
+        return sorted(
+            (task for tasks in results for task in tasks),
+            key=lambda task: task.priority,
+        )
+
+    async def fetch_next_tasks(self, user_id: int, limit: int) -> list:
+        # Each shard's top limit, so the merged top limit is among them
+        results = await asyncio.gather(
+            *(
+                shard.fetch_next_tasks(user_id, limit)
+                for shard in await self._user_shards(user_id)
+            )
+        )
+        return heapq.nsmallest(
+            limit,
+            (task for tasks in results for task in tasks),
+            key=lambda task: (task.priority, task.deadline or "", task.id),
+        )
+
+    async def fetch_archived_tasks(
+        self, user_id: int, limit: int, offset: int = 0
+    ) -> list:
+        # A page further down needs the rows of all shards before it
+        results = await asyncio.gather(
+            *(
+                shard.fetch_archived_tasks(user_id, offset + limit)
+                for shard in await self._user_shards(user_id)
+            )
+        )
+        tasks = heapq.nlargest(
+            offset + limit,
+            (task for tasks in results for task in tasks),
+            key=lambda task: (task.completed_at or "", task.id),
+        )
+        return tasks[offset:]
+
+    # Background jobs: every shard does its part concurrently
+
+    async def fetch_digest_tasks(self, until_day: date) -> dict:
+        digests = {}
+        for shard_digests in await asyncio.gather(
+            *(shard.fetch_digest_tasks(until_day) for shard in self.shards)
+        ):
+            for user_id, tasks in shard_digests.items():
+                digests.setdefault(user_id, []).extend(tasks)
+        for tasks in digests.values():
+            tasks.sort(key=lambda task: (task.deadline, task.priority))
+        return digests
+
+    async def fetch_new_overdue_tasks(self, until: str) -> Union[dict, None]:
+        results = await asyncio.gather(
+            *(shard.fetch_new_overdue_tasks(until) for shard in self.shards)
+        )
+        if any(result is None for result in results):
+            return None
+        overdue = {}
+        for shard_overdue in results:
+            for user_id, tasks in shard_overdue.items():
+                overdue.setdefault(user_id, []).extend(tasks)
+        for tasks in overdue.values():
+            tasks.sort(key=lambda task: (task.deadline, task.priority, task.id))
+        return overdue
+
+    async def mark_overdue(self, until: str, task_ids: list, batch_size: int) -> int:
+        # Every shard, also those without notified tasks, flags its quiet ones
+        groups = self._group(task_ids)
+        return sum(
+            await asyncio.gather(
+                *(
+                    shard.mark_overdue(until, groups.get(shard, []), batch_size)
+                    for shard in self.shards
+                )
+            )
+        )
+
+    async def archive_tasks(self, older_than_days: int, batch_size: int) -> int:
+        return sum(
+            await asyncio.gather(
+                *(
+                    shard.archive_tasks(older_than_days, batch_size)
+                    for shard in self.shards
+                )
+            )
+        )
+
+    async def prune_changes(self, older_than: float, batch_size: int) -> int:
+        return sum(
+            await asyncio.gather(
+                *(db.prune_changes(older_than, batch_size) for db in self.databases)
+            )
+        )
+
+    # Each shard numbers its changes on its own, they are tailed per shard
+    # through change_logs()
+
+    async def fetch_changes(self, after_seq: int, limit: int) -> list:
+        logging.error("Changes are fetched per shard, see change_logs()")
+        return []
+
+    async def fetch_last_change_seq(self) -> Union[int, None]:
+        logging.error("Changes are fetched per shard, see change_logs()")
+        return None
+
+    async def fetch_change_fanout(
+        self, after_seq: int, until_seq: int
+    ) -> Union[dict, None]:
+        logging.error("Changes are fetched per shard, see change_logs()")
+        return None
+
+    # The outbox and watermarks, on the catalog
+
+    async def enqueue_notifications(self, notifications: list) -> bool:
+        return await self.catalog.enqueue_notifications(notifications)
+
+    async def fetch_outbox_batch(self, limit: int) -> list:
+        return await self.catalog.fetch_outbox_batch(limit)
+
+    async def mark_outbox_sent(self, outbox_id: int) -> bool:
+        return await self.catalog.mark_outbox_sent(outbox_id)
+
+    async def mark_outbox_retry(
+        self, outbox_id: int, not_before: Union[float, None], error: str
+    ) -> bool:
+        return await self.catalog.mark_outbox_retry(outbox_id, not_before, error)
+
+    async def prune_outbox(self, older_than: float) -> int:
+        return await self.catalog.prune_outbox(older_than)
+
+    async def fetch_watermark(self, name: str) -> Union[str, None]:
+        return await self.catalog.fetch_watermark(name)
+
+    async def set_watermark(self, name: str, value: str) -> bool:
+        return await self.catalog.set_watermark(name, value)
+
+
+async def _next(iterator: AsyncIterator):
+    try:
+        return await iterator.__anext__()
+    except StopAsyncIteration:
+        return None
@@ -0,0 +1,401 @@
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from contextvars import ContextVar
+from datetime import date
+from modules.libraries.models import Change, Project, Subtask, Task, User
+from modules.libraries.recurrence import (
+    Recurrence,
+    iter_occurrences,
+    parse_deadline,
+    format_deadline,
+)
+from typing import AsyncIterator, Union
+import logging
+
+CALENDAR_CACHE_SIZE = 1024
+TASK_STATUSES = {0: "in progress", 1: "completed"}
+# Telegram id of the user whose update is being handled, recorded as the actor
+# of every change written meanwhile. Background jobs leave it unset.
+current_actor: ContextVar[Union[int, None]] = ContextVar("current_actor", default=None)
+
+
+class Storage(ABC):
+    # Everything handlers and background jobs may ask of the database. Database
+    # (dbms.py) keeps the data in SQLite, PostgresDatabase (postgres.py) in
+    # PostgreSQL. Both return the same models, deadlines as "YYYY-MM-DD" and
+    # timestamps as "YYYY-MM-DD HH:MM:SS" UTC strings.
+
+    def __init__(self):
+        # (user_id, "YYYY-MM") -> {"YYYY-MM-DD": open tasks due that day}
+        self._calendar_cache = OrderedDict()
+
+    @abstractmethod
+    async def connect(self) -> None:
+        pass
+
+    def stats(self) -> dict:
+        return {"calendar_cache": len(self._calendar_cache)}
+
+    def change_logs(self) -> list:
+        # The storages whose change logs are tailed one by one, a seq orders
+        # the changes of one log only
+        return [self]
+
+    @abstractmethod
+    async def create_tables(self):
+        pass
+
+    @abstractmethod
+    async def close(self) -> None:
+        pass
+
+    @abstractmethod
+    async def add_user(self, user_id: int, user_name: str) -> bool:
+        pass
+
+    @abstractmethod
+    async def fetch_user(self, user_id: int) -> Union[User, None]:
+        pass
+
+    @abstractmethod
+    async def fetch_user_ids(self) -> list:
+        pass
+
+    @abstractmethod
+    async def fetch_user_by_name(self, user_name: str) -> Union[User, None]:
+        pass
+
+    @abstractmethod
+    async def update_user_names(self, user_names: list) -> bool:
+        pass
+
+    @abstractmethod
+    async def new_project(self, user_id: int, name: str, desc: str) -> bool:
+        pass
+
+    @abstractmethod
+    async def edit_project(
+        self, user_id: int, old_name: str, new_name: str, new_desc: str
+    ) -> bool:
+        pass
+
+    @abstractmethod
+    async def delete_project(self, project_id: int) -> bool:
+        pass
+
+    @abstractmethod
+    async def fetch_projects(self, user_id: int) -> list:
+        pass
+
+    @abstractmethod
+    async def fetch_project(self, project_id: int) -> Union[Project, None]:
+        pass
+
+    @abstractmethod
+    async def new_task(
+        self,
+        user_id: int,
+        project_id: int,
+        task_name: str,
+        task_description: str,
+        task_deadline: str,
+        priority: int,
+    ) -> bool:
+        pass
+
+    @abstractmethod
+    async def fetch_tasks(self, project_id: int) -> list:
+        pass
+
+    @abstractmethod
+    async def fetch_task(self, task_id: int) -> Union[Task, None]:
+        pass
+
+    @abstractmethod
+    async def user_has_tasks(self, user_id: int) -> bool:
+        pass
+
+    @abstractmethod
+    async def edit_task(self, task_id: int, progress: int) -> bool:
+        pass
+
+    @abstractmethod
+    async def edit_tasks(
+        self,
+        user_id: int,
+        progress: int,
+        task_ids: Union[list, None] = None,
+        project_id: Union[int, None] = None,
+    ) -> Union[list, None]:
+        pass
+
+    @abstractmethod
+    async def set_task_recurrence(self, task_id: int, rule: Union[str, None]) -> bool:
+        pass
+
+    @abstractmethod
+    async def remove_task(self, task_id: int) -> bool:
+        pass
+
+    @abstractmethod
+    async def add_subtask(self, task_id: int, name: str) -> bool:
+        pass
+
+    @abstractmethod
+    async def add_subtasks(self, task_id: int, names: list) -> bool:
+        pass
+
+    @abstractmethod
+    async def fetch_subtasks(self, project_id: int) -> list:
+        pass
+
+    @abstractmethod
+    async def fetch_subtask(self, subtask_id: int) -> Union[Subtask, None]:
+        pass
+
+    @abstractmethod
+    async def user_has_subtasks(self, user_id: int) -> bool:
+        pass
+
+    @abstractmethod
+    async def edit_subtask(self, subtask_id: int) -> bool:
+        pass
+
+    @abstractmethod
+    async def delete_subtask(self, subtask_id: int) -> bool:
+        pass
+
+    @abstractmethod
+    async def edit_subtasks(
+        self,
+        user_id: int,
+        subtask_ids: Union[list, None] = None,
+        project_id: Union[int, None] = None,
+        complete_tasks: bool = False,
+    ) -> Union[tuple, None]:
+        pass
+
+    @abstractmethod
+    async def add_shared_project(self, project_id: int, user_id: int) -> bool:
+        pass
+
+    @abstractmethod
+    async def fetch_shared_projects(self, user_id: int) -> list:
+        pass
+
+    @abstractmethod
+    async def check_project_member(self, project_id: int, user_id: int) -> bool:
+        pass
+
+    @abstractmethod
+    async def fetch_calendar_token(self, user_id: int) -> Union[str, None]:
+        pass
+
+    @abstractmethod
+    async def fetch_user_by_calendar_token(self, token: str) -> Union[int, None]:
+        pass
+
+    @abstractmethod
+    async def fetch_calendar_version(self, user_id: int) -> Union[tuple, None]:
+        pass
+
+    @abstractmethod
+    async def iter_calendar_tasks(self, user_id: int) -> AsyncIterator[Task]:
+        pass
+
+    @abstractmethod
+    async def fetch_notification_settings(self, user_id: int) -> Union[dict, None]:
+        pass
+
+    @abstractmethod
+    async def set_notification_settings(
+        self,
+        user_id: int,
+        notifications: Union[bool, None] = None,
+        digest: Union[bool, None] = None,
+    ) -> bool:
+        pass
+
+    @abstractmethod
+    async def fetch_digest_tasks(self, until_day: date) -> dict:
+        pass
+
+    @abstractmethod
+    async def enqueue_notifications(self, notifications: list) -> bool:
+        pass
+
+    @abstractmethod
+    async def fetch_outbox_batch(self, limit: int) -> list:
+        pass
+
+    @abstractmethod
+    async def mark_outbox_sent(self, outbox_id: int) -> bool:
+        pass
+
+    @abstractmethod
+    async def mark_outbox_retry(
+        self, outbox_id: int, not_before: Union[float, None], error: str
+    ) -> bool:
+        pass
+
+    @abstractmethod
+    async def prune_outbox(self, older_than: float) -> int:
+        pass
+
+    @abstractmethod
+    async def fetch_watermark(self, name: str) -> Union[str, None]:
+        pass
+
+    @abstractmethod
+    async def set_watermark(self, name: str, value: str) -> bool:
+        pass
+
+    @abstractmethod
+    async def fetch_new_overdue_tasks(self, until: str) -> Union[dict, None]:
+        pass
+
+    @abstractmethod
+    async def mark_overdue(self, until: str, task_ids: list, batch_size: int) -> int:
+        # Flags the tasks a sweep notified about and those due before until
+        # that no member is notified about
+        pass
+
+    @abstractmethod
+    async def fetch_changes(self, after_seq: int, limit: int) -> list:
+        # The change log in commit order, for tailing from the last seq seen
+        pass
+
+    @abstractmethod
+    async def fetch_last_change_seq(self) -> Union[int, None]:
+        pass
+
+    @abstractmethod
+    async def fetch_change_fanout(
+        self, after_seq: int, until_seq: int
+    ) -> Union[dict, None]:
+        pass
+
+    @abstractmethod
+    async def prune_changes(self, older_than: float, batch_size: int) -> int:
+        pass
+
+    @abstractmethod
+    async def archive_tasks(self, older_than_days: int, batch_size: int) -> int:
+        pass
+
+    @abstractmethod
+    async def fetch_archived_tasks(
+        self, user_id: int, limit: int, offset: int = 0
+    ) -> list:
+        pass
+
+    @abstractmethod
+    async def fetch_tasks_by_day(self, user_id: int, day: date) -> list:
+        pass
+
+    @abstractmethod
+    async def fetch_next_tasks(self, user_id: int, limit: int) -> list:
+        # Open tasks of owned and shared projects, most urgent first:
+        # priority 1 before 5, then the earliest deadline
+        pass
+
+    @abstractmethod
+    async def _fetch_deadline_rows(
+        self, user_id: int, first_day: date, last_day: date
+    ) -> Union[list, None]:
+        # (deadline, recurrence, open task count) rows, None if the query failed
+        pass
+
+    async def fetch_deadline_counts(
+        self, user_id: int, first_day: date, last_day: date
+    ) -> dict:
+        key = (user_id, first_day.strftime("%Y-%m"))
+        if key in self._calendar_cache:
+            self._calendar_cache.move_to_end(key)
+            return self._calendar_cache[key]
+
+        rows = await self._fetch_deadline_rows(user_id, first_day, last_day)
+        if rows is None:
+            return {}
+
+        counts = {}
+        for deadline, recurrence, count in rows:
+            for day in iter_occurrences(deadline, recurrence, first_day, last_day):
+                day = format_deadline(day)
+                counts[day] = counts.get(day, 0) + count
+
+        self._calendar_cache[key] = counts
+        if len(self._calendar_cache) > CALENDAR_CACHE_SIZE:
+            self._calendar_cache.popitem(last=False)
+        return counts
+
+    def _invalidate_calendar(
+        self,
+        deadline: Union[str, None] = None,
+        recurring: bool = False,
+        user_id: Union[int, None] = None,
+    ) -> None:
+        month = deadline[:7] if deadline else None
+        for key in list(self._calendar_cache):
+            cached_user_id, cached_month = key
+            if user_id is not None and cached_user_id != user_id:
+                continue
+            # A recurring series touches every month from its current deadline on
+            if (
+                month is None
+                or cached_month == month
+                or (recurring and cached_month >= month)
+            ):
+                del self._calendar_cache[key]
+
+    @staticmethod
+    def _next_deadlines(rows: list) -> list:
+        # rows: (id, deadline, recurrence). Completing a recurring task completes
+        # one occurrence and moves the series on, the task itself stays open.
+        # Occurrences missed meanwhile are skipped: the next deadline is the
+        # first one after today, never one that is overdue already.
+        # Returns (next deadline, id) pairs for the recurring rows.
+        advanced = []
+        today = date.today()
+        for task_id, deadline, rule in rows:
+            if not rule:
+                continue
+            current = parse_deadline(deadline)
+            next_deadline = format_deadline(
+                Recurrence.parse(rule).next_after(current, max(current, today))
+            )
+            advanced.append((next_deadline, task_id))
+            logging.info(
+                f"Completed occurrence {deadline} of recurring task with id {task_id}, next is {next_deadline}"
+            )
+        return advanced
+
+    @staticmethod
+    def _due_on(tasks: list, day: date) -> list:
+        # Recurring tasks are fetched by their first deadline, keep the ones
+        # that actually fall on the day
+        return [
+            task
+            for task in tasks
+            if any(iter_occurrences(task.deadline, task.recurrence, day, day))
+        ]
+
+
+def open_storage(url: str, shards: int = 1) -> Storage:
+    # postgresql://... selects PostgreSQL, anything else is a SQLite file path,
+    # split into shard files when there is more than one shard
+    if url.startswith(("postgres://", "postgresql://")):
+        if shards > 1:
+            raise ValueError("Only SQLite databases are sharded")
+        from modules.libraries.postgres import PostgresDatabase
+
+        return PostgresDatabase(url)
+
+    if shards > 1:
+        from modules.libraries.shards import ShardedDatabase
+
+        return ShardedDatabase(url, shards)
+
+    from modules.libraries.dbms import Database
+
+    return Database(url)
@@ -1,4 +1,5 @@
-import random, string
+import calendar, os, random, string
+from datetime import date, time
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 from aiogram.fsm.state import State, StatesGroup
 from modules.libraries.dbms import Database
@@ -6,6 +7,102 @@ from modules.libraries.dbms import Database
 
 class const:
     DATABASE_NAME = "database/prodigy_bot.db"
+    # A postgresql:// URL switches storage to PostgreSQL (needs asyncpg)
+    DATABASE_URL = os.getenv("DATABASE_URL", DATABASE_NAME)
+    # More than one splits a SQLite database into shard files by project owner;
+    # an existing file is split with python -m modules.libraries.reshard
+    DATABASE_SHARDS = int(os.getenv("DATABASE_SHARDS", "1"))
+    # Another Bot API server, e.g. benchmarks/fake_telegram.py, None for Telegram's
+    TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+    RECURRENCE_VIEW_DAYS = 60
+    RECURRENCE_VIEW_LIMIT = 3
+    CALENDAR_FEED_HOST = "127.0.0.1"
+    CALENDAR_FEED_PORT = 8080
+    CALENDAR_FEED_URL = "http://127.0.0.1:8080"
+    MONTH_NAMES = [
+        "Январь",
+        "Февраль",
+        "Март",
+        "Апрель",
+        "Май",
+        "Июнь",
+        "Июль",
+        "Август",
+        "Сентябрь",
+        "Октябрь",
+        "Ноябрь",
+        "Декабрь",
+    ]
+    WEEKDAY_NAMES = ["Пн", "Вт", "Ср", "Чт", "Пт", "Сб", "Вс"]
+    DIGEST_SEND_AT = time(9, 0)
+    DIGEST_WINDOW = 30 * 60
+    OUTBOX_BATCH_SIZE = 50
+    # command class -> (burst capacity, tokens refilled per second)
+    THROTTLE_RATES = {
+        "read": (3, 0.2),
+        "write": (5, 0.5),
+        "input": (10, 1.0),
+    }
+    THROTTLE_MAX_BUCKETS = 10000
+    THROTTLE_IDLE_TTL = 10 * 60
+    CONCURRENCY_LIMIT = 16
+    ADMISSION_QUEUE_SIZE = 256
+    # lower priority is shed first when the admission queue is full
+    UPDATE_PRIORITIES = {"read": 0, "write": 1, "input": 2}
+    USERNAME_BATCH_SIZE = 100
+    USERNAME_FLUSH_INTERVAL = 60
+    SUBTASK_BATCH_LIMIT = 50
+    BULK_EDIT_LIMIT = 500
+    # Completing the last open subtask completes its task as well
+    AUTO_COMPLETE_TASKS = True
+    ARCHIVE_AFTER_DAYS = 30
+    ARCHIVE_BATCH_SIZE = 500
+    ARCHIVE_INTERVAL = 6 * 60 * 60
+    ARCHIVE_VIEW_LIMIT = 20
+    NEXT_TASKS_DEFAULT = 5
+    NEXT_TASKS_LIMIT = 50
+    OVERDUE_SWEEP_INTERVAL = 15 * 60
+    OVERDUE_BATCH_SIZE = 500
+    # Tasks listed in one overdue notification, the rest are only counted
+    OVERDUE_NOTIFY_LIMIT = 20
+    BACKUP_DIRECTORY = "database/backups"
+    BACKUP_INTERVAL = 6 * 60 * 60
+    BACKUP_KEEP = 7
+    BACKUP_COMPRESS = True
+    # Pages copied per backup step and the pause between steps, in seconds
+    BACKUP_PAGES = 256
+    BACKUP_SLEEP = 0.005
+    # Changes older than this are pruned, an entity's latest change is kept
+    CHANGES_RETENTION = 7 * 24 * 60 * 60
+    CHANGES_PRUNE_BATCH_SIZE = 1000
+    CHANGES_PRUNE_INTERVAL = 60 * 60
+    # Changes by other members within a window go out as one message
+    CHANGE_NOTIFY_WINDOW = 60
+    CHANGE_NOTIFY_BATCH_SIZE = 5000
+    # Change notifications enqueued per second, and lines in one of them
+    CHANGE_NOTIFY_RATE = 10
+    CHANGE_NOTIFY_LIMIT = 20
+    LOG_DIRECTORY = ".logs"
+    LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO")
+    # Dotted module or logger name -> level, the longest matching prefix wins
+    LOG_LEVELS = {"aiogram.event": "WARNING"}
+    # Only 1 in N records below WARNING from each call site of these modules
+    # is kept, the per-query lines of the database layer are the bulk of the log
+    LOG_SAMPLING = {"modules.libraries.dbms": 10, "modules.libraries.postgres": 10}
+    LOG_MAX_BYTES = 10 * 1024 * 1024
+    LOG_BACKUPS = 10
+    LOG_ROTATE_INTERVAL = 24 * 60 * 60
+    LOG_QUEUE_SIZE = 10000
+    # Seconds the updates being handled get to finish on shutdown
+    SHUTDOWN_TIMEOUT = 30
+    # Dialogs in progress are kept here between a shutdown and the next start
+    FSM_STATE_PATH = "database/fsm_state.pickle"
+    # Telegram user ids allowed to run /debug_memory, e.g. ADMIN_IDS=1,2
+    ADMIN_IDS = {
+        int(user_id) for user_id in os.getenv("ADMIN_IDS", "").split(",") if user_id
+    }
+    # Allocation sites listed by /debug_memory when tracemalloc is tracing
+    DEBUG_MEMORY_TOP = 10
 
 
 class _Kbs:
@@ -16,6 +113,72 @@ class _Kbs:
 
         return InlineKeyboardMarkup(inline_keyboard=kb)
 
+    @staticmethod
+    def get_notifications_kb(settings: dict) -> InlineKeyboardMarkup:
+        kb = [
+            [
+                InlineKeyboardButton(
+                    text=f"{'🔔' if settings['notifications'] else '🔕'} Уведомления",
+                    callback_data="notifications_toggle",
+                )
+            ],
+            [
+                InlineKeyboardButton(
+                    text=f"{'✅' if settings['digest'] else '⬜'} Ежедневная сводка",
+                    callback_data="digest_toggle",
+                )
+            ],
+        ]
+
+        return InlineKeyboardMarkup(inline_keyboard=kb)
+
+    @staticmethod
+    def get_calendar_kb(year: int, month: int, counts: dict) -> InlineKeyboardMarkup:
+        prev_year, prev_month = (year, month - 1) if month > 1 else (year - 1, 12)
+        next_year, next_month = (year, month + 1) if month < 12 else (year + 1, 1)
+
+        kb = [
+            [
+                InlineKeyboardButton(
+                    text=f"{const.MONTH_NAMES[month - 1]} {year}",
+                    callback_data="cal_noop",
+                )
+            ],
+            [
+                InlineKeyboardButton(text=day, callback_data="cal_noop")
+                for day in const.WEEKDAY_NAMES
+            ],
+        ]
+
+        for week in calendar.monthcalendar(year, month):
+            row = []
+            for day in week:
+                if day == 0:
+                    row.append(InlineKeyboardButton(text=" ", callback_data="cal_noop"))
+                    continue
+                day_iso = date(year, month, day).isoformat()
+                count = counts.get(day_iso)
+                row.append(
+                    InlineKeyboardButton(
+                        text=f"{day}·{count}" if count else str(day),
+                        callback_data=f"cal_day:{day_iso}",
+                    )
+                )
+            kb.append(row)
+
+        kb.append(
+            [
+                InlineKeyboardButton(
+                    text="«", callback_data=f"cal:{prev_year}-{prev_month:02d}"
+                ),
+                InlineKeyboardButton(
+                    text="»", callback_data=f"cal:{next_year}-{next_month:02d}"
+                ),
+            ]
+        )
+
+        return InlineKeyboardMarkup(inline_keyboard=kb)
+
 
 class _States:
 
@@ -45,6 +208,10 @@ class _States:
     class DeleteTask(StatesGroup):
         task_id = State()
 
+    class RepeatTask(StatesGroup):
+        task_id = State()
+        rule = State()
+
     class NewSubTask(StatesGroup):
         task_id = State()
         subtask_name = State()
@@ -0,0 +1,365 @@
+from aiogram import BaseMiddleware, types
+from array import array
+from bisect import bisect_left
+from collections import Counter, OrderedDict
+from modules.libraries.storage import Storage, current_actor
+from typing import Any, Awaitable, Callable, Dict, Union
+import asyncio, heapq, itertools, logging, time
+
+READ_COMMANDS = {
+    "projects",
+    "calendar",
+    "calendar_feed",
+    "notifications",
+    "archive",
+    "next",
+    "help",
+    "info",
+    "start",
+}
+READ_CALLBACKS = {"projects", "calendar_feed", "archive", "next", "cal_noop"}
+READ_CALLBACK_PREFIXES = ("cal:", "cal_day:")
+
+
+def command_class(event: Union[types.Message, types.CallbackQuery], raw_state) -> str:
+    # "read": heavy listings, "write": commands that start a mutation,
+    # "input": text typed into an FSM dialog
+    if isinstance(event, types.CallbackQuery):
+        data = event.data or ""
+        if data in READ_CALLBACKS or data.startswith(READ_CALLBACK_PREFIXES):
+            return "read"
+        return "write"
+
+    text = event.text or ""
+    if text.startswith("/"):
+        parts = text[1:].split(maxsplit=1)
+        command = parts[0].split("@")[0].lower() if parts else ""
+        return "read" if command in READ_COMMANDS else "write"
+    if raw_state is not None:
+        return "input"
+    return "read"
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated", "notified_until")
+
+    def __init__(self, capacity: float, now: float):
+        self.tokens = capacity
+        self.updated = now
+        self.notified_until = 0.0
+
+
+class ThrottlingMiddleware(BaseMiddleware):
+    def __init__(
+        self,
+        rates: Dict[str, tuple],
+        max_buckets: int = 10000,
+        idle_ttl: float = 10 * 60,
+    ):
+        # rates: command class -> (capacity, tokens refilled per second)
+        self._rates = rates
+        self._max_buckets = max_buckets
+        self._idle_ttl = idle_ttl
+        self._buckets = OrderedDict()
+        self.passed = Counter()
+        self.rejected = Counter()
+
+    async def __call__(
+        self,
+        handler: Callable[[types.TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: types.TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is None:
+            return await handler(event, data)
+
+        klass = command_class(event, data.get("raw_state"))
+        capacity, refill = self._rates[klass]
+        now = time.monotonic()
+        bucket = self._bucket((user.id, klass), capacity, now)
+
+        bucket.tokens = min(capacity, bucket.tokens + (now - bucket.updated) * refill)
+        bucket.updated = now
+
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            self.passed[klass] += 1
+            return await handler(event, data)
+
+        self.rejected[klass] += 1
+        retry_in = (1 - bucket.tokens) / refill
+        if now >= bucket.notified_until:
+            # One warning per window, later rejections are dropped silently
+            bucket.notified_until = now + retry_in
+            logging.info(f"Throttled {klass} update of user with id {user.id}")
+            await self._notify(event, retry_in)
+        return None
+
+    def _bucket(self, key: tuple, capacity: float, now: float) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            self._buckets.move_to_end(key)
+            return bucket
+
+        # Buckets are kept in recency order, so idle and overflowing ones sit at the front
+        while self._buckets:
+            oldest = next(iter(self._buckets.values()))
+            if (
+                len(self._buckets) < self._max_buckets
+                and now - oldest.updated < self._idle_ttl
+            ):
+                break
+            self._buckets.popitem(last=False)
+
+        bucket = self._buckets[key] = TokenBucket(capacity, now)
+        return bucket
+
+    async def _notify(
+        self, event: Union[types.Message, types.CallbackQuery], retry_in: float
+    ) -> None:
+        text = (
+            f"Слишком много запросов. Попробуйте через {max(1, round(retry_in))} сек."
+        )
+        try:
+            # Message.answer replies in chat, CallbackQuery.answer shows a toast
+            await event.answer(text)
+        except Exception as e:
+            logging.error(f"Error occurred while sending throttling notice: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "buckets": len(self._buckets),
+            "passed": dict(self.passed),
+            "rejected": dict(self.rejected),
+        }
+
+
+class ConcurrencyMiddleware(BaseMiddleware):
+    def __init__(self, limit: int, queue_size: int, priorities: Dict[str, int]):
+        # priorities: command class -> priority, lower values are shed first
+        self._limit = limit
+        self._queue_size = queue_size
+        self._priorities = priorities
+        self._active = 0
+        self._waiters = []
+        self._order = itertools.count()
+        # Set while no update is being handled or waiting to be
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self.admitted = 0
+        self.shed = Counter()
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    async def __call__(
+        self,
+        handler: Callable[[types.TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: types.TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        klass = command_class(event, data.get("raw_state"))
+        started = time.monotonic()
+
+        if not await self._acquire(self._priorities[klass]):
+            self.shed[klass] += 1
+            logging.warning(
+                f"Shed {klass} update, {len(self._waiters)} updates are waiting"
+            )
+            await self._notify(event)
+            return None
+
+        waited = time.monotonic() - started
+        self.admitted += 1
+        self.wait_total += waited
+        self.wait_max = max(self.wait_max, waited)
+
+        try:
+            return await handler(event, data)
+        finally:
+            self._release()
+
+    async def _acquire(self, priority: int) -> bool:
+        if self._active < self._limit and not self._waiters:
+            self._active += 1
+            self._idle.clear()
+            return True
+
+        if len(self._waiters) >= self._queue_size:
+            # The newest of the lowest-priority waiters makes room, unless the
+            # incoming update is not more important than it
+            victim = max(self._waiters)
+            if -victim[0] >= priority:
+                return False
+            self._waiters.remove(victim)
+            heapq.heapify(self._waiters)
+            victim[2].set_result(False)
+
+        waiter = asyncio.get_running_loop().create_future()
+        entry = (-priority, next(self._order), waiter)
+        heapq.heappush(self._waiters, entry)
+        try:
+            return await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled() and waiter.result():
+                self._release()
+            elif entry in self._waiters:
+                self._waiters.remove(entry)
+                heapq.heapify(self._waiters)
+            raise
+
+    def _release(self) -> None:
+        # The slot is handed straight to the most important waiter
+        while self._waiters:
+            _, _, waiter = heapq.heappop(self._waiters)
+            if not waiter.done():
+                waiter.set_result(True)
+                return
+        self._active -= 1
+        if not self._active:
+            self._idle.set()
+
+    async def drain(self, timeout: float) -> bool:
+        # Waits for the updates being handled and the queued ones, False if
+        # some are still running after timeout
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            return False
+        return True
+
+    async def _notify(self, event: Union[types.Message, types.CallbackQuery]) -> None:
+        try:
+            await event.answer("Бот сейчас перегружен. Попробуйте чуть позже.")
+        except Exception as e:
+            logging.error(f"Error occurred while sending load shedding notice: {e}")
+
+    def stats(self) -> dict:
+        return {
+            "active": self._active,
+            "queue_depth": len(self._waiters),
+            "admitted": self.admitted,
+            "shed": dict(self.shed),
+            "wait_avg": self.wait_total / self.admitted if self.admitted else 0.0,
+            "wait_max": self.wait_max,
+        }
+
+
+class UsernameMiddleware(BaseMiddleware):
+    def __init__(
+        self,
+        db: Storage,
+        batch_size: int = 100,
+        flush_interval: float = 60,
+        max_known: int = 100000,
+    ):
+        self._db = db
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._max_known = max_known
+        self._known = OrderedDict()
+        self._pending = {}
+        self._last_flush = time.monotonic()
+
+    async def __call__(
+        self,
+        handler: Callable[[types.TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: types.TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is not None and user.username:
+            self._track(user.id, user.username)
+
+        if self._pending and (
+            len(self._pending) >= self._batch_size
+            or time.monotonic() - self._last_flush >= self._flush_interval
+        ):
+            await self.flush()
+
+        return await handler(event, data)
+
+    def _track(self, user_id: int, user_name: str) -> None:
+        # Only names that differ from the last one seen are queued for a write
+        if self._known.get(user_id) == user_name:
+            self._known.move_to_end(user_id)
+            return
+        self._known[user_id] = user_name
+        self._known.move_to_end(user_id)
+        if len(self._known) > self._max_known:
+            self._known.popitem(last=False)
+        self._pending[user_id] = user_name
+
+    async def flush(self) -> None:
+        pending, self._pending = self._pending, {}
+        self._last_flush = time.monotonic()
+        if pending and not await self._db.update_user_names(list(pending.items())):
+            for user_id, user_name in pending.items():
+                self._pending.setdefault(user_id, user_name)
+
+    def stats(self) -> dict:
+        return {"known": len(self._known), "pending": len(self._pending)}
+
+
+class KnownUsers:
+    # Sorted array of 8-byte ids plus a small set of recent additions, merged
+    # once it grows, instead of a set of int objects per user
+    def __init__(self, merge_threshold: int = 1024):
+        self._ids = array("q")
+        self._recent = set()
+        self._merge_threshold = merge_threshold
+
+    def __contains__(self, user_id: int) -> bool:
+        if user_id in self._recent:
+            return True
+        index = bisect_left(self._ids, user_id)
+        return index < len(self._ids) and self._ids[index] == user_id
+
+    def __len__(self) -> int:
+        return len(self._ids) + len(self._recent)
+
+    def update(self, user_ids) -> None:
+        self._ids = array("q", sorted(set(self._ids).union(user_ids, self._recent)))
+        self._recent.clear()
+
+    def add(self, user_id: int) -> None:
+        self._recent.add(user_id)
+        if len(self._recent) >= self._merge_threshold:
+            self.update(())
+
+
+class RegistrationMiddleware(BaseMiddleware):
+    def __init__(self, db: Storage):
+        self._db = db
+        self._known = KnownUsers()
+        self._loaded = False
+        self.registered = 0
+
+    async def load(self) -> None:
+        self._known.update(await self._db.fetch_user_ids())
+        self._loaded = True
+        logging.info(f"Loaded {len(self._known)} registered users")
+
+    async def __call__(
+        self,
+        handler: Callable[[types.TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: types.TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = data.get("event_from_user")
+        if user is not None:
+            # Changes written while handling the update are logged as the user's
+            current_actor.set(user.id)
+        if user is not None and user.id not in self._known:
+            if not self._loaded:
+                await self.load()
+            if user.id not in self._known and await self._db.add_user(
+                user.id, user.username
+            ):
+                self._known.add(user.id)
+                self.registered += 1
+
+        return await handler(event, data)
+
+    def stats(self) -> dict:
+        return {"known": len(self._known), "registered": self.registered}
@@ -3,6 +3,7 @@ from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
 from aiogram.filters import CommandStart, Command
 from modules.handlers import (
+    handlers,
     start_handler,
     info_handler,
     new_project_handler,
@@ -12,16 +13,57 @@ from modules.handlers import (
     new_task_handler,
     edit_task_handler,
     delete_task_handler,
+    repeat_task_handler,
+    archive_handler,
+    next_tasks_handler,
+    calendar_handler,
+    calendar_feed_handler,
     new_subtask_handler,
     edit_subtask_handler,
     delete_subtask_handler,
     share_project_handler,
+    notifications_handler,
+    debug_memory_handler,
+)
+from modules.libraries.memory import watch
+from modules.libraries.utils import const, _States
+from modules.middlewares.middlewares import (
+    ThrottlingMiddleware,
+    ConcurrencyMiddleware,
+    RegistrationMiddleware,
+    UsernameMiddleware,
 )
-from modules.libraries.utils import _States
 from typing import Union
 
 router = Router()
 
+throttling_middleware = ThrottlingMiddleware(
+    const.THROTTLE_RATES,
+    max_buckets=const.THROTTLE_MAX_BUCKETS,
+    idle_ttl=const.THROTTLE_IDLE_TTL,
+)
+concurrency_middleware = ConcurrencyMiddleware(
+    const.CONCURRENCY_LIMIT, const.ADMISSION_QUEUE_SIZE, const.UPDATE_PRIORITIES
+)
+registration_middleware = RegistrationMiddleware(handlers._db)
+username_middleware = UsernameMiddleware(
+    handlers._db,
+    batch_size=const.USERNAME_BATCH_SIZE,
+    flush_interval=const.USERNAME_FLUSH_INTERVAL,
+)
+router.message.outer_middleware(throttling_middleware)
+router.message.outer_middleware(concurrency_middleware)
+router.message.outer_middleware(registration_middleware)
+router.message.outer_middleware(username_middleware)
+router.callback_query.outer_middleware(throttling_middleware)
+router.callback_query.outer_middleware(concurrency_middleware)
+router.callback_query.outer_middleware(registration_middleware)
+router.callback_query.outer_middleware(username_middleware)
+watch("throttling", throttling_middleware.stats)
+watch("admission", concurrency_middleware.stats)
+watch("registration", registration_middleware.stats)
+watch("usernames", username_middleware.stats)
+
 
 @router.message(CommandStart())
 async def start_handler_command(message: types.Message):
@@ -98,6 +140,54 @@ async def delete_task_handler_func(
     await delete_task_handler.handle(type, state)
 
 
+@router.callback_query(F.data == "repeat_task")
+@router.message(Command("repeat_task"))
+@router.message(_States.RepeatTask.task_id)
+@router.message(_States.RepeatTask.rule)
+async def repeat_task_handler_func(
+    type: Union[types.Message, types.CallbackQuery], state: FSMContext
+):
+    await repeat_task_handler.handle(type, state)
+
+
+@router.callback_query(F.data == "cal_noop")
+async def calendar_noop_handler_func(callback_query: types.CallbackQuery):
+    await callback_query.answer()
+
+
+@router.callback_query(F.data.startswith("cal:"))
+@router.callback_query(F.data.startswith("cal_day:"))
+@router.message(Command("calendar"))
+async def calendar_handler_func(
+    type: Union[types.Message, types.CallbackQuery], state: FSMContext
+):
+    await calendar_handler.handle(type, state)
+
+
+@router.callback_query(F.data == "calendar_feed")
+@router.message(Command("calendar_feed"))
+async def calendar_feed_handler_func(
+    type: Union[types.Message, types.CallbackQuery], state: FSMContext
+):
+    await calendar_feed_handler.handle(type, state)
+
+
+@router.callback_query(F.data == "archive")
+@router.message(Command("archive"))
+async def archive_handler_func(
+    type: Union[types.Message, types.CallbackQuery], state: FSMContext
+):
+    await archive_handler.handle(type, state)
+
+
+@router.callback_query(F.data == "next")
+@router.message(Command("next"))
+async def next_tasks_handler_func(
+    type: Union[types.Message, types.CallbackQuery], state: FSMContext
+):
+    await next_tasks_handler.handle(type, state)
+
+
 @router.callback_query(F.data == "new_subtask")
 @router.message(Command("new_subtask"))
 @router.message(_States.NewSubTask.task_id)
@@ -136,6 +226,21 @@ async def share_project_handler_func(
     await share_project_handler.handle(type, state)
 
 
+@router.callback_query(F.data.in_({"notifications_toggle", "digest_toggle"}))
+@router.message(Command("notifications"))
+async def notifications_handler_func(
+    type: Union[types.Message, types.CallbackQuery], state: FSMContext
+):
+    await notifications_handler.handle(type, state)
+
+
+@router.message(Command("debug_memory"))
+async def debug_memory_handler_func(
+    type: Union[types.Message, types.CallbackQuery], state: FSMContext
+):
+    await debug_memory_handler.handle(type, state)
+
+
 @router.message(Command(commands=["help", "info"]))
 async def info_handler_func(
     type: Union[types.Message, types.CallbackQuery], state: FSMContext